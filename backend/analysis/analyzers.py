@@ -0,0 +1,573 @@
+"""
+数据分析器
+
+分析器以一次只取所需列的查询读取实验曲线（见 experiments.storage.TraceStore），
+之后全部计算在连续的 NumPy 数组上向量化完成。
+
+每个分析器提供三层接口：
+- analyze(experiment, parameters)：读取实验数据并返回可存入 JSONField 的结果；
+- compute(data, parameters)：在列数组字典上计算结果，供已持有数据的调用方复用；
+- run(data, parameters)：返回 (输出列数组, 结果)。平滑、基线校正等处理类分析器的输出为
+  处理后的列数组（另可单独调用 transform），其余分析器原样返回输入，供分析流水线串联。
+
+平滑、基线校正和积分另提供 stream(source, parameters)，在分块来源（见 analysis.streaming）上
+分窗口处理，内存占用与曲线长度无关。数据点数不少于 ANALYSIS_STREAMING_MIN_POINTS 时
+analyze 自动使用流式计算；逐点输出与 compute 完全相同，汇总统计量只有浮点舍入上的差别。
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from scipy import ndimage, signal, stats
+from scipy.integrate import cumulative_trapezoid
+
+from experiments.pyramid import downsample_columns
+from experiments.segments import sweep_at
+from .streaming import (
+    ChunkSource, CurveSampler, RunningStats, get_window_points, median_from_ranks, median_ranks,
+    select_ranks, windows,
+)
+
+# 结果中附带的处理后曲线的最大点数
+CURVE_MAX_POINTS = 2000
+# 峰值检测前将曲线分块平均到的目标点数
+DETECTION_POINTS = 4000
+# 基线多项式拟合逐块累积的块大小
+FIT_BLOCK_POINTS = 65536
+# 数据点数不少于该值时使用流式计算，0 表示不使用
+DEFAULT_STREAMING_MIN_POINTS = 2000000
+
+
+def estimate_noise(values):
+    """由一阶差分的中位数绝对偏差估计白噪声标准差"""
+    if len(values) < 3:
+        return 0.0
+    diff = np.diff(values)
+    mad = np.median(np.abs(diff - np.median(diff)))
+    return float(mad * 1.4826 / math.sqrt(2))
+
+
+def estimate_noise_stream(open_diffs, groups):
+    """
+    多组一阶差分的 estimate_noise，每组差分只需可重复遍历，内存占用有上限
+
+    open_diffs() 每次返回产出 (组号, 差分数组) 的新生成器；groups 为各组 (差分个数, 最小值, 最大值)。
+    """
+    counts = [count for count, minimum, maximum in groups]
+    medians = [
+        median_from_ranks(count, values) if count else 0.0
+        for count, values in zip(counts, select_ranks(
+            open_diffs, counts, [median_ranks(count) for count in counts],
+            [minimum for count, minimum, maximum in groups], [maximum for count, minimum, maximum in groups],
+        ))
+    ]
+    deviations = select_ranks(
+        lambda: ((group, np.abs(diff - medians[group])) for group, diff in open_diffs()),
+        counts, [median_ranks(count) for count in counts], [0.0] * len(groups),
+        [max(maximum - median, median - minimum) for (count, minimum, maximum), median in zip(groups, medians)],
+    )
+    return [
+        float(median_from_ranks(count, values) * 1.4826 / math.sqrt(2)) if count >= 2 else 0.0
+        for count, values in zip(counts, deviations)
+    ]
+
+
+def linspace_slice(start, stop, num, low, high):
+    """np.linspace(start, stop, num)[low:high]，逐元素结果与 np.linspace 相同"""
+    div = num - 1
+    values = np.arange(low, high, dtype=float)
+    if div > 0:
+        step = (stop - start) / div
+        values = values / div * (stop - start) if step == 0 else values * step
+    values += start
+    if high == num and num > 1 and high > low:
+        values[-1] = stop
+    return values
+
+
+def _offsets(source):
+    """为分块来源的各块附上起始位置"""
+    start = 0
+    for columns in source:
+        yield start, columns
+        start += len(columns['current'])
+
+
+def curve(data, max_points=CURVE_MAX_POINTS):
+    """将曲线降采样为适合存储和绘图的点列表"""
+    columns = downsample_columns({'voltage': data['voltage'], 'current': data['current']}, max_points)
+    return {'voltage': columns['voltage'].tolist(), 'current': columns['current'].tolist()}
+
+
+class BaseAnalyzer:
+    """分析器基类，子类实现 compute 或 run 之一；streaming 为真的子类另实现 stream"""
+    analysis_type = None
+    columns = ('voltage', 'current')
+    streaming = False
+
+    def load(self, experiment):
+        """读取分析所需的列"""
+        return experiment.trace.read(list(self.columns))
+
+    def analyze(self, experiment, parameters=None):
+        if self.streaming and self.use_streaming(experiment):
+            return self.stream(ChunkSource.from_store(experiment.trace, self.columns), parameters or {})
+        return self.compute(self.load(experiment), parameters or {})
+
+    def use_streaming(self, experiment):
+        """数据点数不少于 ANALYSIS_STREAMING_MIN_POINTS（为 0 时不使用）时按分块流式计算"""
+        min_points = getattr(settings, 'ANALYSIS_STREAMING_MIN_POINTS', DEFAULT_STREAMING_MIN_POINTS)
+        return bool(min_points) and experiment.data_points_count >= min_points
+
+    def compute(self, data, parameters):
+        return self.run(data, parameters)[1]
+
+    def run(self, data, parameters):
+        return data, self.compute(data, parameters)
+
+
+class SmoothingAnalyzer(BaseAnalyzer):
+    """平滑滤波：savgol（默认）、moving_average、gaussian"""
+    analysis_type = 'smoothing'
+    streaming = True
+
+    def filter(self, parameters, length):
+        """
+        返回 (滤波函数, 单侧所需邻点数)
+
+        窗口长度按整条曲线的点数限制，分窗口计算时与整段计算使用相同的滤波器。
+        """
+        method = parameters.get('method', 'savgol')
+        if method == 'savgol':
+            window = int(parameters.get('window_length', 11))
+            window = min(window | 1, length - (1 - length % 2))
+            polyorder = min(int(parameters.get('polyorder', 3)), window - 1)
+            return lambda current: signal.savgol_filter(current, window, polyorder), window
+        if method == 'moving_average':
+            # 以卷积计算，各点结果只取决于邻点，与计算起点无关（uniform_filter1d 的累加和则不然）
+            size = int(parameters.get('window_length', 11))
+            weights = np.full(size, 1.0 / size)
+            return lambda current: ndimage.correlate1d(current, weights, mode='nearest'), size
+        if method == 'gaussian':
+            sigma = float(parameters.get('sigma', 2.0))
+            return lambda current: ndimage.gaussian_filter1d(current, sigma, mode='nearest'), int(4 * sigma + 0.5) + 1
+        raise ValueError(f"Unknown smoothing method: {method}")
+
+    def transform(self, data, parameters):
+        current = data['current']
+        if len(current) < 3:
+            smoothed = current.copy()
+        else:
+            smoothed = self.filter(parameters, len(current))[0](current)
+        return dict(data, current=smoothed)
+
+    def run(self, data, parameters):
+        smoothed = self.transform(data, parameters)
+        residual = data['current'] - smoothed['current']
+        return smoothed, {
+            'method': parameters.get('method', 'savgol'),
+            'data_points_count': len(residual),
+            'residual_std': float(residual.std()) if len(residual) else 0.0,
+            'noise_before': estimate_noise(data['current']),
+            'noise_after': estimate_noise(smoothed['current']),
+            'curve': curve(smoothed, int(parameters.get('max_points', CURVE_MAX_POINTS))),
+        }
+
+    def stream(self, source, parameters):
+        length = len(source)
+        if length <= get_window_points():
+            return self.compute(source.read(), parameters)
+        smooth, overlap = self.filter(parameters, length)
+
+        def pieces():
+            """
+            按顺序产出各窗口有效区间内的 (原始列数组, 平滑后的电流, [原始电流差分, 平滑后电流差分])
+
+            差分以上一段的末尾值为前值，各段差分首尾相接即为整条曲线的 np.diff。
+            """
+            previous = None
+            for start, window, low, high in windows(source, overlap):
+                columns = {name: values[low:high] for name, values in window.items()}
+                smoothed = smooth(window['current'])[low:high]
+                series = (columns['current'], smoothed)
+                yield columns, smoothed, [
+                    np.diff(values) if previous is None else np.diff(values, prepend=last)
+                    for values, last in zip(series, previous or series)
+                ]
+                previous = tuple(values[-1:] for values in series)
+
+        residual = RunningStats()
+        ranges = [RunningStats(), RunningStats()]
+        sampler = CurveSampler(length, int(parameters.get('max_points', CURVE_MAX_POINTS)))
+        for columns, smoothed, diffs in pieces():
+            residual.add(columns['current'] - smoothed)
+            sampler.add(dict(columns, current=smoothed))
+            for running, diff in zip(ranges, diffs):
+                running.add(diff)
+
+        noise_before, noise_after = estimate_noise_stream(
+            lambda: ((group, diff) for columns, smoothed, diffs in pieces() for group, diff in enumerate(diffs)),
+            [(length - 1, running.minimum, running.maximum) for running in ranges],
+        )
+        return {
+            'method': parameters.get('method', 'savgol'),
+            'data_points_count': length,
+            'residual_std': float(residual.std),
+            'noise_before': noise_before,
+            'noise_after': noise_after,
+            'curve': sampler.finish(),
+        }
+
+
+class BaselineCorrectionAnalyzer(BaseAnalyzer):
+    """
+    基线校正
+
+    linear：连接首尾两点的直线；
+    polynomial（默认）：迭代多项式拟合，每次将信号截断到拟合值以下后重新拟合，
+    使基线贴合信号底部而不受峰的影响。
+    """
+    analysis_type = 'baseline_correction'
+    streaming = True
+
+    def baseline(self, current, parameters):
+        method = parameters.get('method', 'polynomial')
+        length = len(current)
+        if length < 2:
+            return np.zeros(length)
+
+        if method == 'linear':
+            return np.linspace(current[0], current[-1], length)
+        if method != 'polynomial':
+            raise ValueError(f"Unknown baseline method: {method}")
+
+        coefficients = self.fit(lambda: (
+            (start, current[start:start + FIT_BLOCK_POINTS]) for start in range(0, length, FIT_BLOCK_POINTS)
+        ), length, parameters, targets={})
+        return self.polynomial(coefficients, length, 0, length)
+
+    def polynomial(self, coefficients, length, start, stop):
+        """拟合的基线在 [start, stop) 上的值，x 为 0 到 1 的等间距点；各点的值与计算范围无关"""
+        if coefficients is None:
+            return np.zeros(stop - start)
+        return np.polyval(coefficients, linspace_slice(0.0, 1.0, length, start, stop))
+
+    def fit(self, blocks, length, parameters, targets=None):
+        """
+        迭代多项式拟合，返回多项式系数，没有进行拟合时返回 None
+
+        blocks() 每次返回按顺序产出 (起始位置, 电流) 的新生成器，块大小为 FIT_BLOCK_POINTS。
+        每轮遍历以增广矩阵 [V | 目标] 的 QR 分解逐块累积最小二乘问题，同时计算上一次截断的
+        相对变化量。传入字典 targets 时保存各块截断后的目标；否则每轮由各次拟合值依次截断
+        重新得到，目标序列不占用内存。整段计算和流式计算按相同的块划分累加，结果完全相同。
+        """
+        degree = int(parameters.get('degree', 2))
+        max_iter = int(parameters.get('max_iter', 10))
+        tolerance = float(parameters.get('tolerance', 1e-3))
+
+        fits = []
+        for iteration in range(max_iter + 1):
+            r = np.zeros((0, degree + 2))
+            change_squares = target_squares = 0.0
+            for start, target in blocks():
+                stop = start + len(target)
+                if targets is not None and start in targets:
+                    target = targets[start]
+                else:
+                    for coefficients in fits[:-1]:
+                        target = np.minimum(target, self.polynomial(coefficients, length, start, stop))
+                if fits:
+                    clipped = np.minimum(target, self.polynomial(fits[-1], length, start, stop))
+                    change_squares += float(((clipped - target) ** 2).sum())
+                    target_squares += float((target ** 2).sum())
+                    target = clipped
+                if targets is not None:
+                    targets[start] = target
+                if iteration < max_iter:
+                    vander = np.vander(linspace_slice(0.0, 1.0, length, start, stop), degree + 1)
+                    r = np.linalg.qr(np.vstack([r, np.column_stack([vander, target])]), mode='r')
+
+            if fits and math.sqrt(change_squares) / (math.sqrt(target_squares) or 1.0) < tolerance:
+                break
+            if iteration == max_iter:
+                break
+            fits.append(np.linalg.lstsq(r[:degree + 1, :degree + 1], r[:degree + 1, degree + 1], rcond=None)[0])
+        return fits[-1] if fits else None
+
+    def transform(self, data, parameters):
+        return dict(data, current=data['current'] - self.baseline(data['current'], parameters))
+
+    def run(self, data, parameters):
+        baseline = self.baseline(data['current'], parameters)
+        corrected = dict(data, current=data['current'] - baseline)
+        return corrected, {
+            'method': parameters.get('method', 'polynomial'),
+            'data_points_count': len(baseline),
+            'baseline_mean': float(baseline.mean()) if len(baseline) else 0.0,
+            'baseline_range': [float(baseline.min()), float(baseline.max())] if len(baseline) else [0.0, 0.0],
+            'curve': curve(corrected, int(parameters.get('max_points', CURVE_MAX_POINTS))),
+        }
+
+    def stream(self, source, parameters):
+        length = len(source)
+        if length <= get_window_points():
+            return self.compute(source.read(), parameters)
+
+        method = parameters.get('method', 'polynomial')
+        if method == 'linear':
+            first = last = None
+            for columns in source:
+                if len(columns['current']):
+                    first = columns['current'][0] if first is None else first
+                    last = columns['current'][-1]
+            baseline = lambda start, stop: linspace_slice(first, last, length, start, stop)
+        elif method == 'polynomial':
+            coefficients = self.fit(lambda: (
+                (start + low, window['current'][low:high])
+                for start, window, low, high in windows(source, 0, FIT_BLOCK_POINTS)
+            ), length, parameters)
+            baseline = lambda start, stop: self.polynomial(coefficients, length, start, stop)
+        else:
+            raise ValueError(f"Unknown baseline method: {method}")
+
+        summary = RunningStats()
+        sampler = CurveSampler(length, int(parameters.get('max_points', CURVE_MAX_POINTS)))
+        for start, columns in _offsets(source):
+            values = baseline(start, start + len(columns['current']))
+            summary.add(values)
+            sampler.add(dict(columns, current=columns['current'] - values))
+        return {
+            'method': method,
+            'data_points_count': length,
+            'baseline_mean': summary.mean,
+            'baseline_range': [summary.minimum, summary.maximum],
+            'curve': sampler.finish(),
+        }
+
+
+class PeakDetectionAnalyzer(BaseAnalyzer):
+    """
+    峰值检测
+
+    在电流上检测阳极峰、在电流取反后检测阴极峰（scipy.signal.find_peaks）。
+    长曲线先按 block_size 个点（默认使曲线缩减到约 DETECTION_POINTS 个点）分块取平均，
+    在平均后的曲线上检测，既抑制噪声产生的伪峰，又使检测耗时与总点数基本无关；
+    峰的 index 为所在分块中心的原始位置。默认最小突出度为电流范围的5%；峰宽、峰面积按
+    半高处的左右边界计算，面积为扣除边界连线后的 ∫I dV。置信度由峰突出度与噪声水平之比得到。
+    analyze 另按实验的分段索引给出峰所在的扫描方向（sweep）。
+    """
+    analysis_type = 'peak_detection'
+
+    def analyze(self, experiment, parameters=None):
+        peaks = super().analyze(experiment, parameters)
+        segments = experiment.trace.segment_index()
+        for peak in peaks:
+            peak['sweep'] = sweep_at(segments, peak['index'])
+        return peaks
+
+    def compute(self, data, parameters):
+        voltage = data['voltage']
+        current = data['current']
+        length = len(current)
+        if length < 3:
+            return []
+
+        block = max(int(parameters.get('block_size', length // DETECTION_POINTS)), 1)
+        noise = estimate_noise(current) / math.sqrt(block)
+        if block > 1:
+            starts = np.arange(0, length, block)
+            sizes = np.diff(np.append(starts, length))
+            voltage = np.add.reduceat(voltage, starts) / sizes
+            current = np.add.reduceat(current, starts) / sizes
+
+        span = float(current.max() - current.min())
+        if span == 0:
+            return []
+
+        options = {
+            'prominence': float(parameters.get('prominence', 0.05 * span)),
+            'distance': max(int(parameters['distance']) // block, 1) if parameters.get('distance') else None,
+            'width': float(parameters['min_width']) / block if parameters.get('min_width') else None,
+        }
+        rel_height = float(parameters.get('rel_height', 0.5))
+        max_peaks = int(parameters.get('max_peaks', 20))
+        noise = noise or span * 1e-6
+
+        # 累积积分，用于向量化计算每个峰的面积
+        integral = cumulative_trapezoid(current, voltage, initial=0.0)
+        positions = np.arange(len(current))
+
+        peaks = []
+        for peak_type, values in (('anodic', current), ('cathodic', -current)):
+            indexes, properties = signal.find_peaks(values, **options)
+            if not len(indexes):
+                continue
+
+            prominences = properties['prominences']
+            widths = signal.peak_widths(values, indexes, rel_height=rel_height, prominence_data=(
+                prominences, properties['left_bases'], properties['right_bases']
+            ))
+            left = np.floor(widths[2]).astype(int)
+            right = np.minimum(np.ceil(widths[3]).astype(int), len(current) - 1)
+
+            left_voltage = np.interp(widths[2], positions, voltage)
+            right_voltage = np.interp(widths[3], positions, voltage)
+            chord = (current[left] + current[right]) / 2 * (voltage[right] - voltage[left])
+            areas = np.abs(integral[right] - integral[left] - chord)
+            snr = prominences / noise
+
+            for i, index in enumerate(indexes.tolist()):
+                peaks.append({
+                    'index': min(index * block + block // 2, length - 1),
+                    'voltage': float(voltage[index]),
+                    'current': float(current[index]),
+                    'height': float(prominences[i]),
+                    'area': float(areas[i]),
+                    'width': float(abs(right_voltage[i] - left_voltage[i])),
+                    'type': peak_type,
+                    'confidence': float(1 - math.exp(-snr[i] / 10)),
+                })
+
+        peaks.sort(key=lambda peak: peak['height'], reverse=True)
+        return sorted(peaks[:max_peaks], key=lambda peak: peak['index'])
+
+
+class IntegrationAnalyzer(BaseAnalyzer):
+    """
+    积分计算
+
+    电量为电流对时间的积分 ∫I dt (C)，分别给出阳极（正电流）与阴极（负电流）电量；
+    面积为电流对电压的积分 ∫I dV (A·V)。可用 v_min/v_max 限定电压范围，结果包含各循环的电量。
+    """
+    analysis_type = 'integration'
+    columns = ('timestamp', 'voltage', 'current', 'cycle')
+    streaming = True
+
+    def _mask(self, data, parameters):
+        mask = np.ones(len(data['current']), dtype=bool)
+        if parameters.get('v_min') is not None:
+            mask &= data['voltage'] >= float(parameters['v_min'])
+        if parameters.get('v_max') is not None:
+            mask &= data['voltage'] <= float(parameters['v_max'])
+        return mask
+
+    def _segments(self, data, mask, seconds):
+        """相邻两点构成的梯形，两端点均在范围内才计入；返回 (电量, 面积, 各循环电量)"""
+        current = data['current']
+        segment = mask[1:] & mask[:-1]
+        dt = np.diff(seconds)
+        mean_current = (current[1:] + current[:-1]) / 2
+        charges = np.where(segment, mean_current * dt, 0.0)
+        areas = np.where(segment, mean_current * np.diff(data['voltage']), 0.0)
+
+        cycles = data['cycle'][1:]
+        same_cycle = cycles == data['cycle'][:-1]
+        cycle_values, inverse = np.unique(cycles, return_inverse=True)
+        cycle_charges = np.bincount(inverse, weights=np.where(same_cycle, charges, 0.0), minlength=len(cycle_values))
+        return charges, areas, cycle_values, cycle_charges
+
+    def compute(self, data, parameters):
+        mask = self._mask(data, parameters)
+
+        seconds = (data['timestamp'] - (data['timestamp'][0] if len(data['timestamp']) else 0)) / 1e6
+        current = data['current']
+        if len(current) < 2:
+            return {'data_points_count': len(current), 'charge': 0.0, 'anodic_charge': 0.0,
+                    'cathodic_charge': 0.0, 'area': 0.0, 'cycles': {}}
+
+        charges, areas, cycle_values, cycle_charges = self._segments(data, mask, seconds)
+        return {
+            'data_points_count': int(mask.sum()),
+            'duration': float(seconds[-1]),
+            'charge': float(charges.sum()),
+            'anodic_charge': float(charges[charges > 0].sum()),
+            'cathodic_charge': float(charges[charges < 0].sum()),
+            'area': float(areas.sum()),
+            'cycles': {
+                str(cycle): float(charge)
+                for cycle, charge in zip(cycle_values.tolist(), cycle_charges.tolist())
+            },
+        }
+
+    def stream(self, source, parameters):
+        length = len(source)
+        if length <= get_window_points():
+            return self.compute(source.read(), parameters)
+
+        count = 0
+        totals = {'charge': 0.0, 'anodic_charge': 0.0, 'cathodic_charge': 0.0, 'area': 0.0}
+        cycles = {}
+        origin = None
+        previous = None
+        for columns in source:
+            if not len(columns['current']):
+                continue
+            if origin is None:
+                origin = columns['timestamp'][0]
+            mask = self._mask(columns, parameters)
+            count += int(mask.sum())
+            seconds = (columns['timestamp'] - origin) / 1e6
+            if previous is not None:
+                # 带上前一块的最后一点，使跨块的梯形也被计入
+                last_columns, last_mask, last_seconds = previous
+                columns = {name: np.concatenate([last_columns[name], values]) for name, values in columns.items()}
+                mask = np.concatenate([last_mask, mask])
+                seconds = np.concatenate([last_seconds, seconds])
+            previous = ({name: values[-1:] for name, values in columns.items()}, mask[-1:], seconds[-1:])
+
+            charges, areas, cycle_values, cycle_charges = self._segments(columns, mask, seconds)
+            totals['charge'] += float(charges.sum())
+            totals['anodic_charge'] += float(charges[charges > 0].sum())
+            totals['cathodic_charge'] += float(charges[charges < 0].sum())
+            totals['area'] += float(areas.sum())
+            for cycle, charge in zip(cycle_values.tolist(), cycle_charges.tolist()):
+                cycles[cycle] = cycles.get(cycle, 0.0) + charge
+
+        return {
+            'data_points_count': count,
+            'duration': float(previous[2][0]),
+            **totals,
+            'cycles': {str(cycle): float(cycles[cycle]) for cycle in sorted(cycles)},
+        }
+
+
+class StatisticalAnalyzer(BaseAnalyzer):
+    """统计分析"""
+    analysis_type = 'statistical_analysis'
+
+    def _stats(self, values):
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        return {
+            'mean': float(values.mean()),
+            'std': float(values.std()),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'median': float(median),
+            'q1': float(q1),
+            'q3': float(q3),
+            'skewness': float(stats.skew(values)) if len(values) > 2 else 0.0,
+            'kurtosis': float(stats.kurtosis(values)) if len(values) > 3 else 0.0,
+        }
+
+    def compute(self, data, parameters):
+        current = data['current']
+        if not len(current):
+            raise ValueError("Experiment has no data points")
+
+        noise = estimate_noise(current)
+        return {
+            'data_points_count': len(current),
+            'current_stats': self._stats(current),
+            'voltage_stats': self._stats(data['voltage']),
+            'noise': noise,
+            'snr': float(current.std() / noise) if noise else None,
+        }
+
+
+ANALYZERS = {
+    analyzer.analysis_type: analyzer
+    for analyzer in (
+        PeakDetectionAnalyzer, BaselineCorrectionAnalyzer, SmoothingAnalyzer,
+        IntegrationAnalyzer, StatisticalAnalyzer,
+    )
+}
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class AnalysisConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'analysis'
+    verbose_name = '数据分析'
+
+    def ready(self):
+        from . import signals  # noqa: F401
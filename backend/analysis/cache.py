@@ -0,0 +1,114 @@
+"""
+分析结果缓存
+
+缓存键为 (实验, 数据版本, 分析类型, 规范化参数) 的 SHA-256 哈希。实验每次写入或清空
+数据点都会递增数据版本，因此旧结果不会被误用，无需主动失效。缓存保存在数据库中，
+供 Web 进程和任务进程共享；条目数或总字节数超过上限时按最近使用时间淘汰。
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from experiments.fields import PackedValue, encode
+from .models import AnalysisResultCache
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def canonicalize(value):
+    """规范化参数：字典按键排序，整数值的浮点数转为整数，使等价参数得到相同的键"""
+    if isinstance(value, dict):
+        return {str(key): canonicalize(value[key]) for key in sorted(value, key=str)}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+
+
+def make_key(experiment, analysis_type, parameters):
+    payload = _dumps([experiment.pk, experiment.data_version, analysis_type, canonicalize(parameters or {})])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lookup(key):
+    """读取缓存结果并更新使用时间，未命中时返回 None"""
+    entries = AnalysisResultCache.objects.filter(key=key)
+    result = entries.values_list('result', flat=True).first()
+    if result is None:
+        return None
+    entries.update(hits=F('hits') + 1, last_used_at=timezone.now())
+    return result.decode()
+
+
+def lookup_many(keys):
+    """
+    批量读取缓存结果，返回 {缓存键: 结果}，只包含命中的键
+
+    结果不解码（PackedValue），可直接写入其他 PackedJSONField 而无需重新打包。
+    """
+    entries = AnalysisResultCache.objects.filter(key__in=list(keys))
+    results = dict(entries.values_list('key', 'result'))
+    if results:
+        entries.filter(key__in=list(results)).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    return results
+
+
+def store(key, experiment, analysis_type, parameters, result):
+    """保存分析结果，并按需淘汰最久未使用的条目；结果只编码一次，大小为压缩后的字节数"""
+    packed = PackedValue(encode(result))
+    AnalysisResultCache.objects.update_or_create(key=key, defaults={
+        'experiment': experiment,
+        'data_version': experiment.data_version,
+        'analysis_type': analysis_type,
+        'parameters': canonicalize(parameters or {}),
+        'result': packed,
+        'size': len(packed),
+        'last_used_at': timezone.now(),
+    })
+    evict()
+
+
+def evict():
+    max_entries = getattr(settings, 'ANALYSIS_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+    max_bytes = getattr(settings, 'ANALYSIS_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    totals = AnalysisResultCache.objects.aggregate(count=Count('id'), size=Sum('size'))
+    excess_entries = totals['count'] - max_entries
+    excess_bytes = (totals['size'] or 0) - max_bytes
+    if excess_entries <= 0 and excess_bytes <= 0:
+        return
+
+    # 只读取需要淘汰的最久未使用的条目
+    stale = []
+    entries = AnalysisResultCache.objects.order_by('last_used_at', 'id').values_list('id', 'size')
+    for entry_id, size in entries.iterator():
+        if len(stale) >= excess_entries and excess_bytes <= 0:
+            break
+        stale.append(entry_id)
+        excess_bytes -= size
+    AnalysisResultCache.objects.filter(id__in=stale).delete()
+
+
+def cached(experiment, analysis_type, parameters, compute):
+    """
+    读取缓存结果，未命中时调用 compute() 计算并保存
+
+    返回 (缓存键, 结果, 是否命中)。
+    """
+    key = make_key(experiment, analysis_type, parameters)
+    result = lookup(key)
+    if result is not None:
+        return key, result, True
+    result = compute()
+    store(key, experiment, analysis_type, parameters, result)
+    return key, result, False
@@ -0,0 +1,185 @@
+"""
+多实验比较
+
+所有实验的曲线分块以一次查询按 (实验, 起始位置) 顺序流式读取。每个数据点按扫描方向
+（电压上升为正扫、下降为反扫，取自实验的分段索引，没有索引时由相邻点的电压差判断）
+累加到公共电压网格的分箱中，得到各实验在每个方向上的
+平均电流曲线；空分箱由相邻分箱线性插值。随后对 N 条曲线一次性计算 N×N 相关系数矩阵和
+均方根距离矩阵，结果只保存网格参数、矩阵和各实验的摘要，不保存原始数据。
+"""
+import numpy as np
+
+from experiments.models import ExperimentTraceChunk
+from experiments.segments import directions, segment_index
+from experiments.storage import TRACE_COLUMNS
+
+DEFAULT_GRID_POINTS = 500
+DEFAULT_MAX_GRID_POINTS = 10000
+DIRECTIONS = ('forward', 'reverse')
+
+
+def common_voltage_range(experiments):
+    """各实验电压范围的交集"""
+    ranges = [
+        (experiment.trace_summary['voltage']['min'], experiment.trace_summary['voltage']['max'])
+        for experiment in experiments
+    ]
+    v_min = max(low for low, high in ranges)
+    v_max = min(high for low, high in ranges)
+    if v_min >= v_max:
+        raise ValueError("Experiments have no common voltage range")
+    return v_min, v_max
+
+
+def _sweep_directions(voltage, previous_voltage, previous_direction):
+    """逐点扫描方向：1 为正扫，-1 为反扫；电压不变的点沿用前一点的方向"""
+    diff = np.diff(voltage, prepend=voltage[0] if previous_voltage is None else previous_voltage)
+    direction = np.sign(diff).astype(np.int8)
+    moving = np.where(direction != 0, np.arange(len(direction)), -1)
+    last = np.maximum.accumulate(moving)
+    return np.where(last >= 0, direction[np.maximum(last, 0)], previous_direction)
+
+
+def accumulate(experiments, grid):
+    """
+    流式读取所有实验的曲线，按扫描方向累加到电压网格分箱
+
+    返回 {方向: (电流和, 点数)}，数组形状均为 (实验数, 网格点数)。
+    """
+    positions = {experiment.id: row for row, experiment in enumerate(experiments)}
+    indexes = {
+        experiment.id: segment_index(experiment.trace_segments)
+        for experiment in experiments
+        if experiment.trace_segments.get('length') == experiment.data_points_count
+    }
+    points = len(grid)
+    step = grid[1] - grid[0]
+    sums = {direction: np.zeros((len(experiments), points)) for direction in DIRECTIONS}
+    counts = {direction: np.zeros((len(experiments), points)) for direction in DIRECTIONS}
+
+    rows = ExperimentTraceChunk.objects.filter(experiment__in=list(positions)).order_by(
+        'experiment_id', 'start_offset'
+    ).values_list('experiment_id', 'start_offset', 'voltages', 'currents')
+
+    state = {}
+    for experiment_id, start_offset, voltage_blob, current_blob in rows.iterator(chunk_size=16):
+        voltage = np.frombuffer(voltage_blob, dtype=TRACE_COLUMNS['voltage'][1])
+        current = np.frombuffer(current_blob, dtype=TRACE_COLUMNS['current'][1])
+        if not len(voltage):
+            continue
+
+        if experiment_id in indexes:
+            direction = directions(indexes[experiment_id], start_offset, start_offset + len(voltage))
+        else:
+            previous_voltage, previous_direction = state.get(experiment_id, (None, 1))
+            direction = _sweep_directions(voltage, previous_voltage, previous_direction)
+            state[experiment_id] = (voltage[-1], direction[-1])
+
+        bins = np.rint((voltage - grid[0]) / step).astype(np.int64)
+        inside = (bins >= 0) & (bins < points)
+        row = positions[experiment_id]
+        for sign, name in ((1, 'forward'), (-1, 'reverse')):
+            selected = inside & (direction == sign)
+            sums[name][row] += np.bincount(bins[selected], weights=current[selected], minlength=points)
+            counts[name][row] += np.bincount(bins[selected], minlength=points)
+
+    return {direction: (sums[direction], counts[direction]) for direction in DIRECTIONS}
+
+
+def resample(sums, counts, grid):
+    """分箱平均，空分箱线性插值；有效分箱少于一半的实验整行为 NaN"""
+    curves = np.full(sums.shape, np.nan)
+    filled = counts > 0
+    for row in range(len(sums)):
+        if filled[row].sum() * 2 < len(grid):
+            continue
+        means = sums[row, filled[row]] / counts[row, filled[row]]
+        curves[row] = np.interp(grid, grid[filled[row]], means)
+    return curves
+
+
+def _matrix(values, valid):
+    """只在有效实验之间填入矩阵，其余为 None"""
+    size = len(valid)
+    matrix = [[None] * size for _ in range(size)]
+    indexes = np.flatnonzero(valid)
+    for i, row in zip(indexes.tolist(), values.tolist()):
+        for j, value in zip(indexes.tolist(), row):
+            matrix[i][j] = value
+    return matrix
+
+
+def correlation_and_distance(curves):
+    """N×N 相关系数矩阵和均方根距离矩阵，NaN 行对应的实验不参与计算"""
+    valid = ~np.isnan(curves).any(axis=1)
+    data = curves[valid]
+
+    centered = data - data.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1)
+    norms[norms == 0] = np.inf
+    normalized = centered / norms[:, None]
+    correlation = np.clip(normalized @ normalized.T, -1.0, 1.0)
+
+    squares = (data ** 2).sum(axis=1)
+    distance = np.sqrt(np.maximum(squares[:, None] + squares[None, :] - 2 * data @ data.T, 0) / data.shape[1])
+    np.fill_diagonal(distance, 0.0)
+    return valid, correlation, distance
+
+
+def compare_experiments(experiments, grid_points=DEFAULT_GRID_POINTS):
+    """比较多个实验，返回可存入 JSONField 的结果"""
+    experiments = [experiment for experiment in experiments if experiment.trace_summary.get('count')]
+    if len(experiments) < 2:
+        raise ValueError("At least 2 experiments with data points are required for comparison")
+    if grid_points < 2:
+        raise ValueError("grid_points must be at least 2")
+
+    v_min, v_max = common_voltage_range(experiments)
+    grid = np.linspace(v_min, v_max, grid_points)
+    accumulated = accumulate(experiments, grid)
+
+    correlation_matrix = {}
+    distance_matrix = {}
+    pair_correlations = []
+    for direction in DIRECTIONS:
+        valid, correlation, distance = correlation_and_distance(resample(*accumulated[direction], grid))
+        if valid.sum() < 2:
+            continue
+        correlation_matrix[direction] = _matrix(correlation, valid)
+        distance_matrix[direction] = _matrix(distance, valid)
+        pair_correlations.append(correlation[np.triu_indices(len(correlation), k=1)])
+
+    pair_correlations = np.concatenate(pair_correlations) if pair_correlations else np.empty(0)
+    statistics = {}
+    if len(pair_correlations):
+        statistics = {
+            'mean_correlation': float(pair_correlations.mean()),
+            'min_correlation': float(pair_correlations.min()),
+            'max_correlation': float(pair_correlations.max()),
+        }
+
+    return {
+        'experiments': [
+            {
+                'id': experiment.id,
+                'name': experiment.name,
+                'type': experiment.experiment_type,
+                'data_points_count': experiment.trace_summary['count'],
+            }
+            for experiment in experiments
+        ],
+        'grid': {'v_min': v_min, 'v_max': v_max, 'points': grid_points},
+        'statistics': statistics,
+        'correlation_matrix': correlation_matrix,
+        'distance_matrix': distance_matrix,
+        'peak_comparison': {
+            str(experiment.id): {
+                'peak_current': experiment.trace_summary['current']['max'],
+                'peak_voltage': experiment.trace_summary['peak_voltage'],
+                'valley_current': experiment.trace_summary['current']['min'],
+                'valley_voltage': experiment.trace_summary['valley_voltage'],
+            }
+            for experiment in experiments
+        },
+        'correlation_coefficient': statistics.get('mean_correlation'),
+    }
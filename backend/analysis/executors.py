@@ -0,0 +1,214 @@
+"""
+分析任务执行后端
+
+ANALYSIS_JOB_BACKEND 选择分析任务的执行方式：
+- celery（默认）：通过 Celery 提交到 CELERY_BROKER_URL 指定的消息队列；
+- process：在本机进程池中执行，无需 Redis。进程池大小为 ANALYSIS_JOB_WORKERS，
+  排队任务数不超过 ANALYSIS_JOB_QUEUE_SIZE，工作进程平均执行
+  ANALYSIS_JOB_MAX_TASKS_PER_CHILD 个任务后重启以释放内存；
+- sync：在当前进程中同步执行，用于测试和调试。
+
+除分析任务外，call(task, *args) 以同样的方式执行其他 Celery 任务函数（如停止实验后的
+分块合并和结果生成），参数需可序列化为 JSON。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'celery'
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_MAX_TASKS_PER_CHILD = 50
+
+
+class JobQueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Analysis job queue is full, try again later'
+    default_code = 'job_queue_full'
+
+
+def _setup_worker():
+    """工作进程以 spawn 方式启动，需要单独初始化 Django"""
+    import django
+    django.setup()
+
+
+def _run_job(job_id):
+    from .views import run_analysis_task
+    run_analysis_task(job_id)
+
+
+def _run_jobs(job_ids):
+    from .views import run_analysis_jobs_task
+    run_analysis_jobs_task(job_ids)
+
+
+def _fail_jobs(job_ids, message):
+    from .views import fail_jobs
+    fail_jobs(job_ids, message)
+
+
+def _task_path(task):
+    function = getattr(task, 'run', task)
+    return f'{function.__module__}.{function.__name__}'
+
+
+def _call_task(call):
+    """在工作进程中按模块路径调用任务函数，call 为 (路径, 参数)"""
+    path, args = call
+    module, name = path.rsplit('.', 1)
+    getattr(import_module(module), name)(*args)
+
+
+class CeleryExecutor:
+    def submit(self, job_id):
+        from .views import run_analysis_task
+        run_analysis_task.delay(job_id)
+
+    def submit_many(self, job_ids):
+        """一组任务作为一条消息提交，由同一个 worker 依次执行"""
+        from .views import run_analysis_jobs_task
+        run_analysis_jobs_task.delay(list(job_ids))
+
+    def call(self, task, *args):
+        task.delay(*args)
+
+
+class SyncExecutor:
+    def submit(self, job_id):
+        try:
+            _run_job(job_id)
+        except Exception:
+            # 失败信息已记录在任务中
+            logger.exception('Analysis job %s failed', job_id)
+
+    def submit_many(self, job_ids):
+        _run_jobs(list(job_ids))
+
+    def call(self, task, *args):
+        try:
+            task(*args)
+        except Exception:
+            logger.exception('Task %s failed', _task_path(task))
+
+
+class ProcessPoolJobExecutor:
+    """
+    本机进程池，排队与执行中的任务总数有上限，超出时拒绝提交
+
+    进程池累计接收 工作进程数 × max_tasks_per_child 个任务后，新任务提交到新建的进程池，
+    旧进程池执行完已接收的任务后退出，从而定期回收工作进程。未使用
+    ProcessPoolExecutor 自带的 max_tasks_per_child，因其在 Python 3.11 中重启工作进程时可能挂起。
+
+    工作进程异常退出（如内存不足被终止）会使整个进程池不可用：提交时改用新建的进程池重试一次，
+    池中未完成的分析任务标记为失败，可重试。
+    """
+
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE, max_tasks_per_child=DEFAULT_MAX_TASKS_PER_CHILD):
+        self.workers = workers or os.cpu_count() or 1
+        self.tasks_per_pool = self.workers * max_tasks_per_child if max_tasks_per_child else None
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._submitted = 0
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_setup_worker,
+        )
+
+    def _current_pool(self, replace=False):
+        if replace or self._pool is None or (self.tasks_per_pool and self._submitted >= self.tasks_per_pool):
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = self._new_pool()
+            self._submitted = 0
+        self._submitted += 1
+        return self._pool
+
+    def _submit(self, function, argument):
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull()
+        try:
+            with self._lock:
+                try:
+                    future = self._current_pool().submit(function, argument)
+                except BrokenProcessPool:
+                    logger.warning('Analysis process pool is broken, starting a new one')
+                    future = self._current_pool(replace=True).submit(function, argument)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._finished(function, argument, done))
+
+    def submit(self, job_id):
+        self._submit(_run_job, job_id)
+
+    def submit_many(self, job_ids):
+        """一组任务只占用一个排队位置，在同一个工作进程中依次执行"""
+        self._submit(_run_jobs, list(job_ids))
+
+    def call(self, task, *args):
+        self._submit(_call_task, (_task_path(task), list(args)))
+
+    def _finished(self, function, argument, future):
+        self._slots.release()
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        if function is _call_task:
+            logger.error('Task %s failed: %s', argument[0], error)
+            return
+        logger.error('Analysis job %s failed: %s', argument, error)
+        if isinstance(error, BrokenProcessPool):
+            # 工作进程未能记录失败，任务仍为待执行或执行中
+            from django.db import connection
+            try:
+                _fail_jobs(argument if isinstance(argument, list) else [argument], str(error))
+            except Exception:
+                logger.exception('Failed to mark analysis jobs %s as failed', argument)
+            finally:
+                # 回调在进程池的管理线程中执行，线程退出前关闭其数据库连接
+                connection.close()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """返回当前进程中 ANALYSIS_JOB_BACKEND 对应的任务执行后端（按设置懒创建，每种后端一个）"""
+    backend = getattr(settings, 'ANALYSIS_JOB_BACKEND', DEFAULT_BACKEND)
+    with _executor_lock:
+        if backend not in _executors:
+            if backend == 'celery':
+                executor = CeleryExecutor()
+            elif backend == 'process':
+                executor = ProcessPoolJobExecutor(
+                    workers=getattr(settings, 'ANALYSIS_JOB_WORKERS', None),
+                    queue_size=getattr(settings, 'ANALYSIS_JOB_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+                    max_tasks_per_child=getattr(settings, 'ANALYSIS_JOB_MAX_TASKS_PER_CHILD', DEFAULT_MAX_TASKS_PER_CHILD),
+                )
+            elif backend == 'sync':
+                executor = SyncExecutor()
+            else:
+                raise ValueError(f"Unknown analysis job backend: {backend}")
+            _executors[backend] = executor
+        return _executors[backend]
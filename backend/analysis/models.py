@@ -1,4 +1,6 @@
 from django.db import models
+from django.contrib.auth.models import User
+from experiments.fields import PackedJSONField
 from experiments.models import Experiment, ExperimentResult
 
 
@@ -12,6 +14,7 @@ class AnalysisMethod(models.Model):
         ('derivative', '导数计算'),
         ('fourier_transform', '傅里叶变换'),
         ('statistical_analysis', '统计分析'),
+        ('pipeline', '分析流水线'),
     ]
     
     name = models.CharField(max_length=100)
@@ -31,6 +34,27 @@ class AnalysisMethod(models.Model):
         return self.name
 
 
+class AnalysisBatch(models.Model):
+    """批量分析：对筛选出的一组实验执行一组分析方法"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analysis_batches')
+    name = models.CharField(max_length=200, blank=True)
+    methods = models.ManyToManyField(AnalysisMethod, related_name='batches')
+    
+    # 创建批量分析时使用的实验筛选条件
+    experiment_filters = models.JSONField(default=dict, blank=True)
+    total_jobs = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "批量分析"
+        verbose_name_plural = "批量分析"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return self.name or f"Batch {self.pk}"
+
+
 class AnalysisJob(models.Model):
     """分析任务模型"""
     STATUS_CHOICES = [
@@ -42,13 +66,19 @@ class AnalysisJob(models.Model):
     
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='analysis_jobs')
     method = models.ForeignKey(AnalysisMethod, on_delete=models.CASCADE)
+    batch = models.ForeignKey(AnalysisBatch, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     parameters = models.JSONField(default=dict, blank=True)
     
     # 结果数据
-    result_data = models.JSONField(default=dict, blank=True)
+    result_data = PackedJSONField(default=dict, blank=True)
     error_message = models.TextField(blank=True)
     
+    # 结果缓存键，相同键的任务共享结果
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    # 合并到的任务：相同缓存键的任务执行中时不重复提交，等待该任务完成后一并写入结果
+    leader = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='followers')
+    
     # 时间戳
     created_at = models.DateTimeField(auto_now_add=True)
     started_at = models.DateTimeField(null=True, blank=True)
@@ -62,6 +92,28 @@ class AnalysisJob(models.Model):
         return f"{self.method.name} for {self.experiment}"
 
 
+class AnalysisResultCache(models.Model):
+    """分析结果缓存，键为实验数据版本、分析类型和规范化参数的哈希"""
+    key = models.CharField(max_length=64, unique=True)
+    experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='cached_analyses')
+    data_version = models.PositiveIntegerField()
+    analysis_type = models.CharField(max_length=50)
+    parameters = models.JSONField(default=dict, blank=True)
+    result = PackedJSONField()
+    size = models.PositiveIntegerField(help_text="结果压缩保存后的字节数")
+    hits = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        verbose_name = "分析结果缓存"
+        verbose_name_plural = "分析结果缓存"
+    
+    def __str__(self):
+        return f"{self.analysis_type} for {self.experiment} (v{self.data_version})"
+
+
 class PeakAnalysis(models.Model):
     """峰值分析结果模型"""
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='peak_analyses')
@@ -82,10 +134,18 @@ class PeakAnalysis(models.Model):
         ('cathodic', '阴极峰'),
         ('mixed', '混合峰'),
     ], default='anodic')
+    # 峰所在的扫描方向，由实验的分段索引得到
+    sweep = models.CharField(max_length=10, blank=True, choices=[
+        ('forward', '正扫'),
+        ('reverse', '反扫'),
+    ])
     
     # 置信度
     confidence = models.FloatField(default=0.0, help_text="置信度 (0-1)")
     
+    # 产生该结果的分析缓存键
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -121,6 +181,9 @@ class StatisticalAnalysis(models.Model):
     # 详细分析结果
     analysis_data = models.JSONField(default=dict, blank=True)
     
+    # 产生该结果的分析缓存键
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -138,7 +201,7 @@ class ComparisonAnalysis(models.Model):
     experiments = models.ManyToManyField(Experiment, related_name='comparisons')
     
     # 比较结果
-    comparison_data = models.JSONField(default=dict, blank=True)
+    comparison_data = PackedJSONField(default=dict, blank=True)
     
     # 相关性分析
     correlation_coefficient = models.FloatField(null=True, blank=True)
@@ -0,0 +1,110 @@
+"""
+分析流水线
+
+流水线类型的分析方法在 parameters['steps'] 中按顺序列出要执行的分析方法：
+
+    {"steps": [
+        {"method": 3, "name": "smooth"},
+        {"method": 5, "name": "baseline", "parameters": {"degree": 3}},
+        {"method": 1, "name": "peaks"},
+        {"method": 4, "input": "smooth"}
+    ]}
+
+实验曲线只读取一次（所有步骤所需列的并集），之后各步骤在内存中的列数组上执行。
+每个步骤默认以上一个处理类步骤（平滑、基线校正）的输出为输入，也可用 input 指定
+任一已命名步骤的输出或 "raw"（原始曲线），从而组成有向无环的处理图、共享中间结果。
+步骤参数覆盖分析方法自身的默认参数。
+"""
+import time
+
+from .analyzers import ANALYZERS
+
+PIPELINE_TYPE = 'pipeline'
+RAW_INPUT = 'raw'
+
+
+def resolve_steps(steps):
+    """校验步骤定义并查询对应的分析方法，返回 [(名称, 分析方法, 参数, 输入)]"""
+    from .models import AnalysisMethod
+
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("Pipeline steps must be a non-empty list")
+    if not all(isinstance(step, dict) and 'method' in step for step in steps):
+        raise ValueError("Each pipeline step must specify a method")
+    if not all(isinstance(step['method'], (int, str)) and not isinstance(step['method'], bool) for step in steps):
+        raise ValueError("Pipeline step method must be an analysis method id")
+
+    methods = AnalysisMethod.objects.in_bulk({step['method'] for step in steps})
+    resolved = []
+    names = {RAW_INPUT}
+    for position, step in enumerate(steps):
+        method = methods.get(step['method'])
+        if method is None:
+            raise ValueError(f"Analysis method not found: {step['method']}")
+        if method.analysis_type not in ANALYZERS:
+            raise ValueError(f"Analysis type cannot be used in a pipeline: {method.analysis_type}")
+
+        name = str(step.get('name') or f'step_{position + 1}')
+        if name in names:
+            raise ValueError(f"Duplicate pipeline step name: {name}")
+        source = step.get('input')
+        if source is not None and source not in names:
+            raise ValueError(f"Unknown input for step {name}: {source}")
+        names.add(name)
+
+        parameters = step.get('parameters') or {}
+        if not isinstance(parameters, dict):
+            raise ValueError(f"Parameters of step {name} must be an object")
+        resolved.append((name, method, {**method.parameters, **parameters}, source))
+    return resolved
+
+
+def effective_parameters(method, parameters=None):
+    """
+    分析方法与任务参数合并后的有效参数，用于计算缓存键
+
+    流水线展开为各步骤的分析类型和参数，使缓存键随步骤所用方法的参数变化。
+    """
+    parameters = {**method.parameters, **(parameters or {})}
+    if method.analysis_type == PIPELINE_TYPE:
+        parameters = {'steps': [
+            {'name': name, 'analysis_type': step_method.analysis_type, 'parameters': step_parameters, 'input': source}
+            for name, step_method, step_parameters, source in resolve_steps(parameters.get('steps'))
+        ]}
+    return parameters
+
+
+def run_pipeline(experiment, steps):
+    """执行流水线，返回包含各步骤结果的字典"""
+    resolved = resolve_steps(steps)
+    analyzers = [ANALYZERS[method.analysis_type]() for name, method, parameters, source in resolved]
+
+    columns = []
+    for analyzer in analyzers:
+        columns.extend(column for column in analyzer.columns if column not in columns)
+    raw = experiment.trace.read(columns)
+
+    outputs = {RAW_INPUT: raw}
+    current = raw
+    results = []
+    for (name, method, parameters, source), analyzer in zip(resolved, analyzers):
+        started = time.perf_counter()
+        output, result = analyzer.run(outputs[source] if source else current, parameters)
+        outputs[name] = output
+        if hasattr(analyzer, 'transform'):
+            current = output
+        results.append({
+            'name': name,
+            'method': method.id,
+            'method_name': method.name,
+            'analysis_type': method.analysis_type,
+            'input': source or None,
+            'parameters': parameters,
+            'duration': time.perf_counter() - started,
+            'result': result,
+        })
+
+    return {
+        'data_points_count': len(raw['current']),
+        'steps': results,
+    }
@@ -0,0 +1,240 @@
+from django.conf import settings
+from django.db import models, transaction
+from rest_framework import serializers
+from experiments.models import Experiment
+from .models import AnalysisMethod, AnalysisBatch, AnalysisJob, PeakAnalysis, StatisticalAnalysis, ComparisonAnalysis
+from .cache import make_key
+from .comparison import DEFAULT_GRID_POINTS, DEFAULT_MAX_GRID_POINTS
+from .pipeline import PIPELINE_TYPE, effective_parameters, resolve_steps
+
+DEFAULT_BATCH_MAX_JOBS = 10000
+
+
+def _validate_parameters(value):
+    """参数需与分析方法的默认参数合并，必须为对象"""
+    if not isinstance(value, dict):
+        raise serializers.ValidationError("Parameters must be an object")
+    return value
+
+
+class AnalysisMethodSerializer(serializers.ModelSerializer):
+    """分析方法序列化器"""
+    class Meta:
+        model = AnalysisMethod
+        fields = [
+            'id', 'name', 'description', 'analysis_type', 'parameters',
+            'is_active', 'created_at', 'updated_at'
+        ]
+    
+    def validate_parameters(self, value):
+        return _validate_parameters(value)
+
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    """分析任务序列化器"""
+    method_name = serializers.CharField(source='method.name', read_only=True)
+    analysis_type = serializers.CharField(source='method.analysis_type', read_only=True)
+    result_data = serializers.JSONField(read_only=True)
+    
+    class Meta:
+        model = AnalysisJob
+        fields = [
+            'id', 'experiment', 'method', 'method_name', 'analysis_type',
+            'status', 'parameters', 'result_data', 'error_message',
+            'created_at', 'started_at', 'completed_at'
+        ]
+        read_only_fields = ['id', 'status', 'result_data', 'error_message', 'created_at', 'started_at', 'completed_at']
+    
+    def validate_experiment(self, value):
+        if value.user != self.context['request'].user:
+            raise serializers.ValidationError("Experiment not found")
+        return value
+    
+    def validate_parameters(self, value):
+        return _validate_parameters(value)
+    
+    def validate(self, attrs):
+        method = attrs.get('method')
+        if method and method.analysis_type == PIPELINE_TYPE:
+            parameters = {**method.parameters, **attrs.get('parameters', {})}
+            try:
+                resolve_steps(parameters.get('steps'))
+            except ValueError as e:
+                raise serializers.ValidationError({'parameters': str(e)})
+        return attrs
+
+
+class ComparisonRunSerializer(serializers.Serializer):
+    """比较分析的运行参数，网格点数上限为 COMPARISON_MAX_GRID_POINTS"""
+    grid_points = serializers.IntegerField(min_value=2, required=False, default=DEFAULT_GRID_POINTS)
+    
+    def validate_grid_points(self, value):
+        max_points = getattr(settings, 'COMPARISON_MAX_GRID_POINTS', DEFAULT_MAX_GRID_POINTS)
+        if value > max_points:
+            message = self.fields['grid_points'].error_messages['max_value']
+            raise serializers.ValidationError(message.format(max_value=max_points))
+        return value
+
+
+class ExperimentFilterSerializer(serializers.Serializer):
+    """批量分析的实验筛选条件，各条件同时满足"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    experiment_type = serializers.ChoiceField(choices=Experiment.EXPERIMENT_TYPES, required=False)
+    status = serializers.ChoiceField(choices=Experiment.STATUS_CHOICES, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    
+    def filter(self, queryset):
+        data = self.validated_data
+        lookups = {
+            'ids': 'id__in',
+            'experiment_type': 'experiment_type',
+            'status': 'status',
+            'created_after': 'created_at__gte',
+            'created_before': 'created_at__lt',
+        }
+        return queryset.filter(**{lookups[name]: value for name, value in data.items()})
+
+
+class AnalysisBatchSerializer(serializers.ModelSerializer):
+    """
+    批量分析序列化器
+    
+    创建时对 experiment_filters 筛选出的每个有数据的实验执行 methods 中的每个分析方法，
+    一次写入全部分析任务。
+    """
+    methods = serializers.PrimaryKeyRelatedField(
+        many=True, queryset=AnalysisMethod.objects.filter(is_active=True)
+    )
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AnalysisBatch
+        fields = ['id', 'name', 'methods', 'experiment_filters', 'total_jobs', 'progress', 'created_at']
+        read_only_fields = ['id', 'total_jobs', 'created_at']
+    
+    def validate_methods(self, value):
+        if not value:
+            raise serializers.ValidationError("At least one method is required")
+        for method in value:
+            if method.analysis_type == PIPELINE_TYPE:
+                try:
+                    resolve_steps(method.parameters.get('steps'))
+                except ValueError as e:
+                    raise serializers.ValidationError(f"{method.name}: {e}")
+        return value
+    
+    def validate_experiment_filters(self, value):
+        filters = ExperimentFilterSerializer(data=value)
+        filters.is_valid(raise_exception=True)
+        self._experiments = filters.filter(Experiment.objects.filter(
+            user=self.context['request'].user, data_points_count__gt=0
+        ))
+        return value
+    
+    def validate(self, attrs):
+        if not hasattr(self, '_experiments'):
+            self.validate_experiment_filters({})
+        
+        total = self._experiments.count() * len(attrs['methods'])
+        if not total:
+            raise serializers.ValidationError({'experiment_filters': "No experiments with data points match the filters"})
+        max_jobs = getattr(settings, 'ANALYSIS_BATCH_MAX_JOBS', DEFAULT_BATCH_MAX_JOBS)
+        if total > max_jobs:
+            raise serializers.ValidationError(f"Batch would create {total} jobs, the limit is {max_jobs}")
+        return attrs
+    
+    def create(self, validated_data):
+        methods = validated_data.pop('methods')
+        with transaction.atomic():
+            batch = AnalysisBatch.objects.create(**validated_data)
+            batch.methods.set(methods)
+            
+            # 各方法的有效参数只解析一次
+            method_parameters = [(method, effective_parameters(method)) for method in methods]
+            jobs = [
+                AnalysisJob(
+                    experiment=experiment, method=method, batch=batch,
+                    cache_key=make_key(experiment, method.analysis_type, parameters),
+                )
+                for experiment in self._experiments.only('id', 'data_version').iterator()
+                for method, parameters in method_parameters
+            ]
+            AnalysisJob.objects.bulk_create(jobs, batch_size=500)
+            batch.total_jobs = len(jobs)
+            batch.save(update_fields=['total_jobs'])
+        return batch
+    
+    def get_progress(self, obj):
+        counts = job_status_counts(obj)
+        finished = counts['completed'] + counts['failed']
+        return {
+            'total': obj.total_jobs,
+            **counts,
+            'finished': finished,
+            'percent': round(100.0 * finished / obj.total_jobs, 1) if obj.total_jobs else 100.0,
+        }
+
+
+JOB_STATUSES = [choice for choice, _ in AnalysisJob.STATUS_CHOICES]
+
+
+def status_count_annotations():
+    """按状态统计批量分析任务数的注解，列表查询中一次得到所有批量分析的进度"""
+    return {
+        f'{status}_jobs': models.Count('jobs', filter=models.Q(jobs__status=status))
+        for status in JOB_STATUSES
+    }
+
+
+def job_status_counts(batch):
+    """批量分析中各状态的任务数，优先使用查询注解"""
+    if hasattr(batch, f'{JOB_STATUSES[0]}_jobs'):
+        return {status: getattr(batch, f'{status}_jobs') for status in JOB_STATUSES}
+    counts = dict.fromkeys(JOB_STATUSES, 0)
+    counts.update(batch.jobs.values_list('status').annotate(count=models.Count('id')).order_by())
+    return counts
+
+
+class PeakAnalysisSerializer(serializers.ModelSerializer):
+    """峰值分析序列化器"""
+    class Meta:
+        model = PeakAnalysis
+        fields = [
+            'id', 'experiment', 'peak_voltage', 'peak_current', 'peak_height',
+            'peak_area', 'peak_width', 'peak_index', 'peak_type', 'sweep', 'confidence',
+            'created_at'
+        ]
+
+
+class StatisticalAnalysisSerializer(serializers.ModelSerializer):
+    """统计分析序列化器"""
+    class Meta:
+        model = StatisticalAnalysis
+        fields = [
+            'id', 'experiment',
+            'current_mean', 'current_std', 'current_min', 'current_max', 'current_median',
+            'voltage_mean', 'voltage_std', 'voltage_min', 'voltage_max', 'voltage_median',
+            'data_points_count', 'signal_to_noise_ratio', 'analysis_data',
+            'created_at'
+        ]
+
+
+class ComparisonAnalysisSerializer(serializers.ModelSerializer):
+    """比较分析序列化器"""
+    comparison_data = serializers.JSONField(read_only=True)
+    
+    class Meta:
+        model = ComparisonAnalysis
+        fields = [
+            'id', 'name', 'description', 'experiments',
+            'comparison_data', 'correlation_coefficient',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'comparison_data', 'correlation_coefficient', 'created_at', 'updated_at']
+    
+    def validate_experiments(self, value):
+        user = self.context['request'].user
+        if any(experiment.user != user for experiment in value):
+            raise serializers.ValidationError("Experiment not found")
+        return value
@@ -0,0 +1,16 @@
+"""
+缓存失效：分析方法保存或删除时使分析方法列表的缓存失效（见 electrochemical.caching）
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from electrochemical.caching import invalidate
+
+from .models import AnalysisMethod
+
+METHODS_NAMESPACE = 'analysis_methods'
+
+
+@receiver([post_save, post_delete], sender=AnalysisMethod)
+def invalidate_methods(sender, **kwargs):
+    invalidate(METHODS_NAMESPACE)
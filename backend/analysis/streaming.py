@@ -0,0 +1,269 @@
+"""
+分块流式分析的基础工具
+
+超长曲线按分块读取，分析器在带重叠的窗口上逐段处理，内存占用只取决于窗口大小，
+与曲线长度无关。数据来源为可重复迭代的分块生成器（数据库分块或文件），需要全局信息的
+统计量（中位数、降采样曲线等）通过多次遍历得到，结果与一次读入内存的计算一致。
+"""
+import numpy as np
+from django.conf import settings
+
+from experiments.pyramid import minmax_indices
+
+DEFAULT_WINDOW_POINTS = 262144
+# 精确分位数每轮的直方图分箱数和直接计数的值数量上限
+SELECT_BINS = 4096
+SELECT_MAX_VALUES = 1 << 16
+
+
+def get_window_points():
+    return getattr(settings, 'ANALYSIS_STREAMING_WINDOW_POINTS', DEFAULT_WINDOW_POINTS)
+
+
+class ChunkSource:
+    """
+    可重复迭代的曲线分块来源
+
+    open_chunks() 每次调用返回一个新的生成器，按顺序产出列数组字典；length 为总点数。
+    """
+
+    def __init__(self, open_chunks, length):
+        self.open_chunks = open_chunks
+        self.length = length
+
+    def __iter__(self):
+        return iter(self.open_chunks())
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_store(cls, store, columns):
+        """从实验曲线存储按分块读取指定的列"""
+        columns = list(columns)
+        return cls(
+            lambda: (arrays for offset, arrays in store.iter_chunks(columns)),
+            store.end_offset(),
+        )
+
+    def read(self):
+        """读取全部数据，用于点数较少、无需分窗处理的情况"""
+        parts = list(self)
+        return _concatenate(parts) if parts else {}
+
+
+def windows(chunks, overlap, size=None):
+    """
+    将分块重新划分为带重叠的窗口，产出 (窗口起始位置, 窗口列数组, 有效区间起点, 有效区间终点)
+
+    有效区间为窗口内的相对位置，前后各带最多 overlap 个点的上下文；各窗口的有效区间首尾相接，
+    覆盖全部数据点。依赖 ±overlap 范围内邻点的计算在有效区间内的结果与整段计算相同。
+    """
+    size = size or get_window_points()
+    parts = []
+    buffered = 0
+    buffer_start = 0
+    emitted = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        buffered += len(next(iter(chunk.values())))
+        if buffer_start + buffered < emitted + size + overlap:
+            continue
+
+        buffer = _concatenate(parts)
+        while buffer_start + buffered >= emitted + size + overlap:
+            low = max(emitted - overlap, buffer_start)
+            high = emitted + size + overlap
+            window = {name: values[low - buffer_start:high - buffer_start] for name, values in buffer.items()}
+            yield low, window, emitted - low, emitted + size - low
+            emitted += size
+            drop = max(emitted - overlap, buffer_start) - buffer_start
+            buffer = {name: values[drop:] for name, values in buffer.items()}
+            buffer_start += drop
+            buffered -= drop
+        parts = [buffer]
+
+    if buffered and buffer_start + buffered > emitted:
+        buffer = _concatenate(parts)
+        low = max(emitted - overlap, buffer_start)
+        window = {name: values[low - buffer_start:] for name, values in buffer.items()}
+        yield low, window, emitted - low, buffer_start + buffered - low
+
+
+def _concatenate(parts):
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+class RunningStats:
+    """合并各段的点数、均值和离差平方和，得到整体的均值与标准差"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def add(self, values):
+        count = len(values)
+        if not count:
+            return
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    @property
+    def std(self):
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+
+class RankSelector:
+    """
+    多次遍历求第 k 小的值（精确），内存占用有上限
+
+    每轮遍历对当前范围内的值做直方图，将范围缩小到包含目标名次的分箱；范围内的值足够少或
+    范围已无法再分时，最后一轮对范围内的不同值计数，直接得到目标名次的值。
+    """
+
+    def __init__(self, count, ranks, minimum, maximum):
+        self.ranks = sorted(set(ranks))
+        self.low = minimum
+        self.high = maximum
+        self.below = 0
+        self.inside = count
+        self.results = None
+        self._begin()
+
+    @property
+    def done(self):
+        return self.results is not None
+
+    def _begin(self):
+        if self.low == self.high:
+            self.results = {rank: self.low for rank in self.ranks}
+            return
+        edges = np.linspace(self.low, self.high, SELECT_BINS + 1)
+        self.counting = self.inside <= SELECT_MAX_VALUES or not (np.diff(edges) > 0).all()
+        if self.counting:
+            self.values = []
+        else:
+            self.edges = edges
+            self.histogram = np.zeros(SELECT_BINS, dtype=np.int64)
+
+    def feed(self, values):
+        if self.done:
+            return
+        values = values[(values >= self.low) & (values <= self.high)]
+        if self.counting:
+            self.values.append(np.unique(values, return_counts=True))
+        else:
+            self.histogram += np.histogram(values, self.edges)[0]
+
+    def finish_pass(self):
+        """结束一轮遍历，返回是否已得到全部结果"""
+        if self.done:
+            return True
+        if self.counting:
+            values, inverse = np.unique(
+                np.concatenate([unique for unique, counts in self.values]), return_inverse=True
+            )
+            counts = np.bincount(inverse, weights=np.concatenate([counts for unique, counts in self.values]))
+            positions = self.below + np.cumsum(counts)
+            self.results = {
+                rank: float(values[np.searchsorted(positions, rank, side='right')]) for rank in self.ranks
+            }
+            return True
+
+        positions = self.below + np.cumsum(self.histogram)
+        bins = np.searchsorted(positions, self.ranks, side='right')
+        first, last = int(bins.min()), int(bins.max())
+        self.below = self.below + (int(self.histogram[:first].sum()) if first else 0)
+        self.inside = int(self.histogram[first:last + 1].sum())
+        # 分箱为左闭右开（最后一个分箱为闭区间），缩小后的范围取分箱的右边界时需排除该值
+        self.low = float(self.edges[first])
+        self.high = float(self.edges[last + 1]) if last == SELECT_BINS - 1 else float(
+            np.nextafter(self.edges[last + 1], -np.inf)
+        )
+        self._begin()
+        return self.done
+
+
+def select_ranks(open_values, count, ranks, minimum, maximum):
+    """
+    精确求多组值的指定名次
+
+    open_values() 每次返回产出 (组号, 数组) 的新生成器；count、ranks、minimum、maximum 为各组的
+    点数、名次、最小值和最大值列表。返回各组 {名次: 值}。
+    """
+    selectors = [RankSelector(*arguments) for arguments in zip(count, ranks, minimum, maximum)]
+    while not all(selector.done for selector in selectors):
+        for group, values in open_values():
+            selectors[group].feed(values)
+        for selector in selectors:
+            selector.finish_pass()
+    return [selector.results for selector in selectors]
+
+
+def median_ranks(count):
+    return [(count - 1) // 2, count // 2]
+
+
+def median_from_ranks(count, values):
+    """与 np.median 相同：偶数个值时取中间两个值的平均"""
+    low, high = median_ranks(count)
+    if low == high:
+        return values[low]
+    return float(np.mean([values[low], values[high]]))
+
+
+class CurveSampler:
+    """
+    分段累积降采样曲线，结果与 experiments.pyramid.downsample_columns 在整条曲线上的结果相同
+
+    按全局位置划分与整段计算相同的桶，跨段的桶在补齐后再选取最小、最大值点。
+    """
+
+    def __init__(self, length, max_points):
+        self.length = length
+        self.bucket_size = 0 if length <= max_points else -(-length // (max_points // 2))
+        self.pending = None
+        self.parts = []
+
+    def add(self, columns):
+        if self.pending is not None:
+            columns = {name: np.concatenate([self.pending[name], values]) for name, values in columns.items()}
+        length = len(columns['current'])
+        if not self.bucket_size:
+            self.parts.append(columns)
+            self.pending = None
+            return
+        complete = length - length % self.bucket_size
+        if complete:
+            head = {name: values[:complete] for name, values in columns.items()}
+            selected = minmax_indices(head['current'], self.bucket_size)
+            self.parts.append({name: values[selected] for name, values in head.items()})
+        self.pending = {name: values[complete:] for name, values in columns.items()}
+
+    def finish(self):
+        if self.pending is not None and len(self.pending['current']):
+            # 与整段计算相同，末尾不足一桶时用最后一个值补齐
+            current = self.pending['current']
+            if self.bucket_size > 2:
+                current = np.concatenate([current, np.full(self.bucket_size - len(current), current[-1])])
+            selected = np.minimum(minmax_indices(current, self.bucket_size), len(self.pending['current']) - 1)
+            self.parts.append({name: values[selected] for name, values in self.pending.items()})
+        self.pending = None
+        if not self.parts:
+            return {'voltage': [], 'current': []}
+        return {
+            name: np.concatenate([part[name] for part in self.parts]).tolist()
+            for name in ('voltage', 'current')
+        }
@@ -0,0 +1,236 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from experiments.models import Experiment
+from .analyzers import ANALYZERS, BaseAnalyzer
+from .executors import ProcessPoolJobExecutor
+from .cache import make_key, store
+from .models import AnalysisBatch, AnalysisJob, AnalysisMethod
+from .views import dispatch_analysis_batch, dispatch_analysis_job, run_analysis_task
+
+
+def cv_trace(n, cycles=2, seed=0):
+    """合成的循环伏安曲线列数组"""
+    rng = np.random.default_rng(seed)
+    per = n // cycles
+    half = per // 2
+    voltage = np.tile(np.concatenate([np.linspace(-0.4, 0.6, half), np.linspace(0.6, -0.4, per - half)]), cycles)
+    current = 2e-6 * voltage + 1e-5 * np.exp(-((voltage - 0.25) / 0.05) ** 2) + rng.normal(0, 1e-7, len(voltage))
+    return {
+        'timestamp': (1704067200_000000 + np.arange(len(voltage)) * 1000).astype('<i8'),
+        'voltage': voltage,
+        'current': current,
+        'cycle': np.repeat(np.arange(1, cycles + 1), per).astype('<i4'),
+    }
+
+
+class StreamingAnalysisTests(TestCase):
+    """点数达到 ANALYSIS_STREAMING_MIN_POINTS 时 analyze 按分块流式计算，结果与 compute 一致"""
+
+    def setUp(self):
+        user = User.objects.create_user('analyst', password='password')
+        self.experiment = Experiment.objects.create(
+            user=user, experiment_type='CV', start_voltage=-0.4, end_voltage=0.6, scan_rate=50, status='completed',
+        )
+        self.experiment.trace.append(cv_trace(20000))
+        self.experiment.refresh_from_db()
+
+    def assert_matches(self, expected, actual, path=''):
+        """曲线逐点相同，汇总统计量允许浮点舍入误差"""
+        if isinstance(expected, dict):
+            self.assertEqual(list(expected), list(actual), path)
+            for key in expected:
+                self.assert_matches(expected[key], actual[key], f'{path}.{key}')
+        elif isinstance(expected, list):
+            self.assertEqual(len(expected), len(actual), path)
+            if path.endswith(('voltage', 'current')):
+                self.assertEqual(expected, actual, path)
+            else:
+                for left, right in zip(expected, actual):
+                    self.assert_matches(left, right, path)
+        elif isinstance(expected, float):
+            self.assertTrue(np.isclose(expected, actual, rtol=1e-9, atol=1e-18), (path, expected, actual))
+        else:
+            self.assertEqual(expected, actual, path)
+
+    @override_settings(ANALYSIS_STREAMING_MIN_POINTS=10000, ANALYSIS_STREAMING_WINDOW_POINTS=2000)
+    def test_streaming_matches_compute(self):
+        for name in ('smoothing', 'baseline_correction', 'integration'):
+            analyzer = ANALYZERS[name]()
+            expected = analyzer.compute(analyzer.load(self.experiment), {})
+            with mock.patch.object(BaseAnalyzer, 'load', side_effect=AssertionError('trace read into memory')):
+                actual = analyzer.analyze(self.experiment, {})
+            self.assert_matches(expected, actual, name)
+
+    @override_settings(ANALYSIS_STREAMING_MIN_POINTS=30000)
+    def test_small_trace_is_computed_in_memory(self):
+        analyzer = ANALYZERS['smoothing']()
+        with mock.patch.object(type(analyzer), 'stream') as stream:
+            analyzer.analyze(self.experiment, {})
+        stream.assert_not_called()
+
+
+@mock.patch('analysis.views.get_executor')
+class CoalescedJobTests(TestCase):
+    """相同缓存键的任务只在合并到执行任务（leader）上时随其完成或失败"""
+
+    def setUp(self):
+        user = User.objects.create_user('analyst', password='password')
+        self.experiment = Experiment.objects.create(
+            user=user, experiment_type='CV', start_voltage=-0.4, end_voltage=0.6, scan_rate=50, status='completed',
+        )
+        self.experiment.trace.append(cv_trace(2000))
+        self.experiment.refresh_from_db()
+        self.method = AnalysisMethod.objects.create(name='平滑', analysis_type='smoothing')
+
+    def submit(self):
+        job = AnalysisJob.objects.create(experiment=self.experiment, method=self.method)
+        dispatch_analysis_job(job)
+        return job
+
+    def status(self, job):
+        job.refresh_from_db()
+        return job.status
+
+    def test_completion_finishes_only_followers(self, get_executor):
+        leader = self.submit()
+        follower = self.submit()
+        self.assertEqual(follower.leader_id, leader.id)
+        self.assertEqual(get_executor.return_value.submit.call_count, 1)
+
+        # 超时后提交的任务单独执行，并接管等待中的任务
+        AnalysisJob.objects.filter(id=leader.id).update(created_at=timezone.now() - timedelta(hours=2))
+        independent = self.submit()
+        self.assertIsNone(independent.leader_id)
+        self.assertEqual(get_executor.return_value.submit.call_count, 2)
+
+        run_analysis_task(leader.id)
+        self.assertEqual(self.status(leader), 'completed')
+        self.assertEqual(self.status(independent), 'pending')
+        self.assertEqual(self.status(follower), 'pending')
+        self.assertEqual(follower.leader_id, independent.id)
+
+        run_analysis_task(independent.id)
+        self.assertEqual(self.status(follower), 'completed')
+
+    def test_failure_propagates_only_to_followers(self, get_executor):
+        leader = self.submit()
+        follower = self.submit()
+        AnalysisJob.objects.filter(id=leader.id).update(created_at=timezone.now() - timedelta(hours=2))
+        AnalysisJob.objects.filter(id=follower.id).update(leader=None)
+        independent = self.submit()
+        follower_of_leader = AnalysisJob.objects.create(
+            experiment=self.experiment, method=self.method, cache_key=leader.cache_key, leader=independent,
+        )
+
+        with mock.patch('analysis.views.cached', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                run_analysis_task(independent.id)
+        self.assertEqual(self.status(independent), 'failed')
+        self.assertEqual(self.status(follower_of_leader), 'failed')
+        self.assertEqual(self.status(leader), 'pending')
+        self.assertEqual(self.status(follower), 'pending')
+
+    def test_batch_cache_hits_complete_in_one_update(self, get_executor):
+        experiments = [self.experiment] + [
+            Experiment.objects.create(
+                user=self.experiment.user, experiment_type='CV', start_voltage=-0.4, end_voltage=0.6, scan_rate=50,
+            )
+            for _ in range(2)
+        ]
+        batch = AnalysisBatch.objects.create(user=self.experiment.user)
+        jobs = []
+        for number, experiment in enumerate(experiments):
+            key = make_key(experiment, 'smoothing', {})
+            store(key, experiment, 'smoothing', {}, {'experiment': number, 'values': [0.5] * 50})
+            jobs.append(AnalysisJob.objects.create(experiment=experiment, method=self.method, batch=batch, cache_key=key))
+
+        # 待执行任务、执行中任务、读取缓存、更新命中次数，以及一条完成全部任务的更新
+        with self.assertNumQueries(5):
+            dispatch_analysis_batch(batch)
+        get_executor.return_value.submit_many.assert_not_called()
+        for number, job in enumerate(jobs):
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'completed')
+            self.assertEqual(job.result_data, {'experiment': number, 'values': [0.5] * 50})
+
+
+class BrokenProcessPoolTests(TestCase):
+    """工作进程异常退出后换用新进程池，未完成的任务标记为失败"""
+
+    def setUp(self):
+        user = User.objects.create_user('analyst', password='password')
+        experiment = Experiment.objects.create(
+            user=user, experiment_type='CV', start_voltage=-0.4, end_voltage=0.6, scan_rate=50, status='completed',
+        )
+        method = AnalysisMethod.objects.create(name='平滑', analysis_type='smoothing')
+        self.job = AnalysisJob.objects.create(experiment=experiment, method=method, status='running')
+        self.follower = AnalysisJob.objects.create(experiment=experiment, method=method, leader=self.job)
+        self.executor = ProcessPoolJobExecutor(workers=1, queue_size=1)
+
+    def test_submit_replaces_broken_pool(self):
+        broken, fresh = mock.Mock(), mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool('worker died')
+        fresh.submit.return_value = Future()
+        with mock.patch.object(self.executor, '_new_pool', side_effect=[broken, fresh]):
+            self.executor.submit(self.job.id)
+        broken.shutdown.assert_called_once_with(wait=False)
+        fresh.submit.assert_called_once()
+        self.assertIs(self.executor._pool, fresh)
+
+    def test_broken_pool_fails_jobs(self):
+        future = Future()
+        fresh = mock.Mock()
+        fresh.submit.return_value = future
+        with mock.patch.object(self.executor, '_new_pool', return_value=fresh):
+            self.executor.submit_many([self.job.id])
+        with mock.patch('django.db.connection.close'):
+            future.set_exception(BrokenProcessPool('worker died'))
+        for job in (self.job, self.follower):
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'failed')
+            self.assertIn('worker died', job.error_message)
+        # 排队位置已释放
+        self.assertTrue(self.executor._slots.acquire(blocking=False))
+
+
+class PipelineValidationTests(TestCase):
+    """格式错误的参数和步骤返回 400 而不是服务器错误"""
+
+    def setUp(self):
+        user = User.objects.create_user('analyst', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.experiment = Experiment.objects.create(
+            user=user, experiment_type='CV', start_voltage=-0.4, end_voltage=0.6, scan_rate=50, status='completed',
+        )
+        self.smoothing = AnalysisMethod.objects.create(name='平滑', analysis_type='smoothing')
+        self.pipeline = AnalysisMethod.objects.create(
+            name='流水线', analysis_type='pipeline', parameters={'steps': [{'method': self.smoothing.pk}]},
+        )
+
+    def create_job(self, method, parameters):
+        return self.client.post('/api/analysis/jobs/', {
+            'experiment': self.experiment.pk, 'method': method.pk, 'parameters': parameters,
+        }, format='json')
+
+    def test_parameters_must_be_an_object(self):
+        for method in (self.pipeline, self.smoothing):
+            for parameters in ([1, 2], 'steps', 3):
+                response = self.create_job(method, parameters)
+                self.assertEqual(response.status_code, 400, (method.analysis_type, parameters))
+                self.assertIn('parameters', response.json())
+
+    def test_step_method_must_be_an_id(self):
+        for method in ([self.smoothing.pk], {'id': self.smoothing.pk}, True):
+            response = self.create_job(self.pipeline, {'steps': [{'method': method}]})
+            self.assertEqual(response.status_code, 400, method)
+            self.assertIn('parameters', response.json())
@@ -0,0 +1,15 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from . import views
+
+router = DefaultRouter()
+router.register(r'methods', views.AnalysisMethodViewSet)
+router.register(r'jobs', views.AnalysisJobViewSet, basename='analysis-job')
+router.register(r'batches', views.AnalysisBatchViewSet, basename='analysis-batch')
+router.register(r'peak-analysis', views.PeakAnalysisViewSet, basename='peak-analysis')
+router.register(r'statistical-analysis', views.StatisticalAnalysisViewSet, basename='statistical-analysis')
+router.register(r'comparisons', views.ComparisonAnalysisViewSet, basename='comparison')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
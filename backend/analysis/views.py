@@ -1,27 +1,38 @@
-from rest_framework import viewsets, status
+import logging
+
+from django.conf import settings
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from experiments.models import Experiment, ExperimentDataPoint
-from .models import AnalysisMethod, AnalysisJob, PeakAnalysis, StatisticalAnalysis, ComparisonAnalysis
+from electrochemical.caching import CachedReadMixin
+from experiments.models import Experiment
+from .models import AnalysisMethod, AnalysisBatch, AnalysisJob, PeakAnalysis, StatisticalAnalysis, ComparisonAnalysis
 from .serializers import (
-    AnalysisMethodSerializer, AnalysisJobSerializer, PeakAnalysisSerializer,
-    StatisticalAnalysisSerializer, ComparisonAnalysisSerializer
-)
-from .analyzers import (
-    PeakDetectionAnalyzer, BaselineCorrectionAnalyzer, SmoothingAnalyzer,
-    IntegrationAnalyzer, StatisticalAnalyzer
+    AnalysisMethodSerializer, AnalysisBatchSerializer, AnalysisJobSerializer, PeakAnalysisSerializer,
+    StatisticalAnalysisSerializer, ComparisonAnalysisSerializer, ComparisonRunSerializer, status_count_annotations
 )
-import numpy as np
+from .analyzers import ANALYZERS, PeakDetectionAnalyzer, StatisticalAnalyzer
+from .pipeline import PIPELINE_TYPE, effective_parameters, run_pipeline
+from .cache import cached, lookup, lookup_many, make_key
+from .comparison import compare_experiments
+from .executors import JobQueueFull, get_executor
+from .signals import METHODS_NAMESPACE
 from celery import shared_task
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_CHUNK_SIZE = 50
+DEFAULT_JOB_STALE_SECONDS = 3600
 
-class AnalysisMethodViewSet(viewsets.ReadOnlyModelViewSet):
-    """分析方法视图集"""
+
+class AnalysisMethodViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
+    """分析方法视图集，列表和详情缓存"""
     queryset = AnalysisMethod.objects.filter(is_active=True)
     serializer_class = AnalysisMethodSerializer
     permission_classes = [IsAuthenticated]
+    cache_namespace = METHODS_NAMESPACE
 
 
 class AnalysisJobViewSet(viewsets.ModelViewSet):
@@ -30,14 +41,14 @@ class AnalysisJobViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return AnalysisJob.objects.filter(experiment__user=self.request.user)
+        return AnalysisJob.objects.filter(experiment__user=self.request.user).select_related('method')
     
     def perform_create(self, serializer):
         """创建分析任务"""
         analysis_job = serializer.save()
         
-        # 异步执行分析任务
-        run_analysis_task.delay(analysis_job.id)
+        # 异步执行分析任务（命中缓存或有相同任务执行中时不重复计算）
+        dispatch_analysis_job(analysis_job)
         
         return analysis_job
     
@@ -53,10 +64,11 @@ class AnalysisJobViewSet(viewsets.ModelViewSet):
         
         job.status = 'pending'
         job.error_message = ''
+        job.leader = None
         job.save()
         
         # 重新执行任务
-        run_analysis_task.delay(job.id)
+        dispatch_analysis_job(job)
         
         return Response({
             'message': 'Analysis job restarted',
@@ -64,6 +76,52 @@ class AnalysisJobViewSet(viewsets.ModelViewSet):
         })
 
 
+class AnalysisBatchViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """批量分析视图集"""
+    serializer_class = AnalysisBatchSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return AnalysisBatch.objects.filter(user=self.request.user).annotate(
+            **status_count_annotations()
+        ).prefetch_related('methods').order_by('-created_at')
+    
+    def perform_create(self, serializer):
+        """创建批量分析的全部任务并分组提交"""
+        batch = serializer.save(user=self.request.user)
+        dispatch_analysis_batch(batch)
+        # 返回提交后的进度
+        serializer.instance = self.get_queryset().get(pk=batch.pk)
+    
+    @action(detail=True, methods=['get'])
+    def jobs(self, request, pk=None):
+        """批量分析中的任务，可按 status 筛选"""
+        batch = self.get_object()
+        jobs = batch.jobs.select_related('method').order_by('id')
+        if request.query_params.get('status'):
+            jobs = jobs.filter(status=request.query_params['status'])
+        
+        page = self.paginate_queryset(jobs)
+        if page is not None:
+            return self.get_paginated_response(AnalysisJobSerializer(page, many=True).data)
+        return Response(AnalysisJobSerializer(jobs, many=True).data)
+    
+    @action(detail=True, methods=['post'])
+    def retry_failed(self, request, pk=None):
+        """重新提交批量分析中失败的任务"""
+        batch = self.get_object()
+        failed = batch.jobs.filter(status='failed')
+        jobs = list(failed.order_by('id').values_list('id', 'cache_key'))
+        retried = failed.update(status='pending', error_message='', completed_at=None, leader=None)
+        if retried:
+            dispatch_analysis_batch(batch, jobs)
+        
+        return Response({
+            'message': f'{retried} jobs restarted',
+            'batch': self.get_serializer(self.get_queryset().get(pk=batch.pk)).data
+        })
+
+
 class PeakAnalysisViewSet(viewsets.ReadOnlyModelViewSet):
     """峰值分析视图集"""
     serializer_class = PeakAnalysisSerializer
@@ -85,25 +143,33 @@ class PeakAnalysisViewSet(viewsets.ReadOnlyModelViewSet):
                 'error': 'Experiment not found'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # 执行峰值分析
-        analyzer = PeakDetectionAnalyzer()
-        results = analyzer.analyze(experiment, parameters)
-        
-        # 保存结果
-        peak_analyses = []
-        for result in results:
-            peak_analysis = PeakAnalysis.objects.create(
-                experiment=experiment,
-                peak_voltage=result['voltage'],
-                peak_current=result['current'],
-                peak_height=result['height'],
-                peak_area=result.get('area', 0),
-                peak_width=result.get('width', 0),
-                peak_index=result['index'],
-                peak_type=result.get('type', 'anodic'),
-                confidence=result.get('confidence', 0.0)
+        # 相同数据版本和参数的峰值分析已保存时直接返回
+        key = make_key(experiment, PeakDetectionAnalyzer.analysis_type, parameters)
+        peak_analyses = list(PeakAnalysis.objects.filter(experiment=experiment, cache_key=key))
+        if not peak_analyses:
+            # 执行峰值分析
+            analyzer = PeakDetectionAnalyzer()
+            key, results, hit = cached(
+                experiment, analyzer.analysis_type, parameters,
+                lambda: analyzer.analyze(experiment, parameters)
             )
-            peak_analyses.append(peak_analysis)
+            
+            # 保存结果
+            for result in results:
+                peak_analysis = PeakAnalysis.objects.create(
+                    experiment=experiment,
+                    peak_voltage=result['voltage'],
+                    peak_current=result['current'],
+                    peak_height=result['height'],
+                    peak_area=result.get('area', 0),
+                    peak_width=result.get('width', 0),
+                    peak_index=result['index'],
+                    peak_type=result.get('type', 'anodic'),
+                    sweep=result.get('sweep') or '',
+                    confidence=result.get('confidence', 0.0),
+                    cache_key=key
+                )
+                peak_analyses.append(peak_analysis)
         
         serializer = PeakAnalysisSerializer(peak_analyses, many=True)
         return Response({
@@ -132,27 +198,39 @@ class StatisticalAnalysisViewSet(viewsets.ReadOnlyModelViewSet):
                 'error': 'Experiment not found'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # 执行统计分析
-        analyzer = StatisticalAnalyzer()
-        results = analyzer.analyze(experiment)
-        
-        # 保存结果
-        statistical_analysis = StatisticalAnalysis.objects.create(
-            experiment=experiment,
-            current_mean=results['current_stats']['mean'],
-            current_std=results['current_stats']['std'],
-            current_min=results['current_stats']['min'],
-            current_max=results['current_stats']['max'],
-            current_median=results['current_stats']['median'],
-            voltage_mean=results['voltage_stats']['mean'],
-            voltage_std=results['voltage_stats']['std'],
-            voltage_min=results['voltage_stats']['min'],
-            voltage_max=results['voltage_stats']['max'],
-            voltage_median=results['voltage_stats']['median'],
-            data_points_count=results['data_points_count'],
-            signal_to_noise_ratio=results.get('snr'),
-            analysis_data=results
-        )
+        # 相同数据版本的统计分析已保存时直接返回
+        key = make_key(experiment, StatisticalAnalyzer.analysis_type, {})
+        statistical_analysis = StatisticalAnalysis.objects.filter(experiment=experiment, cache_key=key).first()
+        if statistical_analysis is None:
+            # 执行统计分析
+            analyzer = StatisticalAnalyzer()
+            try:
+                key, results, hit = cached(
+                    experiment, analyzer.analysis_type, {}, lambda: analyzer.analyze(experiment)
+                )
+            except ValueError as e:
+                return Response({
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # 保存结果
+            statistical_analysis = StatisticalAnalysis.objects.create(
+                experiment=experiment,
+                current_mean=results['current_stats']['mean'],
+                current_std=results['current_stats']['std'],
+                current_min=results['current_stats']['min'],
+                current_max=results['current_stats']['max'],
+                current_median=results['current_stats']['median'],
+                voltage_mean=results['voltage_stats']['mean'],
+                voltage_std=results['voltage_stats']['std'],
+                voltage_min=results['voltage_stats']['min'],
+                voltage_max=results['voltage_stats']['max'],
+                voltage_median=results['voltage_stats']['median'],
+                data_points_count=results['data_points_count'],
+                signal_to_noise_ratio=results.get('snr'),
+                analysis_data=results,
+                cache_key=key
+            )
         
         serializer = StatisticalAnalysisSerializer(statistical_analysis)
         return Response({
@@ -167,21 +245,31 @@ class ComparisonAnalysisViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return ComparisonAnalysis.objects.filter(experiments__user=self.request.user).distinct()
+        return ComparisonAnalysis.objects.filter(
+            experiments__user=self.request.user
+        ).distinct().prefetch_related('experiments')
     
     @action(detail=True, methods=['post'])
     def run_comparison(self, request, pk=None):
         """运行比较分析"""
         comparison = self.get_object()
         
-        experiments = comparison.experiments.all()
-        if experiments.count() < 2:
+        experiments = list(comparison.experiments.all())
+        if len(experiments) < 2:
             return Response({
                 'error': 'At least 2 experiments are required for comparison'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        params = ComparisonRunSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        
         # 执行比较分析
-        results = self._perform_comparison(experiments)
+        try:
+            results = compare_experiments(experiments, params.validated_data['grid_points'])
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         # 保存结果
         comparison.comparison_data = results
@@ -192,49 +280,166 @@ class ComparisonAnalysisViewSet(viewsets.ModelViewSet):
             'message': 'Comparison analysis completed',
             'comparison': ComparisonAnalysisSerializer(comparison).data
         })
-    
-    def _perform_comparison(self, experiments):
-        """执行比较分析"""
-        comparison_data = {
-            'experiments': [],
-            'statistics': {},
-            'correlation_matrix': {},
-            'peak_comparison': {}
-        }
-        
-        # 收集实验数据
-        experiment_data = []
-        for exp in experiments:
-            data_points = exp.data_points.all()
-            voltages = [dp.voltage for dp in data_points]
-            currents = [dp.current for dp in data_points]
-            
-            experiment_data.append({
-                'id': exp.id,
-                'name': exp.name,
-                'type': exp.experiment_type,
-                'voltages': voltages,
-                'currents': currents,
-                'data_points_count': len(voltages)
-            })
-        
-        comparison_data['experiments'] = experiment_data
-        
-        # 计算相关性（如果有多个实验）
-        if len(experiment_data) >= 2:
-            # 简单的相关性计算
-            exp1_currents = np.array(experiment_data[0]['currents'])
-            exp2_currents = np.array(experiment_data[1]['currents'])
-            
-            # 确保长度一致
-            min_len = min(len(exp1_currents), len(exp2_currents))
-            exp1_currents = exp1_currents[:min_len]
-            exp2_currents = exp2_currents[:min_len]
-            
-            correlation = np.corrcoef(exp1_currents, exp2_currents)[0, 1]
-            comparison_data['correlation_coefficient'] = float(correlation)
-        
-        return comparison_data
+
+
+def _finish_jobs(job, **fields):
+    """结束合并到 job 上、等待其结果的任务"""
+    from django.utils import timezone
+
+    AnalysisJob.objects.filter(leader=job, status='pending').update(completed_at=timezone.now(), **fields)
+
+
+def fail_jobs(job_ids, message):
+    """将未能执行完成的任务（如工作进程异常退出）及合并到它们上的任务标记为失败"""
+    from django.db.models import Q
+    from django.utils import timezone
+
+    AnalysisJob.objects.filter(
+        Q(id__in=job_ids) | Q(leader_id__in=job_ids), status__in=['pending', 'running']
+    ).update(status='failed', error_message=message, completed_at=timezone.now())
+
+
+def _adopt_followers(leaders):
+    """
+    新提交的任务接管相同缓存键上的等待任务，leaders 为 {缓存键: 任务ID}
+
+    原执行任务已超时（见 _in_flight_jobs）时，合并到它上面的任务改为等待新提交的任务；
+    须在提交前调用，避免新任务完成时尚未接管。
+    """
+    from django.db.models import Case, Value, When
+
+    if not leaders:
+        return
+    AnalysisJob.objects.filter(
+        cache_key__in=list(leaders), status='pending', leader__isnull=False
+    ).exclude(leader__in=_in_flight_jobs(leaders)).update(
+        leader=Case(*[When(cache_key=key, then=Value(job_id)) for key, job_id in leaders.items()])
+    )
+
+
+def _in_flight_jobs(keys):
+    """
+    缓存键在 keys 中、尚未超时的待执行或执行中的任务
+
+    创建（待执行）或开始执行后超过 ANALYSIS_JOB_STALE_SECONDS 秒的任务视为已丢失（进程池重启、
+    worker 被终止等），不再等待其结果；新任务照常提交，并接管合并到这些任务上的等待任务。
+    只返回实际提交执行的任务，合并到其他任务上的等待任务除外。
+    """
+    from datetime import timedelta
+    from django.db.models import Q
+    from django.utils import timezone
+
+    stale_seconds = getattr(settings, 'ANALYSIS_JOB_STALE_SECONDS', DEFAULT_JOB_STALE_SECONDS)
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+    return AnalysisJob.objects.filter(cache_key__in=list(keys), leader__isnull=True).filter(
+        Q(status='pending', created_at__gte=cutoff) | Q(status='running', started_at__gte=cutoff)
+    )
+
+
+def dispatch_analysis_job(job):
+    """
+    提交分析任务
+
+    缓存命中时直接完成；已有相同缓存键的任务在执行时不重复提交，合并到该任务（leader），
+    由该任务完成后一并写入结果（超时的任务除外，见 _in_flight_jobs）。
+    """
+    from django.utils import timezone
+
+    job.cache_key = make_key(job.experiment, job.method.analysis_type, effective_parameters(job.method, job.parameters))
+    job.save(update_fields=['cache_key'])
+
+    leader = _in_flight_jobs([job.cache_key]).filter(id__lt=job.id).order_by('id').first()
+    if leader is not None:
+        job.leader = leader
+        job.save(update_fields=['leader'])
+        return
+
+    result = lookup(job.cache_key)
+    if result is not None:
+        job.result_data = result
+        job.status = 'completed'
+        job.completed_at = timezone.now()
+        job.save(update_fields=['result_data', 'status', 'completed_at'])
+        return
+
+    _adopt_followers({job.cache_key: job.id})
+    try:
+        get_executor().submit(job.id)
+    except JobQueueFull as e:
+        job.status = 'failed'
+        job.error_message = str(e.detail)
+        job.save(update_fields=['status', 'error_message'])
+        _finish_jobs(job, status='failed', error_message=job.error_message)
+        raise
+
+
+def dispatch_analysis_batch(batch, jobs=None):
+    """
+    提交批量分析中的任务，jobs 为 [(任务ID, 缓存键)]，默认为全部待执行任务
+
+    与 dispatch_analysis_job 相同：缓存命中的任务直接完成，与执行中（未超时）的任务或批内其他任务
+    缓存键相同的任务合并到该任务，等待其结果。其余任务每 ANALYSIS_BATCH_CHUNK_SIZE 个为一组提交，
+    每组只占用一条任务消息；队列已满时剩余任务标记为失败，可稍后重试。
+    """
+    from django.db.models import Case, Q, Value, When
+    from django.utils import timezone
+
+    if jobs is None:
+        jobs = list(batch.jobs.filter(status='pending').order_by('id').values_list('id', 'cache_key'))
+    ids = {job_id for job_id, _ in jobs}
+    keys = {key for _, key in jobs}
+    in_flight = {}
+    for job_id, key in _in_flight_jobs(keys).exclude(id__in=ids).order_by('id').values_list('id', 'cache_key'):
+        in_flight.setdefault(key, job_id)
+
+    results = lookup_many(keys - set(in_flight))
+    if results:
+        field = AnalysisJob._meta.get_field('result_data')
+        batch.jobs.filter(cache_key__in=list(results), status='pending').update(
+            status='completed', completed_at=timezone.now(),
+            result_data=Case(
+                *[When(cache_key=key, then=Value(result, output_field=field)) for key, result in results.items()],
+                output_field=field,
+            ),
+        )
+
+    # 每个缓存键只执行第一个任务，其余任务合并到该任务或批外执行中的任务
+    first = {}
+    for job_id, key in jobs:
+        if key not in in_flight and key not in results:
+            first.setdefault(key, job_id)
+    leaders = {**in_flight, **first}
+    followers = [job_id for job_id, key in jobs if key in leaders and job_id != leaders[key]]
+    if followers:
+        AnalysisJob.objects.filter(id__in=followers).update(
+            leader=Case(*[When(cache_key=key, then=Value(job_id)) for key, job_id in leaders.items()])
+        )
+    _adopt_followers(first)
+    job_ids = list(first.values())
+
+    size = getattr(settings, 'ANALYSIS_BATCH_CHUNK_SIZE', DEFAULT_BATCH_CHUNK_SIZE)
+    executor = get_executor()
+    for start in range(0, len(job_ids), size):
+        try:
+            executor.submit_many(job_ids[start:start + size])
+        except JobQueueFull as e:
+            rejected = job_ids[start:]
+            AnalysisJob.objects.filter(Q(id__in=rejected) | Q(leader_id__in=rejected), status='pending').update(
+                status='failed', error_message=str(e.detail), completed_at=timezone.now()
+            )
+            logger.warning('Analysis batch %s: %d jobs rejected, queue is full', batch.id, len(job_ids) - start)
+            break
+
+
+@shared_task
+def run_analysis_jobs_task(job_ids):
+    """Celery任务：依次运行一组分析任务，单个任务失败不影响其余任务"""
+    for job_id in job_ids:
+        try:
+            run_analysis_task(job_id)
+        except Exception:
+            # 失败信息已记录在任务中
+            logger.exception('Analysis job %s failed', job_id)
 
 
 @shared_task
@@ -243,35 +448,38 @@ def run_analysis_task(job_id):
     from django.utils import timezone
     
     try:
-        job = AnalysisJob.objects.get(id=job_id)
+        job = AnalysisJob.objects.select_related('experiment', 'method').get(id=job_id)
         job.status = 'running'
         job.started_at = timezone.now()
         job.save()
         
-        # 获取分析器
-        analyzer_map = {
-            'peak_detection': PeakDetectionAnalyzer,
-            'baseline_correction': BaselineCorrectionAnalyzer,
-            'smoothing': SmoothingAnalyzer,
-            'integration': IntegrationAnalyzer,
-            'statistical_analysis': StatisticalAnalyzer,
-        }
-        
-        analyzer_class = analyzer_map.get(job.method.analysis_type)
-        if not analyzer_class:
-            raise ValueError(f"Unknown analysis type: {job.method.analysis_type}")
+        def compute():
+            if job.method.analysis_type == PIPELINE_TYPE:
+                # 流水线：只读取一次数据，依次执行各步骤
+                return run_pipeline(job.experiment, parameters['steps'])
+            
+            # 获取分析器
+            analyzer_class = ANALYZERS.get(job.method.analysis_type)
+            if not analyzer_class:
+                raise ValueError(f"Unknown analysis type: {job.method.analysis_type}")
+            
+            analyzer = analyzer_class()
+            return analyzer.analyze(job.experiment, parameters)
         
-        analyzer = analyzer_class()
-        results = analyzer.analyze(job.experiment, job.parameters)
+        parameters = {**job.method.parameters, **job.parameters}
+        key, results, hit = cached(job.experiment, job.method.analysis_type, effective_parameters(job.method, job.parameters), compute)
         
-        # 保存结果
+        # 保存结果，合并到本任务的任务一并完成
+        job.cache_key = key
         job.result_data = results
         job.status = 'completed'
         job.completed_at = timezone.now()
         job.save()
+        _finish_jobs(job, status='completed', result_data=results)
         
     except Exception as e:
         job.status = 'failed'
         job.error_message = str(e)
         job.save()
+        _finish_jobs(job, status='failed', error_message=str(e))
         raise e
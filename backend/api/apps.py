@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # 在建立数据库连接之前注册查询统计
+        from electrochemical import metrics  # noqa: F401
+        from . import signals  # noqa: F401
@@ -0,0 +1,86 @@
+import hashlib
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+DEFAULT_TOKEN_CACHE_TIMEOUT = 300
+# 已注销令牌的标记，在缓存中保留一个有效期，防止注销前读取到令牌的并发请求重新写入缓存
+REVOKED = 'revoked'
+
+
+def get_token_cache_timeout():
+    return getattr(settings, 'TOKEN_CACHE_TIMEOUT', DEFAULT_TOKEN_CACHE_TIMEOUT)
+
+
+def _cache_key(key):
+    # 缓存键不包含令牌原文
+    return 'api:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def forget_token(key):
+    """用户信息变化后删除缓存的认证结果，下次请求重新查询"""
+    cache.delete(_cache_key(key))
+
+
+def revoke_token(key):
+    """令牌删除（注销）后立即失效"""
+    cache.set(_cache_key(key), REVOKED, get_token_cache_timeout())
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    带缓存的令牌认证
+
+    与 TokenAuthentication 相同，但令牌对应的 (用户, 令牌) 在 Django 缓存中保存
+    TOKEN_CACHE_TIMEOUT 秒，命中时认证不查询数据库。令牌删除时（注销、删除用户）立即失效，
+    用户保存时重新查询（见 api.signals）。locmem 缓存的失效只在本进程内有效，
+    多进程部署应使用文件或 Redis 缓存，否则其他进程中已注销的令牌最长在有效期内仍可使用。
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _cache_key(key)
+        cached = cache.get(cache_key)
+        if cached == REVOKED:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        # add 不会覆盖并发注销写入的标记
+        cache.add(cache_key, (user, token), get_token_cache_timeout())
+        return user, token
+
+
+@database_sync_to_async
+def get_token_user(key):
+    try:
+        return CachedTokenAuthentication().authenticate_credentials(key)[0]
+    except exceptions.AuthenticationFailed:
+        return AnonymousUser()
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    WebSocket令牌认证
+
+    支持 Authorization: Token <key> 请求头；浏览器无法为WebSocket设置请求头，
+    也可通过查询参数 token 传递。
+    """
+    
+    async def __call__(self, scope, receive, send):
+        key = None
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                parts = value.decode().split()
+                if len(parts) == 2 and parts[0].lower() == 'token':
+                    key = parts[1]
+        if key is None:
+            key = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        
+        scope = dict(scope, user=await get_token_user(key) if key else AnonymousUser())
+        return await super().__call__(scope, receive, send)
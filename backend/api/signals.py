@@ -0,0 +1,22 @@
+"""
+令牌认证缓存的失效（见 api.authentication.CachedTokenAuthentication）
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, revoke_token
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    revoke_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    # 用户信息或状态（is_active）变化后，缓存的用户对象需要重新读取
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            forget_token(key)
@@ -6,4 +6,5 @@ urlpatterns = [
     path('profile/', views.UserProfileView.as_view(), name='profile'),
     path('system-info/', views.SystemInfoView.as_view(), name='system-info'),
     path('health/', views.HealthCheckView.as_view(), name='health'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
@@ -2,10 +2,14 @@ from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
+from django.conf import settings
+from django.http import HttpResponse
+from electrochemical.metrics import REGISTRY
+import hmac
 import json
 
 
@@ -139,3 +143,25 @@ class HealthCheckView(APIView):
             'timestamp': json.dumps(request.build_absolute_uri(), default=str),
             'version': '1.0.0'
         })
+
+
+class MetricsView(APIView):
+    """运行指标（Prometheus文本格式），设置了 METRICS_TOKEN 时以 Bearer 令牌访问，否则仅限管理员"""
+
+    def get_authenticators(self):
+        if getattr(settings, 'METRICS_TOKEN', ''):
+            return []
+        return super().get_authenticators()
+
+    def get_permissions(self):
+        if getattr(settings, 'METRICS_TOKEN', ''):
+            return []
+        return [IsAdminUser()]
+
+    def get(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token:
+            supplied = request.META.get('HTTP_AUTHORIZATION', '')
+            if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+                return HttpResponse('Unauthorized\n', status=401, content_type='text/plain; charset=utf-8')
+        return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -2,6 +2,8 @@
 ASGI config for electrochemical project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections are routed to the
+experiment stream consumers.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'electrochemical.settings')
 
-application = get_asgi_application()
+# 先初始化Django，再导入依赖模型的模块
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from api.authentication import TokenAuthMiddleware  # noqa: E402
+from experiments.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
+})
@@ -0,0 +1,100 @@
+"""
+接口数据缓存
+
+基于 Django 缓存框架（CACHES，locmem、文件或 Redis 后端均可）缓存很少变化的查询结果和
+序列化数据。缓存项属于一个或多个命名空间，每个命名空间在缓存中保存一个版本号，缓存键包含
+各命名空间的当前版本；数据变化时（各应用 signals.py 中的保存、删除信号）更新命名空间的版本号，
+旧缓存项不再被读取，到期后淘汰。
+
+版本号在事务提交后才更新，提交前读取到的旧数据只会写入旧版本的缓存键。locmem 后端的
+缓存和失效只在本进程内有效，多进程部署应使用文件或 Redis 后端（见 CACHE_BACKEND）。
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+PREFIX = 'api'
+DEFAULT_TIMEOUT = 300
+
+
+def get_timeout():
+    return getattr(settings, 'API_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _version_keys(namespaces):
+    return [f'{PREFIX}:ns:{namespace}' for namespace in namespaces]
+
+
+def _versions(namespaces):
+    keys = _version_keys(namespaces)
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # 版本号丢失时使用新的版本号，不会与淘汰前的旧缓存项冲突；并发时以先写入的为准
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+class Entry:
+    """一个缓存项，键由名称、命名空间的当前版本和 key 确定"""
+
+    def __init__(self, name, namespaces, key):
+        digest = hashlib.sha1(repr((key, _versions(namespaces))).encode()).hexdigest()
+        self.key = f'{PREFIX}:{name}:{digest}'
+
+    def get(self):
+        return cache.get(self.key)
+
+    def set(self, value):
+        cache.set(self.key, value, get_timeout())
+        return value
+
+    async def aget(self):
+        return await cache.aget(self.key)
+
+    async def aset(self, value):
+        await cache.aset(self.key, value, get_timeout())
+        return value
+
+
+def invalidate(*namespaces):
+    """更新命名空间的版本号，使其中的缓存项失效；在事务中调用时于提交后生效"""
+    keys = _version_keys(namespaces)
+    transaction.on_commit(lambda: cache.set_many({key: time.time_ns() for key in keys}, None))
+
+
+class CachedReadMixin:
+    """
+    缓存视图集 list 和 retrieve 的响应数据
+
+    cache_namespace 为缓存所属的命名空间；cache_per_user 为真时按用户分别缓存（查询集与用户有关时）。
+    缓存键包含完整的请求 URL，分页链接和查询参数各自对应不同的缓存项。
+    """
+    cache_namespace = None
+    cache_per_user = False
+
+    def get_cache_entry(self, request):
+        user = request.user.pk if self.cache_per_user else None
+        return Entry(self.cache_namespace, [self.cache_namespace], (user, self.action, request.build_absolute_uri()))
+
+    def _cached(self, request, respond):
+        entry = self.get_cache_entry(request)
+        data = entry.get()
+        if data is not None:
+            return Response(data)
+        response = respond()
+        if response.status_code == 200:
+            entry.set(response.data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(request, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(request, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs))
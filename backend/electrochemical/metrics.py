@@ -0,0 +1,257 @@
+"""
+运行指标
+
+进程内的计数器和直方图，以 Prometheus 文本格式输出（/api/metrics/）：
+
+- http_request_duration_seconds、http_response_size_bytes、http_request_queries、
+  http_request_query_seconds_total：按路由（视图名）、请求方法和状态码统计，由
+  electrochemical.middleware.MetricsMiddleware 记录；
+- experiment_points_ingested_total、experiment_batches_ingested_total：写入的数据点数和批次数，
+  rate() 即每秒写入点数；
+- analysis_jobs、analysis_job_duration_seconds：在输出时由分析任务表汇总（见 collectors），
+  任务在 Celery worker 或进程池中执行时同样可见。
+
+计数器和直方图只统计当前进程，多进程部署时由 Prometheus 按实例分别采集。
+"""
+import bisect
+import math
+import threading
+import time
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.db.backends.signals import connection_created
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+JOB_DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f'{self.name}{_labels(self.label_names, key)} {_number(value)}' for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self, **labels):
+        """返回 (各分箱累计计数, 总数, 总和)"""
+        counts, total = self._values.get(self._key(labels)) or ([0] * (len(self.buckets) + 1), 0.0)
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, total
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        return self.header() + render_histogram(self.name, self.label_names, self.buckets, values)
+
+
+def render_histogram(name, label_names, buckets, values):
+    """values 为 [(标签值, (各分箱计数（最后一个为超出最大分箱的计数）, 总和))]"""
+    lines = []
+    for key, (counts, total) in values:
+        running = 0
+        for bound, count in zip(list(buckets) + [math.inf], counts):
+            running += count
+            lines.append(f'{name}_bucket{_labels(label_names, key, [("le", _number(float(bound)))])} {running}')
+        lines.append(f'{name}_count{_labels(label_names, key)} {running}')
+        lines.append(f'{name}_sum{_labels(label_names, key)} {_number(float(total))}')
+    return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        """注册在输出时调用的函数，返回 Prometheus 文本行的列表"""
+        self.collectors.append(function)
+        return function
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            lines.extend(collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency until the response is returned',
+    labels=('route', 'method', 'status'),
+))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    'http_response_size_bytes', 'HTTP response body size, streamed responses counted when fully sent',
+    labels=('route', 'method'), buckets=SIZE_BUCKETS,
+))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    'http_request_queries', 'SQL queries executed per HTTP request',
+    labels=('route', 'method'), buckets=QUERY_BUCKETS,
+))
+REQUEST_QUERY_SECONDS = REGISTRY.register(Counter(
+    'http_request_query_seconds_total', 'Time spent in SQL queries during HTTP requests',
+    labels=('route', 'method'),
+))
+POINTS_INGESTED = REGISTRY.register(Counter(
+    'experiment_points_ingested_total', 'Data points written to experiment traces',
+))
+BATCHES_INGESTED = REGISTRY.register(Counter(
+    'experiment_batches_ingested_total', 'Data point batches received, duplicates are retried batches',
+    labels=('duplicate',),
+))
+
+
+class QueryStats:
+    """一个请求内执行的 SQL 查询数和耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# 当前请求的查询统计；通过 contextvar 传递，异步视图在线程中执行的查询也能计入
+current_queries = ContextVar('current_queries', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = current_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+
+
+def _install_query_recorder(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_recorder, dispatch_uid='metrics_query_recorder')
+
+
+def record_ingest(points, duplicate=False):
+    BATCHES_INGESTED.inc(duplicate='true' if duplicate else 'false')
+    if not duplicate:
+        POINTS_INGESTED.inc(points)
+
+
+@REGISTRY.collector
+def collect_analysis_jobs():
+    """由分析任务表汇总各分析类型、状态的任务数，以及已完成任务的耗时分布"""
+    from analysis.models import AnalysisJob
+
+    lines = ['# HELP analysis_jobs Analysis jobs by analysis type and status', '# TYPE analysis_jobs gauge']
+    counts = AnalysisJob.objects.values_list('method__analysis_type', 'status').annotate(
+        count=Count('id')
+    ).order_by('method__analysis_type', 'status')
+    for analysis_type, status, count in counts:
+        lines.append(f'analysis_jobs{_labels(("analysis_type", "status"), (analysis_type, status))} {count}')
+
+    duration = ExpressionWrapper(F('completed_at') - F('started_at'), output_field=DurationField())
+    aggregates = {
+        f'le_{index}': Count('id', filter=Q(duration__lte=timedelta(seconds=bound)))
+        for index, bound in enumerate(JOB_DURATION_BUCKETS)
+    }
+    rows = AnalysisJob.objects.filter(
+        status='completed', started_at__isnull=False, completed_at__isnull=False
+    ).annotate(duration=duration).values('method__analysis_type').annotate(
+        total=Count('id'), seconds=Sum('duration'), **aggregates
+    ).order_by('method__analysis_type')
+
+    lines += ['# HELP analysis_job_duration_seconds Duration of completed analysis jobs',
+              '# TYPE analysis_job_duration_seconds histogram']
+    for row in rows:
+        cumulative = [row[f'le_{index}'] for index in range(len(JOB_DURATION_BUCKETS))] + [row['total']]
+        counts = [cumulative[0]] + [b - a for a, b in zip(cumulative, cumulative[1:])]
+        seconds = row['seconds'].total_seconds() if row['seconds'] is not None else 0.0
+        lines += render_histogram(
+            'analysis_job_duration_seconds', ('analysis_type',), JOB_DURATION_BUCKETS,
+            [((row['method__analysis_type'],), (counts, seconds))],
+        )
+    return lines
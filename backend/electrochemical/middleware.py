@@ -0,0 +1,281 @@
+"""
+请求指标、按需性能剖析与响应压缩
+
+MetricsMiddleware 对每个请求记录延迟、SQL 查询数和耗时、响应大小（见 electrochemical.metrics），
+路由标签为 URL 名称（未匹配的请求记为 unmatched），避免按实际路径产生过多的标签值；
+流式响应的查询数只包含返回响应前执行的查询。
+同时支持同步和异步调用，不会让异步视图退回到线程中执行。
+
+设置 REQUEST_PROFILING_TOKEN 后，请求头 X-Profile 与之相同的请求在 cProfile 下执行，
+返回剖析结果（纯文本，按累计耗时排序）而不是原响应；流式响应在剖析期间完整生成，
+以便计入导出等逐块生成内容的耗时。异步视图的剖析结果只包含事件循环线程中的调用，
+在线程中执行的数据库查询表现为等待时间。
+
+CompressionMiddleware 按 Accept-Encoding 协商压缩 JSON、CSV 和文本响应：安装了 brotli 时
+优先使用 br，否则使用 gzip。普通响应不小于 COMPRESSION_MIN_BYTES 时才压缩，流式响应（导出）
+逐块压缩。已编码的响应和二进制格式（npz、parquet）不处理。
+"""
+import cProfile
+import hmac
+import io
+import pstats
+import time
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+DEFAULT_PROFILE_LINES = 50
+DEFAULT_COMPRESSION_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'text/plain', 'text/html')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else 'unmatched'
+
+
+def _profiling_requested(request):
+    token = getattr(settings, 'REQUEST_PROFILING_TOKEN', '')
+    value = request.META.get(PROFILE_HEADER)
+    return bool(token) and value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = metrics.QueryStats()
+        token = metrics.current_queries.set(stats)
+        start = time.perf_counter()
+        try:
+            if _profiling_requested(request):
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                    size = self._consume(response) if not getattr(response, 'is_async', False) else None
+                finally:
+                    profiler.disable()
+                return self._profile_response(request, response, size, profiler, stats, start)
+            response = self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        return self._record(request, response, stats, start)
+
+    async def __acall__(self, request):
+        stats = metrics.QueryStats()
+        token = metrics.current_queries.set(stats)
+        start = time.perf_counter()
+        try:
+            if _profiling_requested(request):
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    response = await self.get_response(request)
+                    size = await self._aconsume(response)
+                finally:
+                    profiler.disable()
+                return self._profile_response(request, response, size, profiler, stats, start)
+            response = await self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        return self._record(request, response, stats, start)
+
+    def _record(self, request, response, stats, start):
+        route, method = _route(request), request.method
+        metrics.REQUEST_DURATION.observe(time.perf_counter() - start, route=route, method=method,
+                                         status=response.status_code)
+        metrics.REQUEST_QUERIES.observe(stats.count, route=route, method=method)
+        metrics.REQUEST_QUERY_SECONDS.inc(stats.seconds, route=route, method=method)
+        if response.streaming:
+            # 流式响应发送完毕后才知道大小
+            response.streaming_content = self._count(response, route, method)
+        else:
+            metrics.RESPONSE_SIZE.observe(len(response.content), route=route, method=method)
+        return response
+
+    @staticmethod
+    def _count(response, route, method):
+        content = response.streaming_content
+        if response.is_async:
+            async def counted():
+                size = 0
+                async for part in content:
+                    size += len(part)
+                    yield part
+                metrics.RESPONSE_SIZE.observe(size, route=route, method=method)
+        else:
+            def counted():
+                size = 0
+                for part in content:
+                    size += len(part)
+                    yield part
+                metrics.RESPONSE_SIZE.observe(size, route=route, method=method)
+        return counted()
+
+    @staticmethod
+    def _consume(response):
+        if response.streaming:
+            return sum(len(part) for part in response.streaming_content)
+        return len(response.content)
+
+    @staticmethod
+    async def _aconsume(response):
+        if not response.streaming:
+            return len(response.content)
+        if not response.is_async:
+            return sum(len(part) for part in response.streaming_content)
+        size = 0
+        async for part in response.streaming_content:
+            size += len(part)
+        return size
+
+    def _profile_response(self, request, response, size, profiler, stats, start):
+        output = io.StringIO()
+        output.write(
+            f"{request.method} {request.get_full_path()} -> {response.status_code}\n"
+            f"route: {_route(request)}\n"
+            f"elapsed: {(time.perf_counter() - start) * 1000:.2f} ms\n"
+            f"queries: {stats.count} ({stats.seconds * 1000:.2f} ms)\n"
+            f"response bytes: {size if size is not None else 'unknown'}\n\n"
+        )
+        lines = getattr(settings, 'REQUEST_PROFILING_LINES', DEFAULT_PROFILE_LINES)
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(lines)
+        profile = HttpResponse(output.getvalue(), content_type='text/plain; charset=utf-8')
+        profile['X-Profile-Status'] = str(response.status_code)
+        return profile
+
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回 {编码: q 值}"""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encoding(header):
+    """选择响应的压缩编码，q 值相同时优先 br；客户端不接受任何可用编码时返回 None"""
+    accepted = _accepted_encodings(header or '')
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def _compressor(encoding):
+    """返回 (压缩一块数据的函数, 结束压缩的函数)"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or not _compressible(response):
+            return response
+        min_bytes = getattr(settings, 'COMPRESSION_MIN_BYTES', DEFAULT_COMPRESSION_MIN_BYTES)
+        if not response.streaming and len(response.content) < min_bytes:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+
+        compress, finish = _compressor(encoding)
+        if response.streaming:
+            response.streaming_content = self._stream(response, compress, finish)
+            response.headers.pop('Content-Length', None)
+        else:
+            content = compress(response.content) + finish()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # 压缩后的内容与原内容逐字节不同，强 ETag 改为弱 ETag（条件请求仍按弱比较匹配）
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _stream(response, compress, finish):
+        content = response.streaming_content
+        if response.is_async:
+            async def compressed():
+                async for part in content:
+                    data = compress(part)
+                    if data:
+                        yield data
+                yield finish()
+        else:
+            def compressed():
+                for part in content:
+                    data = compress(part)
+                    if data:
+                        yield data
+                yield finish()
+        return compressed()
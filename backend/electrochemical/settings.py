@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'electrochemical.middleware.MetricsMiddleware',
+    'electrochemical.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'corsheaders.middleware.CorsMiddleware',
@@ -73,6 +75,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'electrochemical.wsgi.application'
+ASGI_APPLICATION = 'electrochemical.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -106,7 +109,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # REST_FRAMEWORK = {
 #     'DEFAULT_AUTHENTICATION_CLASSES': [
 #         'rest_framework.authentication.SessionAuthentication',
-#         'rest_framework.authentication.TokenAuthentication',
+#         'api.authentication.CachedTokenAuthentication',
 #     ],
 #     'DEFAULT_PERMISSION_CLASSES': [
 #         'rest_framework.permissions.IsAuthenticated',
@@ -171,6 +174,89 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ENABLE_UTC = True
 
+# 实验曲线分块存储：每个分块保存的数据点数量
+EXPERIMENT_TRACE_CHUNK_SIZE = int(os.getenv('EXPERIMENT_TRACE_CHUNK_SIZE', '4096'))
+# 写入分块时单条 INSERT 语句的字节数上限，需小于 MySQL 的 max_allowed_packet
+EXPERIMENT_TRACE_INSERT_BYTES = int(os.getenv('EXPERIMENT_TRACE_INSERT_BYTES', str(1024 * 1024)))
+# 分段索引：电压从极值回退超过该值 (V) 才视为扫描换向
+EXPERIMENT_SEGMENT_THRESHOLD = float(os.getenv('EXPERIMENT_SEGMENT_THRESHOLD', '0.005'))
+
+# WebSocket实时通道
+# 单进程部署使用进程内通道层；多进程部署设置 CHANNEL_REDIS_URL 使用Redis通道层
+CHANNEL_REDIS_URL = os.getenv('CHANNEL_REDIS_URL')
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# 实时通道累积到该点数或等待该秒数后批量写入数据库
+EXPERIMENT_STREAM_FLUSH_POINTS = int(os.getenv('EXPERIMENT_STREAM_FLUSH_POINTS', '2000'))
+EXPERIMENT_STREAM_FLUSH_INTERVAL = float(os.getenv('EXPERIMENT_STREAM_FLUSH_INTERVAL', '0.5'))
+
+# 分析任务执行后端：celery（需要Redis）、process（本机进程池）或 sync（同步执行，用于测试）
+ANALYSIS_JOB_BACKEND = os.getenv('ANALYSIS_JOB_BACKEND', 'celery')
+# process 后端：工作进程数（缺省为CPU核数）、排队任务上限、每个工作进程执行多少个任务后重启
+ANALYSIS_JOB_WORKERS = int(os.getenv('ANALYSIS_JOB_WORKERS', '0')) or None
+ANALYSIS_JOB_QUEUE_SIZE = int(os.getenv('ANALYSIS_JOB_QUEUE_SIZE', '100'))
+ANALYSIS_JOB_MAX_TASKS_PER_CHILD = int(os.getenv('ANALYSIS_JOB_MAX_TASKS_PER_CHILD', '50'))
+# 相同缓存键的任务等待先提交的任务的结果；待执行或执行超过该秒数的任务视为已丢失，不再等待
+ANALYSIS_JOB_STALE_SECONDS = int(os.getenv('ANALYSIS_JOB_STALE_SECONDS', '3600'))
+# 批量分析：每组提交的任务数、单个批量分析的任务数上限
+ANALYSIS_BATCH_CHUNK_SIZE = int(os.getenv('ANALYSIS_BATCH_CHUNK_SIZE', '50'))
+ANALYSIS_BATCH_MAX_JOBS = int(os.getenv('ANALYSIS_BATCH_MAX_JOBS', '10000'))
+# 多实验比较的公共电压网格点数上限
+COMPARISON_MAX_GRID_POINTS = int(os.getenv('COMPARISON_MAX_GRID_POINTS', '10000'))
+# 流式分析：数据点数不少于该值时平滑、基线校正和积分分窗口计算（0 表示不使用），每个窗口的点数
+ANALYSIS_STREAMING_MIN_POINTS = int(os.getenv('ANALYSIS_STREAMING_MIN_POINTS', '2000000'))
+ANALYSIS_STREAMING_WINDOW_POINTS = int(os.getenv('ANALYSIS_STREAMING_WINDOW_POINTS', '262144'))
+
+# 分析结果缓存：超过条目数或总字节数时按最近使用时间淘汰
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '1000'))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv('ANALYSIS_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# 缓存：CACHE_BACKEND 为 locmem（缺省，进程内）、file（CACHE_LOCATION 为目录）或 redis（CACHE_LOCATION 为地址）
+# locmem 的缓存失效只在本进程内有效，多进程部署应使用 file 或 redis
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'electrochemical'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://localhost:6379/1'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
+    }
+}
+if CACHE_BACKEND != 'redis':
+    # locmem 和 file 后端超过该条目数时淘汰
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000'))}
+# 接口缓存（模板、分析方法、实验结果、已完成实验的统计）的有效期（秒），数据变化时另行失效
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', '300'))
+
+# 令牌认证结果的缓存有效期（秒），见 api.authentication.CachedTokenAuthentication
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', '300'))
+
+# 运行指标：/api/metrics/ 的访问令牌（为空时仅限管理员用户访问）
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# 按需性能剖析：请求头 X-Profile 与该令牌相同时返回 cProfile 结果（为空时关闭），输出的函数行数
+REQUEST_PROFILING_TOKEN = os.getenv('REQUEST_PROFILING_TOKEN', '')
+REQUEST_PROFILING_LINES = int(os.getenv('REQUEST_PROFILING_LINES', '50'))
+
+# 分析结果、图表数据等 PackedJSONField 的压缩算法：zlib（缺省）或 zstd（需要 zstandard）
+PACKED_JSON_CODEC = os.getenv('PACKED_JSON_CODEC', 'zlib')
+# 响应压缩（gzip，安装 brotli 时优先 br）：小于该字节数的响应不压缩
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -5,3 +5,6 @@ class ExperimentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'experiments'
     verbose_name = '实验管理'
+
+    def ready(self):
+        from . import signals  # noqa: F401
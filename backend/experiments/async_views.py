@@ -0,0 +1,198 @@
+"""
+读取密集接口的异步视图
+
+实验列表、数据点、导出和实验结果的 GET 请求由这里的异步视图处理，其余请求方法仍交给
+对应的视图集。通过 electrochemical.asgi（daphne）部署时，异步视图在事件循环中等待查询，
+不会因为大页数据点或长时间导出而占用工作线程：
+
+- 模型查询使用 Django 的异步 ORM（aget、async for）；
+- 分块解码、降采样等基于 NumPy 的计算放到线程中执行，不阻塞事件循环；
+- 导出以异步迭代器逐块产出。同步迭代器在 ASGI 下会被整体读入内存后才开始发送，
+  异步迭代器则边读取边发送。
+
+认证、权限和限流检查、查询集、分页和序列化都由对应的视图集实例完成，响应格式与视图集一致；
+数据点、导出和实验结果详情同样支持条件请求（见 experiments.conditional）。
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions
+from rest_framework.utils.encoders import JSONEncoder
+
+from electrochemical.caching import Entry
+
+from .conditional import experiment_validators, not_modified, result_validators, set_validators
+from .pagination import TraceCursorPagination
+from .signals import results_namespace
+from .views import (
+    ExperimentResultViewSet, ExperimentViewSet, downsampled_points, export_response, range_filters
+)
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def _json_response(data, status=200, headers=None):
+    """与 REST framework 的 JSONRenderer 相同的编码方式"""
+    content = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return HttpResponse(content, status=status, headers=headers, content_type='application/json')
+
+
+def _error_response(request, exc):
+    """将 REST framework 异常转换为与视图集相同的错误响应"""
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        authenticators = request.authenticators
+        header = authenticators[0].authenticate_header(request) if authenticators else None
+        if header:
+            headers['WWW-Authenticate'] = header
+        else:
+            exc.status_code = 403
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = '%d' % exc.wait
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _json_response(detail, status=exc.status_code, headers=headers)
+
+
+async def aiterate(iterator):
+    """
+    逐块迭代同步生成器
+
+    每次取值在请求的同一线程中执行，生成器持有的数据库游标始终在创建它的连接上使用。
+    """
+    step = sync_to_async(next)
+    done = object()
+    while True:
+        part = await step(iterator, done)
+        if part is done:
+            break
+        yield part
+
+
+def _stream_for(request):
+    """ASGI 下导出使用异步迭代器；WSGI 下仍使用同步迭代器，避免被整体读入内存"""
+    return aiterate if isinstance(request, ASGIRequest) else None
+
+
+def read_view(viewset_class, action, fallback=None):
+    """
+    装饰异步的读取处理函数
+
+    GET/HEAD 请求先由 viewset_class 的实例以 action 执行与视图集相同的初始化（认证、权限、
+    限流和内容协商，见 APIView.initial），再以 handler(视图集实例, 请求, ...) 处理，查询集、
+    对象和序列化器均从视图集实例取得。其他请求方法交给 fallback 视图，没有时返回 405。
+    """
+    fallback = sync_to_async(fallback) if fallback is not None else None
+
+    def decorator(handler):
+        async def view(request, *args, **kwargs):
+            if request.method not in READ_METHODS:
+                if fallback is not None:
+                    return await fallback(request, *args, **kwargs)
+                return _json_response({'detail': exceptions.MethodNotAllowed(request.method).detail},
+                                      status=405, headers={'Allow': ', '.join(READ_METHODS)})
+
+            viewset = viewset_class(action_map={'get': action, 'head': action}, args=args, kwargs=kwargs)
+            drf_request = viewset.initialize_request(request, *args, **kwargs)
+            viewset.request = drf_request
+            try:
+                await sync_to_async(viewset.initial)(drf_request, *args, **kwargs)
+                return await handler(viewset, drf_request, *args, **kwargs)
+            except Http404:
+                # 与 REST framework 的异常处理相同，get_object 等抛出的 Django 异常转换为 API 异常
+                return _error_response(drf_request, exceptions.NotFound())
+            except PermissionDenied:
+                return _error_response(drf_request, exceptions.PermissionDenied())
+            except exceptions.APIException as exc:
+                return _error_response(drf_request, exc)
+
+        # 与视图集相同，CSRF 由 SessionAuthentication 自行检查
+        view.csrf_exempt = True
+        view.__doc__ = handler.__doc__
+        return view
+    return decorator
+
+
+async def _paginated(viewset, request):
+    """按视图集的分页类分页视图集的查询集；未设置分页时用异步 ORM 读取全部结果"""
+    queryset = viewset.filter_queryset(viewset.get_queryset())
+    paginator = viewset.paginator
+    page = await sync_to_async(paginator.paginate_queryset)(queryset, request, viewset) if paginator else None
+    if page is None:
+        objects = [obj async for obj in queryset]
+        return _json_response(viewset.get_serializer(objects, many=True).data)
+    data = viewset.get_serializer(page, many=True).data
+    return _json_response(paginator.get_paginated_response(data).data)
+
+
+@read_view(ExperimentViewSet, 'list', ExperimentViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def experiment_list(viewset, request):
+    """实验列表（不包含统计摘要和元数据）"""
+    return await _paginated(viewset, request)
+
+
+@read_view(ExperimentViewSet, 'data_points')
+async def experiment_data_points(viewset, request, pk):
+    """获取实验数据点，可按循环、扫描方向、时间和电压范围筛选"""
+    experiment = await sync_to_async(viewset.get_object)()
+    filters = range_filters(request.query_params)
+    validators = experiment_validators(experiment)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+
+    if 'max_points' in request.query_params:
+        data = await sync_to_async(downsampled_points)(experiment, request.query_params, filters)
+        return set_validators(_json_response(data), validators)
+
+    # 游标分页，仅读取当前页所在的分块
+    paginator = TraceCursorPagination()
+    page = await sync_to_async(paginator.paginate_queryset)(experiment.trace.where(**filters), request)
+    return set_validators(_json_response(paginator.get_paginated_response(page).data), validators)
+
+
+@read_view(ExperimentViewSet, 'export')
+async def experiment_export(viewset, request, pk):
+    """导出实验数据，可按循环、扫描方向、时间和电压范围筛选"""
+    experiment = await sync_to_async(viewset.get_object)()
+    validators = experiment_validators(experiment)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    # json 格式需要先序列化实验信息，在线程中完成
+    response = await sync_to_async(export_response)(experiment, request.query_params, _stream_for(request._request))
+    return set_validators(response, validators)
+
+
+async def _result_entry(request, name, key):
+    """用户实验结果的缓存项，实验或结果变化时失效（见 experiments.signals）"""
+    user = request.user.pk
+    return await sync_to_async(Entry)(name, [results_namespace(user)], (user, key))
+
+
+@read_view(ExperimentResultViewSet, 'list', ExperimentResultViewSet.as_view({'get': 'list'}))
+async def result_list(viewset, request):
+    """实验结果列表，按用户和请求 URL 缓存编码后的响应内容"""
+    entry = await _result_entry(request, 'result_list', request.build_absolute_uri())
+    content = await entry.aget()
+    if content is not None:
+        return HttpResponse(content, content_type='application/json')
+    response = await _paginated(viewset, request)
+    if response.status_code == 200:
+        await entry.aset(response.content)
+    return response
+
+
+@read_view(ExperimentResultViewSet, 'retrieve', ExperimentResultViewSet.as_view({'get': 'retrieve'}))
+async def result_detail(viewset, request, pk):
+    """实验结果详情，序列化数据和条件请求的验证器一起缓存"""
+    entry = await _result_entry(request, 'result', pk)
+    cached = await entry.aget()
+    if cached is None:
+        result = await sync_to_async(viewset.get_object)()
+        data = viewset.get_serializer(result).data
+        cached = await entry.aset((dict(data), result_validators(result)))
+    data, validators = cached
+    return not_modified(request, validators) or set_validators(_json_response(data), validators)
@@ -0,0 +1,246 @@
+"""
+性能基准
+
+用合成曲线（见 experiments.synthetic）测量数据写入、查询、导出和分析的热点路径，
+请求经过完整的 URL 路由、认证和序列化：
+
+- ingest.binary / ingest.json：通过 add_data_points 分批写入（二进制列格式；JSON 只测到
+  JSON_INGEST_MAX_POINTS 个点）的耗时和每秒点数；
+- stop：停止实验，包括收尾任务（合并分块、构建降采样层级和生成实验结果）；
+- detail、data_points、downsample、list：接口延迟；
+- export.csv、export.json：流式导出的耗时、输出字节数和 Python 内存峰值（tracemalloc）；
+- analysis.<分析类型>：各分析器在实验上的运行时间。
+
+每项结果为一个字典，以 (benchmark, technique, points) 标识；compare() 将结果与基线比较，
+找出耗时超过基线一定比例的项目。运行基准会写入数据库，应在独立的数据库中进行
+（见 benchmark 管理命令）。
+"""
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import django
+import numpy as np
+import scipy
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .models import Experiment
+from .storage import get_chunk_size, timestamps_to_iso
+from .synthetic import TECHNIQUES, voltammogram
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+MAX_POINTS = 5000000
+JSON_INGEST_MAX_POINTS = 100000
+JSON_BATCH_POINTS = 1000
+BINARY_BATCH_POINTS = 50000
+BINARY_COLUMNS = ('timestamp', 'voltage', 'current', 'cycle')
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+
+
+class BenchmarkError(RuntimeError):
+    """基准中的请求未成功"""
+
+
+def _check(response, name):
+    if response.status_code >= 400:
+        raise BenchmarkError(f"{name} failed with status {response.status_code}: {response.content[:200]!r}")
+    return response
+
+
+def _timed(function, repeat):
+    """执行 repeat 次，返回 (耗时中位数, 最短耗时, 最后一次的返回值)"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), min(durations), result
+
+
+def _peak_memory(function):
+    """执行期间 Python 分配内存的峰值（字节）"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _consume(response):
+    """读取完整的（流式）响应，返回字节数；不保留内容"""
+    if response.streaming:
+        return sum(len(part) for part in response.streaming_content)
+    return len(response.content)
+
+
+def environment():
+    """运行环境，随结果一起保存以便比较"""
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'django': django.get_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'database': connection.vendor,
+        'chunk_size': get_chunk_size(),
+    }
+
+
+class BenchmarkSuite:
+    def __init__(self, repeat=DEFAULT_REPEAT, log=None):
+        self.repeat = repeat
+        self.log = log or (lambda message: None)
+        self.results = []
+
+    def record(self, benchmark, technique, points, seconds, min_seconds, **extra):
+        result = {
+            'benchmark': benchmark,
+            'technique': technique,
+            'points': points,
+            'seconds': seconds,
+            'min_seconds': min_seconds,
+            **extra,
+        }
+        self.results.append(result)
+        self.log(f"{benchmark:<30} {technique or '-':<4} {points:>9} {seconds * 1000:>12.2f} ms")
+        return result
+
+    def run(self, techniques=TECHNIQUES, sizes=DEFAULT_SIZES):
+        for points in sizes:
+            if not 2 <= points <= MAX_POINTS:
+                raise ValueError(f"Benchmark sizes must be between 2 and {MAX_POINTS}")
+
+        user = User.objects.create_user(f'benchmark-{time.time_ns()}')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+        for technique in techniques:
+            for points in sizes:
+                self.run_trace(user, technique, points)
+
+        count = Experiment.objects.filter(user=user).count()
+        seconds, fastest, response = _timed(lambda: _check(self.client.get(reverse('experiment-list')), 'list'), self.repeat)
+        self.record('list', None, count, seconds, fastest)
+        return {'environment': environment(), 'repeat': self.repeat, 'results': self.results}
+
+    def run_trace(self, user, technique, points):
+        data = voltammogram(technique, points)
+        experiment = Experiment.objects.create(
+            user=user, name=f'benchmark {technique} {points}', experiment_type=technique,
+            start_voltage=float(data['voltage'][0]), end_voltage=float(data['voltage'].max()),
+            scan_rate=50, status='running',
+        )
+        self.ingest_binary(experiment, technique, data)
+        if points <= JSON_INGEST_MAX_POINTS:
+            json_experiment = Experiment.objects.create(
+                user=user, name=f'benchmark {technique} {points} json', experiment_type=technique,
+                start_voltage=experiment.start_voltage, end_voltage=experiment.end_voltage,
+                scan_rate=50, status='running',
+            )
+            self.ingest_json(json_experiment, technique, data)
+        del data
+
+        # 收尾任务（合并分块、降采样层级、实验结果）以 sync 后端在请求中执行，计入 stop 的耗时
+        with override_settings(ANALYSIS_JOB_BACKEND='sync'):
+            seconds, fastest, response = _timed(lambda: _check(
+                self.client.post(reverse('experiment-stop', args=[experiment.pk])), 'stop'
+            ), 1)
+        self.record('stop', technique, points, seconds, fastest)
+        experiment.refresh_from_db()
+
+        for name, url in (
+            ('detail', reverse('experiment-detail', args=[experiment.pk])),
+            ('data_points', reverse('experiment-data-points', args=[experiment.pk]) + '?page_size=1000'),
+            ('downsample', reverse('experiment-data-points', args=[experiment.pk]) + '?max_points=2000'),
+        ):
+            seconds, fastest, response = _timed(lambda: _check(self.client.get(url), name), self.repeat)
+            self.record(name, technique, points, seconds, fastest)
+
+        for format_type in ('csv', 'json'):
+            url = reverse('experiment-export', args=[experiment.pk]) + f'?format={format_type}'
+            export = lambda: _consume(_check(self.client.get(url), f'export {format_type}'))
+            seconds, fastest, size = _timed(export, self.repeat)
+            self.record(f'export.{format_type}', technique, points, seconds, fastest,
+                        bytes=size, peak_memory=_peak_memory(export))
+
+        self.run_analyzers(experiment, technique, points)
+
+    def ingest_binary(self, experiment, technique, data):
+        url = reverse('experiment-add-data-points', args=[experiment.pk])
+        content_type = f"application/x-trace-columns; columns={','.join(BINARY_COLUMNS)}"
+        length = len(data['timestamp'])
+        bodies = [
+            b''.join(np.ascontiguousarray(data[name][start:start + BINARY_BATCH_POINTS]).tobytes() for name in BINARY_COLUMNS)
+            for start in range(0, length, BINARY_BATCH_POINTS)
+        ]
+
+        def ingest():
+            for body in bodies:
+                _check(self.client.post(url, body, content_type=content_type), 'ingest binary')
+
+        seconds, fastest, result = _timed(ingest, 1)
+        self.record('ingest.binary', technique, length, seconds, fastest,
+                    points_per_second=length / seconds, batch_points=BINARY_BATCH_POINTS)
+
+    def ingest_json(self, experiment, technique, data):
+        url = reverse('experiment-add-data-points', args=[experiment.pk])
+        length = len(data['timestamp'])
+        timestamps = timestamps_to_iso(data['timestamp'])
+        voltages, currents, cycles = data['voltage'].tolist(), data['current'].tolist(), data['cycle'].tolist()
+        payloads = [
+            {'data_points': [
+                {'timestamp': timestamps[i], 'voltage': voltages[i], 'current': currents[i], 'cycle': cycles[i]}
+                for i in range(start, min(start + JSON_BATCH_POINTS, length))
+            ]}
+            for start in range(0, length, JSON_BATCH_POINTS)
+        ]
+
+        def ingest():
+            for payload in payloads:
+                _check(self.client.post(url, payload, format='json'), 'ingest json')
+
+        seconds, fastest, result = _timed(ingest, 1)
+        self.record('ingest.json', technique, length, seconds, fastest,
+                    points_per_second=length / seconds, batch_points=JSON_BATCH_POINTS)
+
+    def run_analyzers(self, experiment, technique, points):
+        from analysis.analyzers import ANALYZERS
+
+        for analysis_type, analyzer_class in ANALYZERS.items():
+            analyzer = analyzer_class()
+            seconds, fastest, result = _timed(lambda: analyzer.analyze(experiment, {}), self.repeat)
+            self.record(f'analysis.{analysis_type}', technique, points, seconds, fastest)
+
+
+def _key(result):
+    return result['benchmark'], result['technique'], result['points']
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    与基线结果比较，返回耗时超过基线 (1 + threshold) 倍的项目列表
+
+    以最短耗时比较，受偶发干扰的影响较小；基线中没有的项目不参与比较。
+    """
+    previous = {_key(result): result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results.get('results', []):
+        before = previous.get(_key(result))
+        if before is None or not before['min_seconds']:
+            continue
+        ratio = result['min_seconds'] / before['min_seconds']
+        if ratio > 1 + threshold:
+            regressions.append({**dict(zip(('benchmark', 'technique', 'points'), _key(result))),
+                                'baseline_seconds': before['min_seconds'],
+                                'seconds': result['min_seconds'], 'ratio': ratio})
+    return regressions
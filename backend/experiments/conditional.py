@@ -0,0 +1,47 @@
+"""
+条件请求（ETag / Last-Modified）
+
+实验详情、数据点和导出的内容由实验的 updated_at 与 data_version（写入或清空数据点时递增）
+确定，实验结果的内容由结果和所属实验的 updated_at 确定。请求带有 If-None-Match 或
+If-Modified-Since 且资源未变化时直接返回 304，不读取数据点，也不序列化。
+
+写入数据点时同时更新实验的 updated_at（见 TraceStore），Last-Modified 因此也随数据变化；
+Last-Modified 只精确到秒，两者同时提供时以 ETag 为准。响应带有 Cache-Control: private, no-cache，
+浏览器保存响应、每次使用前重新验证。
+"""
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def _microseconds(value):
+    return int(value.timestamp() * 1_000_000)
+
+
+def experiment_validators(experiment):
+    """实验详情、数据点和导出的 (ETag, 最后修改时间)；查询参数不同的 URL 是不同的资源，无需计入"""
+    etag = f'W/"experiment-{experiment.pk}-{experiment.data_version}-{_microseconds(experiment.updated_at)}"'
+    return etag, experiment.updated_at
+
+
+def result_validators(result):
+    """实验结果的 (ETag, 最后修改时间)，结果中包含实验名称，实验更新时也随之变化"""
+    experiment = result.experiment
+    etag = f'W/"result-{result.pk}-{_microseconds(result.updated_at)}-{_microseconds(experiment.updated_at)}"'
+    return etag, max(result.updated_at, experiment.updated_at)
+
+
+def set_validators(response, validators):
+    etag, last_modified = validators
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(request, validators):
+    """资源未变化时返回 304 响应，否则返回 None"""
+    etag, last_modified = validators
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is not None:
+        set_validators(response, validators)
+    return response
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .models import Experiment
+from .parsers import parse_column_names, unpack_columns
+from .storage import TRACE_COLUMNS, column_values, columns_from_points, normalize_columns
+
+
+class ExperimentStreamConsumer(AsyncWebsocketConsumer):
+    """
+    实验数据实时通道 ws/experiments/<id>/stream/
+
+    采集端发送数据帧：文本帧为 {"data_points": [...]}，格式与 add_data_points 相同；
+    二进制帧为按列打包的小端序数组，列顺序由连接参数 columns 指定（同 TraceColumnsParser）。
+    数据帧立即转发给同一实验的其他连接，同时在内存中累积，达到
+    EXPERIMENT_STREAM_FLUSH_POINTS 个点或 EXPERIMENT_STREAM_FLUSH_INTERVAL 秒后批量写入数据库。
+    实验停止后数据帧不再转发和保存；实验状态每个连接最多每 EXPERIMENT_STREAM_FLUSH_INTERVAL 秒查询一次。
+    """
+    
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        
+        self.experiment = await self._get_experiment(self.scope['url_route']['kwargs']['pk'], user)
+        if self.experiment is None:
+            await self.close()
+            return
+        
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            self.columns = parse_column_names(query.get('columns', [None])[0])
+        except ValueError:
+            await self.close()
+            return
+        
+        self.group_name = f'experiment_{self.experiment.pk}'
+        self.pending = []
+        self.pending_count = 0
+        self.flush_task = None
+        self.running = self.experiment.status == 'running'
+        self.status_checked_at = time.monotonic()
+        
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+    
+    async def disconnect(self, code):
+        if not hasattr(self, 'group_name'):
+            return
+        # 连接已关闭，只写入数据库，不再发送写入结果
+        await self.flush(notify=False)
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            if bytes_data is not None:
+                columns = normalize_columns(unpack_columns(bytes_data, self.columns))[0]
+            else:
+                columns = columns_from_points(json.loads(text_data)['data_points'])
+        except (ValueError, KeyError, TypeError) as e:
+            await self._send_json({'type': 'error', 'error': str(e)})
+            return
+        
+        count = len(columns['timestamp'])
+        if not count:
+            return
+        
+        if not await self._is_running():
+            await self._send_json({
+                'type': 'error',
+                'error': f'Experiment is not running, {count} data points discarded'
+            })
+            return
+        
+        # 先转发给其他查看者，再缓存等待写入
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'trace.points',
+            'sender': self.channel_name,
+            'columns': {name: column_values(name, values) for name, values in columns.items()},
+        })
+        
+        self.pending.append(columns)
+        self.pending_count += count
+        if self.pending_count >= settings.EXPERIMENT_STREAM_FLUSH_POINTS:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+    
+    async def trace_points(self, event):
+        """转发其他连接收到的数据点"""
+        if event['sender'] != self.channel_name:
+            await self._send_json({'type': 'data_points', 'columns': event['columns']})
+    
+    async def flush(self, notify=True):
+        """将缓存的数据点写入数据库，notify 为 False 时不向本连接发送写入结果"""
+        task, self.flush_task = self.flush_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        if not self.pending:
+            return
+        
+        columns = {
+            name: np.concatenate([batch[name] for batch in self.pending])
+            for name in TRACE_COLUMNS
+        }
+        count = self.pending_count
+        self.pending = []
+        self.pending_count = 0
+        
+        created_count = await self._append(columns)
+        if created_count is None:
+            self.running = False
+            self.status_checked_at = time.monotonic()
+        if not notify:
+            return
+        if created_count is None:
+            await self._send_json({
+                'type': 'error',
+                'error': f'Experiment is not running, {count} data points discarded'
+            })
+        else:
+            await self._send_json({'type': 'stored', 'created_count': created_count})
+    
+    async def _flush_later(self):
+        await asyncio.sleep(settings.EXPERIMENT_STREAM_FLUSH_INTERVAL)
+        await self.flush()
+    
+    async def _is_running(self):
+        now = time.monotonic()
+        if now - self.status_checked_at >= settings.EXPERIMENT_STREAM_FLUSH_INTERVAL:
+            self.running = await self._get_running()
+            self.status_checked_at = now
+        return self.running
+    
+    async def _send_json(self, content):
+        await self.send(text_data=json.dumps(content))
+    
+    @database_sync_to_async
+    def _get_experiment(self, pk, user):
+        return Experiment.objects.filter(pk=pk, user=user).first()
+    
+    @database_sync_to_async
+    def _get_running(self):
+        return Experiment.objects.filter(pk=self.experiment.pk, status='running').exists()
+    
+    @database_sync_to_async
+    def _append(self, columns):
+        # 只接受运行中实验的数据
+        if not Experiment.objects.filter(pk=self.experiment.pk, status='running').exists():
+            return None
+        return self.experiment.trace.append(columns)
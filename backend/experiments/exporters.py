@@ -0,0 +1,142 @@
+"""
+实验数据流式导出
+
+各函数均为生成器，按分块读取曲线并逐段产出文件内容，供 StreamingHttpResponse
+使用，内存占用与实验数据量无关。store 带范围筛选条件时只导出满足条件的数据点。
+各格式均以导出开始时的曲线末尾为界，导出仍在写入的实验时不包含之后写入的数据，
+同一请求的各格式导出相同的数据点。
+"""
+import csv
+import io
+import json
+import zipfile
+
+import numpy as np
+from numpy.lib import format as npy_format
+from rest_framework.utils.encoders import JSONEncoder
+
+from .storage import TRACE_COLUMNS, OPTIONAL_COLUMNS, column_values, columns_to_points
+
+CSV_HEADER = ['Timestamp', 'Voltage (V)', 'Current (A)', 'Cycle', 'Temperature (°C)', 'pH']
+
+# parquet 每个行组包含的数据点数量
+PARQUET_ROW_GROUP_SIZE = 65536
+
+
+class _StreamSink:
+    """只写、不可定位的文件对象，缓存写入内容供生成器取出"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_csv(store):
+    """导出CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+
+    stop = store.end_offset()
+    for indexes, columns in store.select(stop=stop):
+        writer.writerows(zip(*(column_values(name, columns[name]) for name in TRACE_COLUMNS)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_json(experiment_data, store):
+    """导出JSON，实验信息之后逐块写出 data_points 数组"""
+    stop = store.end_offset()
+    head = json.dumps(experiment_data, cls=JSONEncoder, ensure_ascii=False)
+    yield head[:-1] + (', ' if experiment_data else '') + '"data_points": ['
+
+    separator = ''
+    for indexes, columns in store.select(stop=stop):
+        points = json.dumps(columns_to_points(columns, indexes=indexes), cls=JSONEncoder)
+        yield separator + points[1:-1]
+        separator = ', '
+    yield ']}'
+
+
+def iter_npz(store):
+    """导出NumPy npz，每列为一个npy数组，时间戳为 datetime64[us]"""
+    # 以导出开始时的曲线末尾为界，避免与仍在写入的实验数据不一致
+    stop = store.end_offset()
+    count = sum(len(indexes) for indexes, columns in store.select([], stop=stop)) if store.filters else stop
+    sink = _StreamSink()
+
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, (field, dtype) in TRACE_COLUMNS.items():
+            dtype = np.dtype('datetime64[us]') if name == 'timestamp' else np.dtype(dtype)
+            with archive.open(f'{name}.npy', mode='w', force_zip64=True) as entry:
+                npy_format.write_array_header_1_0(entry, {
+                    'descr': npy_format.dtype_to_descr(dtype),
+                    'fortran_order': False,
+                    'shape': (count,),
+                })
+                for indexes, columns in store.select([name], stop=stop):
+                    entry.write(columns[name].tobytes())
+                    yield sink.drain()
+    yield sink.drain()
+
+
+def iter_parquet(store):
+    """导出Apache Parquet，每 PARQUET_ROW_GROUP_SIZE 个数据点写一个行组"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('voltage', pa.float64()),
+        ('current', pa.float64()),
+        ('cycle', pa.int32()),
+        ('temperature', pa.float64()),
+        ('ph', pa.float64()),
+    ])
+
+    def to_batch(columns):
+        arrays = []
+        for field in schema:
+            values = columns[field.name]
+            mask = np.isnan(values) if field.name in OPTIONAL_COLUMNS else None
+            arrays.append(pa.array(values, type=field.type, mask=mask))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    sink = _StreamSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        batches = []
+        pending = 0
+        stop = store.end_offset()
+        for indexes, columns in store.select(stop=stop):
+            batches.append(to_batch(columns))
+            pending += batches[-1].num_rows
+            if pending >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_batches(batches, schema=schema))
+                batches = []
+                pending = 0
+                yield sink.drain()
+        if batches:
+            writer.write_table(pa.Table.from_batches(batches, schema=schema))
+    yield sink.drain()
@@ -0,0 +1,285 @@
+"""
+压缩存储的 JSON 字段
+
+分析结果、比较结果中的曲线和矩阵以 JSON 保存时每个数值十几个字节，读取时还要整体解析。
+PackedJSONField 保存与 JSONField 相同的文档，但：
+
+- 长度不小于 PACK_MIN_LENGTH 的数值数组（全为浮点数或全为整数，可含 None）以及各行等长的
+  二维数组，取出为小端序 float64/int64 数组，文档中只保留其位置、类型和形状；None 用位图标记；
+- 数组按字节重排（每个数值的第 k 个字节放在一起）后与文档一起压缩，浮点曲线的压缩率明显更高；
+- 压缩使用 zstd（需要 zstandard，设置 PACKED_JSON_CODEC=zstd）或 zlib（缺省）；读取时按数据头
+  自动识别，不是本格式的值按 JSON 文本解析。由 JSONField 改为本字段后，尚未转换的 JSON 列
+  照常读取，pack_json_fields 命令将列类型改为二进制并重新编码已有的值；
+- 从数据库读取模型实例时只保存压缩数据，首次访问字段时才解压和还原（见 PackedJSONAttribute）。
+  values()/values_list() 返回的是未解码的 PackedValue，需调用 decode()。
+
+数组还原为 Python 列表，数值与写入时完全相同（整数仍为整数，浮点数逐位相同）。
+"""
+import json
+import struct
+import zlib
+from base64 import b64encode
+
+import numpy as np
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'PJ1'
+CODECS = {b'z': 'zlib', b's': 'zstd'}
+CODEC_BYTES = {name: byte for byte, name in CODECS.items()}
+PACK_MIN_LENGTH = 16
+ARRAY_KEY = '__packed__'
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+INT64_RANGE = (-(1 << 63), (1 << 63) - 1)
+
+
+def get_codec():
+    codec = getattr(settings, 'PACKED_JSON_CODEC', 'zlib')
+    if codec not in CODEC_BYTES:
+        raise ImproperlyConfigured(f"PACKED_JSON_CODEC must be one of {', '.join(CODEC_BYTES)}")
+    if codec == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured('PACKED_JSON_CODEC=zstd requires the zstandard package')
+    return codec
+
+
+def _compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('Reading zstd-compressed values requires the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _shuffle(buffer, itemsize):
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(buffer, itemsize):
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def _scalar_kind(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'other'
+    if isinstance(value, int):
+        return 'i8' if INT64_RANGE[0] <= value <= INT64_RANGE[1] else 'other'
+    if isinstance(value, float):
+        return 'f8'
+    return 'other'
+
+
+def _array_kind(values):
+    """一维数值数组的类型（f8 或 i8），不能打包时返回 None"""
+    kinds = {_scalar_kind(value) for value in values}
+    kinds.discard(None)
+    if len(kinds) == 1 and 'other' not in kinds:
+        return kinds.pop()
+    return None
+
+
+def _packable(value):
+    """返回 (类型, 形状)；一维或各行等长的二维数值数组才打包"""
+    if len(value) < PACK_MIN_LENGTH and not (value and isinstance(value[0], list)):
+        return None
+    if all(isinstance(row, list) for row in value):
+        width = len(value[0]) if value else 0
+        if not width or any(len(row) != width for row in value) or len(value) * width < PACK_MIN_LENGTH:
+            return None
+        kind = _array_kind([item for row in value for item in row])
+        return (kind, [len(value), width]) if kind else None
+    kind = _array_kind(value)
+    return (kind, [len(value)]) if kind else None
+
+
+class _Packer:
+    def __init__(self):
+        self.buffers = []
+        self.offset = 0
+
+    def pack(self, value):
+        if isinstance(value, dict):
+            return {key: self.pack(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            value = list(value)
+            packable = _packable(value)
+            if packable is None:
+                return [self.pack(item) for item in value]
+            kind, shape = packable
+            flat = [item for row in value for item in row] if len(shape) == 2 else value
+            return self._array(flat, kind, shape)
+        return value
+
+    def _array(self, flat, kind, shape):
+        missing = np.fromiter((item is None for item in flat), dtype=bool, count=len(flat))
+        fill = 0 if kind == 'i8' else 0.0
+        array = np.array([fill if item is None else item for item in flat], dtype='<' + kind)
+        entry = {ARRAY_KEY: kind, 'shape': shape, 'offset': self._append(_shuffle(array.tobytes(), 8))}
+        if missing.any():
+            entry['missing'] = self._append(np.packbits(missing).tobytes())
+        return entry
+
+    def _append(self, buffer):
+        offset = self.offset
+        self.buffers.append(buffer)
+        self.offset += len(buffer)
+        return offset
+
+
+def _unpack(value, buffers):
+    if isinstance(value, dict):
+        if ARRAY_KEY in value:
+            return _unpack_array(value, buffers)
+        return {key: _unpack(item, buffers) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unpack(item, buffers) for item in value]
+    return value
+
+
+def _unpack_array(entry, buffers):
+    shape = entry['shape']
+    count = int(np.prod(shape))
+    start = entry['offset']
+    data = _unshuffle(buffers[start:start + count * 8], 8)
+    flat = np.frombuffer(data, dtype='<' + entry[ARRAY_KEY]).tolist()
+    if 'missing' in entry:
+        bits = np.frombuffer(buffers, dtype=np.uint8, count=(count + 7) // 8, offset=entry['missing'])
+        for index in np.flatnonzero(np.unpackbits(bits, count=count)).tolist():
+            flat[index] = None
+    if len(shape) == 2:
+        width = shape[1]
+        return [flat[row * width:(row + 1) * width] for row in range(shape[0])]
+    return flat
+
+
+def encode(value, codec=None):
+    """将 JSON 文档编码为压缩的二进制值"""
+    packer = _Packer()
+    skeleton = json.dumps(packer.pack(value), separators=(',', ':')).encode()
+    payload = struct.pack('<I', len(skeleton)) + skeleton + b''.join(packer.buffers)
+    codec = codec or get_codec()
+    return MAGIC + CODEC_BYTES[codec] + _compress(payload, codec)
+
+
+def decode(data):
+    """还原 encode 编码的值；不是本格式的值按 JSON 文本解析"""
+    data = bytes(data)
+    if not data.startswith(MAGIC):
+        return json.loads(data)
+    codec = CODECS.get(data[len(MAGIC):len(MAGIC) + 1])
+    if codec is None:
+        raise ValueError('Unknown packed JSON codec')
+    payload = _decompress(data[len(MAGIC) + 1:], codec)
+    (length,) = struct.unpack_from('<I', payload)
+    skeleton = json.loads(payload[4:4 + length])
+    return _unpack(skeleton, memoryview(payload)[4 + length:])
+
+
+class PackedValue:
+    """从数据库读取的未解码值"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def decode(self):
+        return decode(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def is_packed(self):
+        """是否为本格式编码的值，否则为 JSON 文本"""
+        return self.data.startswith(MAGIC)
+
+    def __repr__(self):
+        return f'<PackedValue: {len(self.data)} bytes>'
+
+
+class PackedJSONAttribute(DeferredAttribute):
+    """首次访问时解码字段值，之后直接返回解码后的值"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, PackedValue):
+            value = value.decode()
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class PackedJSONField(models.BinaryField):
+    """以压缩二进制保存 JSON 文档的字段，数值数组按类型打包（见模块说明）"""
+    descriptor_class = PackedJSONAttribute
+    description = 'Compressed JSON document with packed numeric arrays'
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('editable') is True:
+            del kwargs['editable']
+        return name, path, args, kwargs
+
+    def get_default(self):
+        # BinaryField 会把缺省值转换为字节串，这里保留字典、列表等文档
+        if self.has_default():
+            return self.default() if callable(self.default) else self.default
+        return None if self.null else {}
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # 尚未转换的 JSON 列（见 pack_json_fields 命令）
+            return PackedValue(value.encode())
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            # 数据库驱动已解析的 JSON 列
+            return PackedValue(json.dumps(value, separators=(',', ':')).encode())
+        return PackedValue(bytes(value))
+
+    def to_python(self, value):
+        if isinstance(value, PackedValue):
+            return value.decode()
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return decode(value)
+        if isinstance(value, str):
+            # 序列化（dumpdata）时为 base64 编码的二进制值
+            return decode(super().to_python(value))
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, PackedValue):
+            return value.data
+        return encode(value)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'form_class': forms.JSONField, **kwargs})
+
+    def value_to_string(self, obj):
+        return b64encode(self.get_prep_value(self.value_from_object(obj))).decode('ascii')
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from experiments.benchmarks import DEFAULT_REPEAT, DEFAULT_SIZES, DEFAULT_THRESHOLD, BenchmarkSuite, compare
+from experiments.synthetic import TECHNIQUES
+
+
+def _list(value, convert=str):
+    return [convert(item.strip()) for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    """在独立的测试数据库中用合成曲线运行性能基准，输出JSON结果"""
+    help = 'Run the performance benchmark suite on synthetic voltammograms'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--techniques', default=','.join(TECHNIQUES), help='实验类型，逗号分隔')
+        parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                            help='每条曲线的点数，逗号分隔，最多5000000')
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='每项测量的重复次数')
+        parser.add_argument('--output', help='结果JSON文件，缺省输出到标准输出')
+        parser.add_argument('--baseline', help='基线结果JSON文件，有项目比基线慢超过阈值时命令失败')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='相对基线允许的变慢比例，默认0.2')
+
+    def handle(self, *args, **options):
+        techniques = _list(options['techniques'])
+        unknown = set(techniques) - set(TECHNIQUES)
+        if unknown:
+            raise CommandError(f"Unknown techniques: {', '.join(sorted(unknown))}")
+        try:
+            sizes = _list(options['sizes'], int)
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        results = self._run(techniques, sizes, options['repeat'])
+
+        content = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(content + '\n')
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(content)
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            for item in regressions:
+                self.stderr.write(self.style.ERROR(
+                    f"{item['benchmark']} {item['technique'] or '-'} {item['points']}: "
+                    f"{item['baseline_seconds'] * 1000:.2f} ms -> {item['seconds'] * 1000:.2f} ms ({item['ratio']:.2f}x)"
+                ))
+            if regressions:
+                raise CommandError(f'{len(regressions)} benchmarks regressed by more than {options["threshold"]:.0%}')
+            self.stderr.write(self.style.SUCCESS('No regressions against baseline'))
+
+    def _run(self, techniques, sizes, repeat):
+        """在测试数据库中运行，SQLite 使用临时文件而非内存数据库，运行结束后删除"""
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        original_test_name = test_settings.get('NAME')
+        directory = None
+        if connection.vendor == 'sqlite' and not original_test_name:
+            directory = tempfile.mkdtemp(prefix='benchmark-')
+            test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            suite = BenchmarkSuite(repeat=repeat, log=self.stderr.write)
+            return suite.run(techniques, sizes)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            test_settings['NAME'] = original_test_name
+            if directory is not None:
+                os.rmdir(directory)
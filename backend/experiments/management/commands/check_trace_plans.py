@@ -0,0 +1,58 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from experiments.models import Experiment
+
+# 各数据库执行计划中表示排序（内存或临时文件）的模式
+SORT_PATTERNS = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+    'postgresql': re.compile(r'^\s*(->\s*)?(Incremental )?Sort\b', re.MULTILINE),
+    'mysql': re.compile(r'Using filesort'),
+}
+
+RANGE_QUERIES = [
+    ('full trace', {}),
+    ('cycle', {'cycle': 7}),
+    ('time window', {'time_min': 1_700_000_000_000_000, 'time_max': 1_700_000_060_000_000}),
+    ('voltage window', {'v_min': -0.2, 'v_max': 0.4}),
+    ('cycle and voltage window', {'cycle': 7, 'v_min': -0.2, 'v_max': 0.4}),
+]
+
+
+class Command(BaseCommand):
+    """检查数据点范围查询的执行计划，确认分块按索引顺序读取而不排序"""
+    help = 'Verify that trace range queries read chunks in index order without sorting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--experiment', type=int, help='使用的实验ID，缺省为数据点最多的实验')
+        parser.add_argument('--show-plans', action='store_true', help='输出完整执行计划')
+
+    def handle(self, *args, **options):
+        pattern = SORT_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f'Unsupported database backend: {connection.vendor}')
+
+        experiments = Experiment.objects.order_by('-data_points_count')
+        if options['experiment']:
+            experiments = experiments.filter(id=options['experiment'])
+        experiment = experiments.first()
+        if experiment is None:
+            raise CommandError('Experiment not found')
+
+        failures = 0
+        for name, filters in RANGE_QUERIES:
+            for start in (0, 1):
+                label = f'{name} (from offset {start})'
+                plan = experiment.trace.where(**filters).chunk_query(['voltage', 'current'], start=start).explain()
+                if options['show_plans']:
+                    self.stdout.write(f'{label}:\n{plan}\n')
+                if pattern.search(plan):
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f'{label}: sorts'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{label}: index order'))
+
+        if failures:
+            raise CommandError(f'{failures} range queries sort instead of reading in index order')
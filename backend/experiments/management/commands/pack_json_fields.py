@@ -0,0 +1,69 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+
+from experiments.fields import PackedJSONField, PackedValue, encode
+
+
+class Command(BaseCommand):
+    """将由 JSONField 改为 PackedJSONField 的列转换为二进制列，并重新编码已有的 JSON 值"""
+    help = 'Convert legacy JSON columns of PackedJSONFields to packed binary values'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            for field in model._meta.concrete_fields:
+                if isinstance(field, PackedJSONField):
+                    self._convert_column(model, field)
+                    total = self._repack(model, field, options['batch_size'])
+                    self.stdout.write(self.style.SUCCESS(
+                        f'{model._meta.label}.{field.name}: packed {total} values'
+                    ))
+
+    def _column_type(self, model, field):
+        with connection.cursor() as cursor:
+            description = connection.introspection.get_table_description(cursor, model._meta.db_table)
+        for column in description:
+            if column.name == field.column:
+                return connection.introspection.get_field_type(column.type_code, column)
+        return None
+
+    def _convert_column(self, model, field):
+        """列类型仍为 JSON/文本时改为二进制，原值保存为 JSON 文本"""
+        column_type = self._column_type(model, field)
+        if column_type in (None, 'BinaryField'):
+            return
+        self.stdout.write(f'{model._meta.label}.{field.name}: converting {column_type} column to binary')
+        if connection.vendor == 'postgresql':
+            # jsonb 不能直接转换为 bytea
+            table, column = connection.ops.quote_name(model._meta.db_table), connection.ops.quote_name(field.column)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} TYPE bytea USING convert_to({column}::text, 'UTF8')"
+                )
+            return
+        legacy = models.JSONField(null=field.null, blank=field.blank)
+        legacy.set_attributes_from_name(field.name)
+        legacy.model = model
+        with connection.schema_editor() as schema_editor:
+            schema_editor.alter_field(model, legacy, field)
+
+    def _repack(self, model, field, batch_size):
+        """逐批读取未编码的值，解析后按 PackedJSONField 格式写回"""
+        manager = model._base_manager
+        rows = manager.exclude(**{f'{field.attname}__isnull': True}).order_by('pk')
+        total = 0
+        last = None
+        while True:
+            batch = rows if last is None else rows.filter(pk__gt=last)
+            batch = list(batch.values_list('pk', field.attname)[:batch_size])
+            if not batch:
+                return total
+            last = batch[-1][0]
+            with transaction.atomic():
+                for pk, value in batch:
+                    if not value.is_packed:
+                        manager.filter(pk=pk).update(**{field.attname: PackedValue(encode(value.decode()))})
+                        total += 1
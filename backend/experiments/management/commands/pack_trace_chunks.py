@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from experiments.models import Experiment, ExperimentDataPoint
+from experiments.pyramid import build_pyramid
+from experiments.storage import to_epoch_us
+
+
+class Command(BaseCommand):
+    """将旧版逐点存储的数据点转换为列式分块"""
+    help = 'Pack legacy ExperimentDataPoint rows into columnar trace chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--keep-rows', action='store_true', help='转换后保留原数据点行')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        experiment_ids = ExperimentDataPoint.objects.values_list('experiment_id', flat=True).distinct()
+
+        for experiment in Experiment.objects.filter(id__in=list(experiment_ids)):
+            store = experiment.trace
+            if store.count():
+                self.stdout.write(self.style.WARNING(f'Skipping {experiment}: trace chunks already exist'))
+                continue
+
+            rows = ExperimentDataPoint.objects.filter(experiment=experiment).order_by('timestamp', 'id')
+            total = 0
+            with transaction.atomic():
+                values = rows.values_list('timestamp', 'voltage', 'current', 'cycle', 'temperature', 'ph')
+                batch = []
+                for row in values.iterator(chunk_size=batch_size):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        total += self._append(store, batch)
+                        batch = []
+                if batch:
+                    total += self._append(store, batch)
+                store.compact()
+                if experiment.status == 'completed':
+                    build_pyramid(store)
+
+                if not options['keep_rows']:
+                    rows.delete()
+
+            self.stdout.write(self.style.SUCCESS(f'Packed {total} points for {experiment}'))
+
+    def _append(self, store, rows):
+        timestamps, voltages, currents, cycles, temperatures, phs = zip(*rows)
+        return store.append({
+            'timestamp': [to_epoch_us(timestamp) for timestamp in timestamps],
+            'voltage': voltages,
+            'current': currents,
+            'cycle': cycles,
+            'temperature': [float('nan') if value is None else value for value in temperatures],
+            'ph': [float('nan') if value is None else value for value in phs],
+        })
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 import json
 
+from .fields import PackedJSONField
+
 
 class Experiment(models.Model):
     """实验模型"""
@@ -50,6 +52,15 @@ class Experiment(models.Model):
     # 元数据
     metadata = models.JSONField(default=dict, blank=True)
     
+    # 数据统计摘要，写入数据点时增量更新
+    trace_summary = models.JSONField(default=dict, blank=True)
+    # 数据点数量，写入数据点时同步更新，列表无需逐个统计
+    data_points_count = models.PositiveIntegerField(default=0)
+    # 数据版本，每次写入或清空数据点时递增，用于判断分析结果是否仍然有效
+    data_version = models.PositiveIntegerField(default=0)
+    # 循环与扫描方向的分段索引状态，写入数据点时增量更新（见 experiments.segments）
+    trace_segments = models.JSONField(default=dict, blank=True)
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = "实验"
@@ -66,13 +77,94 @@ class Experiment(models.Model):
         return None
     
     @property
-    def data_points_count(self):
-        """获取数据点数量"""
-        return self.data_points.count()
+    def trace(self):
+        """实验曲线的列式存储"""
+        from .storage import TraceStore
+        return TraceStore(self)
+
+
+class ExperimentTraceChunk(models.Model):
+    """实验曲线分块模型，每行以小端序定长数组保存一段连续数据点的各列"""
+    experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='trace_chunks')
+    start_offset = models.BigIntegerField(help_text="首个数据点在曲线中的位置")
+    point_count = models.IntegerField(help_text="分块内数据点数量")
+    
+    # 列数据
+    timestamps = models.BinaryField(help_text="时间戳 (int64, Unix微秒)")
+    voltages = models.BinaryField(help_text="电压 (float64, V)")
+    currents = models.BinaryField(help_text="电流 (float64, A)")
+    cycles = models.BinaryField(help_text="循环次数 (int32)")
+    temperatures = models.BinaryField(help_text="温度 (float64, °C，缺失为NaN)")
+    phs = models.BinaryField(help_text="pH值 (float64，缺失为NaN)")
+    
+    # 分块范围，用于按循环、时间和电压范围查询时跳过不相关的分块
+    cycle_min = models.IntegerField()
+    cycle_max = models.IntegerField()
+    time_min = models.BigIntegerField(help_text="最早时间戳 (Unix微秒)")
+    time_max = models.BigIntegerField(help_text="最晚时间戳 (Unix微秒)")
+    voltage_min = models.FloatField()
+    voltage_max = models.FloatField()
+    
+    class Meta:
+        ordering = ['experiment', 'start_offset']
+        unique_together = [('experiment', 'start_offset')]
+        verbose_name = "数据分块"
+        verbose_name_plural = "数据分块"
+    
+    def __str__(self):
+        return f"Points {self.start_offset}-{self.start_offset + self.point_count - 1} for {self.experiment}"
+
+
+class ExperimentDataBatch(models.Model):
+    """已写入的数据点批次，按客户端提供的批次键识别重试的批次，避免重复写入"""
+    experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='data_batches')
+    key = models.CharField(max_length=64, help_text="批次键（批次序号或幂等键）")
+    digest = models.CharField(max_length=64, help_text="批次数据的SHA-256摘要")
+    start_offset = models.BigIntegerField(help_text="批次首个数据点在曲线中的位置")
+    point_count = models.IntegerField(help_text="批次数据点数量")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = [('experiment', 'key')]
+        verbose_name = "数据批次"
+        verbose_name_plural = "数据批次"
+    
+    def __str__(self):
+        return f"Batch {self.key} for {self.experiment}"
+
+
+class ExperimentTraceLevel(models.Model):
+    """实验曲线降采样层级分块，实验结束时构建，用于按分辨率读取图表数据"""
+    experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='trace_levels')
+    level = models.IntegerField(help_text="层级，1为最细，每级点数约为上一级的1/4")
+    start_offset = models.BigIntegerField(help_text="首个点在该层级中的位置")
+    point_count = models.IntegerField(help_text="分块内点数量")
+    
+    # 列数据
+    indexes = models.BinaryField(help_text="原始数据点位置 (int64)")
+    voltages = models.BinaryField(help_text="电压 (float64, V)")
+    currents = models.BinaryField(help_text="电流 (float64, A)")
+    cycles = models.BinaryField(help_text="循环次数 (int32)")
+    
+    # 分块范围，用于跳过不满足筛选条件的分块
+    cycle_min = models.IntegerField()
+    cycle_max = models.IntegerField()
+    voltage_min = models.FloatField()
+    voltage_max = models.FloatField()
+    
+    class Meta:
+        ordering = ['experiment', 'level', 'start_offset']
+        unique_together = [('experiment', 'level', 'start_offset')]
+        verbose_name = "降采样分块"
+        verbose_name_plural = "降采样分块"
+    
+    def __str__(self):
+        return f"Level {self.level} points {self.start_offset}-{self.start_offset + self.point_count - 1} for {self.experiment}"
 
 
 class ExperimentDataPoint(models.Model):
-    """实验数据点模型"""
+    """实验数据点模型（旧版逐点存储，仅用于迁移历史数据，新数据写入ExperimentTraceChunk）"""
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='data_points')
     timestamp = models.DateTimeField()
     voltage = models.FloatField(help_text="电压 (V)")
@@ -158,10 +250,13 @@ class ExperimentResult(models.Model):
     avg_current = models.FloatField(null=True, blank=True)
     
     # 分析数据
-    analysis_data = models.JSONField(default=dict, blank=True)
+    analysis_data = PackedJSONField(default=dict, blank=True)
     
     # 图表数据
-    chart_data = models.JSONField(default=dict, blank=True)
+    chart_data = PackedJSONField(default=dict, blank=True)
+    
+    # 循环与扫描方向的分段索引，[start, stop) 为数据点位置
+    segments = models.JSONField(default=dict, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
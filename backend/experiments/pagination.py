@@ -0,0 +1,89 @@
+from base64 import b64decode, b64encode
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+DEFAULT_TRACE_PAGE_SIZE = 1000
+MAX_TRACE_PAGE_SIZE = 10000
+
+
+class TraceCursorPagination(BasePagination):
+    """
+    实验数据点的游标（键集）分页
+
+    游标编码下一页首个数据点在曲线中的位置，按 (experiment, start_offset) 索引直接定位
+    所在分块，任意深度的分页开销相同。数据点只追加不修改，因此游标在实验写入过程中保持有效。
+    store 带范围筛选条件时从游标位置向后读取满足条件的数据点，只提供下一页链接。
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        default = api_settings.PAGE_SIZE or DEFAULT_TRACE_PAGE_SIZE
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param], strict=True, cutoff=MAX_TRACE_PAGE_SIZE
+            )
+        except (KeyError, ValueError):
+            return default
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return 0
+        try:
+            return _positive_int(b64decode(encoded.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        url = self.request.build_absolute_uri()
+        if position <= 0:
+            return remove_query_param(url, self.cursor_query_param)
+        encoded = b64encode(str(position).encode('ascii')).decode('ascii')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, store, request, view=None):
+        """store 为 TraceStore，多读取一个点以判断是否还有下一页"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.start = self.decode_cursor(request)
+        self.filtered = bool(store.filters)
+
+        # 无筛选条件时所需区间已知，只读取该区间所在的分块
+        stop = None if self.filtered else self.start + self.page_size + 1
+        points = store.points(self.start, stop, limit=self.page_size + 1)
+        self.has_next = len(points) > self.page_size
+        self.next_start = points[self.page_size]['index'] if self.has_next else None
+        return points[:self.page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.next_start)
+
+    def get_previous_link(self):
+        if not self.start or self.filtered:
+            return None
+        return self.encode_cursor(max(self.start - self.page_size, 0))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,54 @@
+import numpy as np
+from django.utils.http import parse_header_parameters
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .storage import TRACE_COLUMNS, REQUIRED_COLUMNS
+
+
+def parse_column_names(value):
+    """解析逗号分隔的列名，缺省为必需列"""
+    names = [name.strip() for name in (value or ','.join(REQUIRED_COLUMNS)).split(',')]
+    unknown = [name for name in names if name not in TRACE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate columns")
+    return names
+
+
+def unpack_columns(body, names):
+    """将依次排列的各列小端序数组拆分为列名到 NumPy 数组的字典，数组直接引用 body"""
+    dtypes = [np.dtype(TRACE_COLUMNS[name][1]) for name in names]
+    row_size = sum(dtype.itemsize for dtype in dtypes)
+    if not body or len(body) % row_size:
+        raise ValueError(f"Body length must be a non-zero multiple of {row_size} bytes")
+
+    count = len(body) // row_size
+    columns = {}
+    offset = 0
+    for name, dtype in zip(names, dtypes):
+        columns[name] = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+    return columns
+
+
+class TraceColumnsParser(BaseParser):
+    """
+    按列打包的二进制数据点解析器
+
+    Content-Type: application/x-trace-columns; columns=timestamp,voltage,current,cycle
+
+    请求体依次为 columns 中各列的小端序定长数组，各列类型与存储一致：
+    timestamp 为 int64 Unix微秒，cycle 为 int32，其余为 float64。
+    解析结果为列名到 NumPy 数组的字典，数组直接引用请求体，不做逐点转换。
+    """
+    media_type = 'application/x-trace-columns'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        _, params = parse_header_parameters(media_type or self.media_type)
+        body = stream.read() if stream is not None else b''
+        try:
+            return unpack_columns(body, parse_column_names(params.get('columns')))
+        except ValueError as e:
+            raise ParseError(str(e))
@@ -0,0 +1,219 @@
+"""
+实验曲线的多分辨率降采样
+
+实验结束时由原始曲线逐级构建降采样层级：每级将上一级每 PYRAMID_BUCKET_SIZE 个点
+缩减为其中电流最小和最大的两个点，保留峰形。图表请求按点数预算选择合适的层级，
+只读取满足筛选条件的分块，再降采样到不超过所需点数。
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import ExperimentTraceLevel
+from .storage import overlapping_chunks
+
+PYRAMID_BUCKET_SIZE = 8
+# 层级点数不超过该值时不再构建更粗的层级
+PYRAMID_MIN_POINTS = 1024
+# 选择层级时允许读取的点数为请求点数的倍数
+OVERSAMPLE = 4
+
+# 列名 -> (层级模型字段, 存储类型)
+LEVEL_COLUMNS = {
+    'index': ('indexes', '<i8'),
+    'voltage': ('voltages', '<f8'),
+    'current': ('currents', '<f8'),
+    'cycle': ('cycles', '<i4'),
+}
+
+
+def minmax_indices(values, bucket_size):
+    """每 bucket_size 个点保留最小值和最大值，按原顺序返回所选位置"""
+    length = len(values)
+    if length <= 2 or bucket_size <= 2:
+        return np.arange(length)
+
+    buckets = -(-length // bucket_size)
+    padded = np.concatenate([values, np.full(buckets * bucket_size - length, values[-1])])
+    blocks = padded.reshape(buckets, bucket_size)
+    base = np.arange(buckets) * bucket_size
+    low = base + blocks.argmin(axis=1)
+    high = base + blocks.argmax(axis=1)
+
+    selected = np.stack([np.minimum(low, high), np.maximum(low, high)], axis=1).ravel()
+    keep = np.ones(len(selected), dtype=bool)
+    keep[1::2] = selected[1::2] != selected[0::2]
+    return np.minimum(selected[keep], length - 1)
+
+
+def downsample_columns(columns, max_points):
+    """将列数组降采样到不超过 max_points 个点"""
+    length = len(columns['current'])
+    if length <= max_points:
+        return columns
+    bucket_size = -(-length // (max_points // 2))
+    selected = minmax_indices(columns['current'], bucket_size)
+    return {name: values[selected] for name, values in columns.items()}
+
+
+def _build_block(experiment, level, start_offset, columns):
+    block = ExperimentTraceLevel(
+        experiment=experiment,
+        level=level,
+        start_offset=start_offset,
+        point_count=len(columns['index']),
+        cycle_min=int(columns['cycle'].min()),
+        cycle_max=int(columns['cycle'].max()),
+        voltage_min=float(columns['voltage'].min()),
+        voltage_max=float(columns['voltage'].max()),
+    )
+    for name, (field, dtype) in LEVEL_COLUMNS.items():
+        setattr(block, field, np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+    return block
+
+
+def _raw_blocks(store):
+    for offset, columns in store.iter_chunks(['voltage', 'current', 'cycle']):
+        columns['index'] = np.arange(offset, offset + len(columns['current']), dtype='<i8')
+        yield columns
+
+
+def _overlapping(blocks, cycle=None, v_min=None, v_max=None):
+    """按分块范围筛选可能包含满足条件数据点的分块"""
+    if cycle is not None:
+        blocks = blocks.filter(cycle_min__lte=cycle, cycle_max__gte=cycle)
+    if v_min is not None:
+        blocks = blocks.filter(voltage_max__gte=v_min)
+    if v_max is not None:
+        blocks = blocks.filter(voltage_min__lte=v_max)
+    return blocks
+
+
+def _level_blocks(experiment, level, **filters):
+    blocks = _overlapping(ExperimentTraceLevel.objects.filter(experiment=experiment, level=level), **filters)
+    names = list(LEVEL_COLUMNS)
+    rows = blocks.order_by('start_offset').values_list(*(LEVEL_COLUMNS[name][0] for name in names))
+    for blobs in rows.iterator(chunk_size=16):
+        yield {
+            name: np.frombuffer(blob, dtype=LEVEL_COLUMNS[name][1])
+            for name, blob in zip(names, blobs)
+        }
+
+
+def _write_level(experiment, level, source, block_size):
+    """由上一级分块流式生成一个层级，返回该层级点数"""
+    buffer = {name: np.empty(0, dtype=dtype) for name, (field, dtype) in LEVEL_COLUMNS.items()}
+    written = 0
+    pending = []
+
+    def flush(columns):
+        nonlocal written
+        pending.append(_build_block(experiment, level, written, columns))
+        written += len(columns['index'])
+        if len(pending) >= 16:
+            ExperimentTraceLevel.objects.bulk_create(pending)
+            pending.clear()
+
+    for columns in source:
+        selected = minmax_indices(columns['current'], PYRAMID_BUCKET_SIZE)
+        for name in LEVEL_COLUMNS:
+            buffer[name] = np.concatenate([buffer[name], columns[name][selected]])
+        while len(buffer['index']) >= block_size:
+            flush({name: values[:block_size] for name, values in buffer.items()})
+            buffer = {name: values[block_size:] for name, values in buffer.items()}
+
+    if len(buffer['index']):
+        flush(buffer)
+    ExperimentTraceLevel.objects.bulk_create(pending)
+    return written
+
+
+def build_pyramid(store):
+    """重建实验的降采样层级，每次只在内存中保留一个分块"""
+    experiment = store.experiment
+    with transaction.atomic():
+        ExperimentTraceLevel.objects.filter(experiment=experiment).delete()
+
+        total = store.count()
+        source = _raw_blocks(store)
+        level = 1
+        while total > PYRAMID_MIN_POINTS:
+            total = _write_level(experiment, level, source, store.chunk_size)
+            source = _level_blocks(experiment, level)
+            level += 1
+
+
+def _filter_columns(columns, cycle=None, v_min=None, v_max=None):
+    mask = np.ones(len(columns['current']), dtype=bool)
+    if cycle is not None:
+        mask &= columns['cycle'] == cycle
+    if v_min is not None:
+        mask &= columns['voltage'] >= v_min
+    if v_max is not None:
+        mask &= columns['voltage'] <= v_max
+    if mask.all():
+        return columns
+    return {name: values[mask] for name, values in columns.items()}
+
+
+def _concat(blocks):
+    blocks = list(blocks)
+    if not blocks:
+        return {name: np.empty(0, dtype=dtype) for name, (field, dtype) in LEVEL_COLUMNS.items()}
+    return {name: np.concatenate([block[name] for block in blocks]) for name in LEVEL_COLUMNS}
+
+
+def _reduce_raw(store, max_points, **filters):
+    """
+    逐块降采样原始曲线，内存中只保留一个分块和已选出的点
+
+    按原始分块的范围估计满足筛选条件的点数，据此确定各分块内的桶大小。
+    """
+    chunks = overlapping_chunks(store.chunks, **filters)
+    estimate = chunks.aggregate(total=Sum('point_count'))['total'] or 0
+    bucket_size = max(-(-estimate // (max_points // 2)), 1)
+    selected = []
+    for block in _raw_blocks(store.where(**filters)):
+        block = _filter_columns(block, **filters)
+        if len(block['current']):
+            indices = minmax_indices(block['current'], bucket_size)
+            selected.append({name: values[indices] for name, values in block.items()})
+    return _concat(selected)
+
+
+def downsample(store, max_points, cycle=None, v_min=None, v_max=None):
+    """
+    读取不超过 max_points 个点的保形降采样曲线，返回 (层级, 列数组)
+
+    层级0表示读取原始曲线：实验未结束或降采样层级尚未生成时使用，原始点数超出预算时逐块降采样。
+    否则按分块范围估计各层级满足筛选条件的点数，选择估计值不超过预算的最细层级。
+    """
+    filters = {'cycle': cycle, 'v_min': v_min, 'v_max': v_max}
+    budget = max_points * OVERSAMPLE
+    total = store.count()
+
+    level = 0
+    if store.experiment.status == 'completed' and total > budget:
+        blocks = _overlapping(ExperimentTraceLevel.objects.filter(experiment=store.experiment), **filters)
+        estimates = dict(blocks.order_by().values_list('level').annotate(total=Sum('point_count')))
+        within_budget = [lvl for lvl, total in estimates.items() if total <= budget]
+        if within_budget:
+            level = min(within_budget)
+        elif estimates:
+            level = max(estimates)
+        elif ExperimentTraceLevel.objects.filter(experiment=store.experiment).exists():
+            # 没有分块与筛选条件重叠
+            return 1, _concat([])
+
+    if level:
+        columns = _concat(
+            _filter_columns(block, **filters)
+            for block in _level_blocks(store.experiment, level, **filters)
+        )
+    elif total > budget:
+        columns = _reduce_raw(store, max_points, **filters)
+    else:
+        columns = _concat(
+            _filter_columns(block, **filters) for block in _raw_blocks(store)
+        )
+    return level, downsample_columns(columns, max_points)
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/experiments/<int:pk>/stream/', consumers.ExperimentStreamConsumer.as_asgi()),
+]
@@ -0,0 +1,180 @@
+"""
+循环与扫描方向的分段索引
+
+CV 曲线按循环和扫描方向（电压上升为正扫、下降为反扫）划分为若干段，每段记录
+[start, stop) 在曲线中的位置。索引在写入数据点时增量更新（TraceStore.append_batch），
+实验结束时保存到 ExperimentResult.segments，分析和范围查询据此直接截取数组，无需重新
+扫描电压。
+
+换向判断带有回差：电压从本段的极值回退超过 threshold 才视为换向，换向点为该极值点，
+因此噪声不会产生伪分段；循环号变化时也开始新的一段。索引状态为可直接存入 JSONField 的
+字典，已结束的段保存为 [循环, 方向, 起点, 终点]，方向 1 为正扫、-1 为反扫、0 为尚未判断。
+"""
+import numpy as np
+from django.conf import settings
+
+DEFAULT_THRESHOLD = 0.005
+# 查找换向点时每次扫描的点数
+SCAN_BLOCK = 4096
+SWEEPS = {1: 'forward', -1: 'reverse', 0: None}
+SWEEP_DIRECTIONS = {'forward': 1, 'reverse': -1}
+
+
+def get_threshold():
+    return getattr(settings, 'EXPERIMENT_SEGMENT_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def empty_state(threshold=None):
+    return {
+        'threshold': get_threshold() if threshold is None else threshold,
+        'length': 0,
+        'segments': [],
+        'open': None,
+    }
+
+
+def _open(cycle, start, voltage):
+    """新的一段：方向未定，origin 为起点电压"""
+    return {'cycle': cycle, 'direction': 0, 'start': start, 'origin': voltage,
+            'extreme': voltage, 'extreme_index': start}
+
+
+def _close(state, stop):
+    current = state['open']
+    if current is not None and stop > current['start']:
+        state['segments'].append([current['cycle'], current['direction'], current['start'], stop])
+    state['open'] = None
+
+
+def _scan(state, voltage, low, high, offset):
+    """在循环号不变的区间 [low, high) 内判断方向并查找换向点"""
+    threshold = state['threshold']
+    position = low
+    while position < high:
+        current = state['open']
+        direction = current['direction']
+        block = voltage[position:min(position + SCAN_BLOCK, high)]
+
+        if not direction:
+            moved = np.flatnonzero(np.abs(block - current['origin']) > threshold)
+            if not len(moved):
+                position += len(block)
+                continue
+            index = int(moved[0])
+            current.update(direction=1 if block[index] > current['origin'] else -1,
+                           extreme=float(block[index]), extreme_index=offset + position + index)
+            position += index + 1
+            continue
+
+        # 沿扫描方向的累计极值，回退超过 threshold 的首个点即为换向
+        signed = direction * block
+        running = np.maximum(np.maximum.accumulate(signed), direction * current['extreme'])
+        reversed_at = np.flatnonzero(running - signed > threshold)
+        end = int(reversed_at[0]) if len(reversed_at) else len(block)
+        if end:
+            peak = int(np.argmax(signed[:end]))
+            if signed[peak] > direction * current['extreme']:
+                current.update(extreme=float(block[peak]), extreme_index=offset + position + peak)
+        if not len(reversed_at):
+            position += len(block)
+            continue
+
+        # 换向点归入本段，下一段从其后一点开始；下一段目前的极值在换向点之后到回退点之间
+        turn = current['extreme_index'] + 1
+        _close(state, turn)
+        first = max(turn - offset, low)
+        stop = position + end + 1
+        following = int(np.argmax(-direction * voltage[first:stop]))
+        state['open'] = {
+            'cycle': current['cycle'], 'direction': -direction, 'start': turn, 'origin': current['extreme'],
+            'extreme': float(voltage[first + following]), 'extreme_index': offset + first + following,
+        }
+        position = stop
+
+
+def extend(state, voltage, cycle):
+    """将紧接在已索引数据之后的一批数据点加入索引，返回新的索引状态"""
+    state = dict(state) if state else empty_state()
+    state['segments'] = list(state['segments'])
+    state['open'] = dict(state['open']) if state['open'] else None
+    offset = state['length']
+    length = len(voltage)
+    if not length:
+        return state
+
+    voltage = np.asarray(voltage, dtype=float)
+    cycle = np.asarray(cycle)
+    # 按循环号划分区间，每个区间内单独判断换向
+    breaks = np.flatnonzero(np.diff(cycle)) + 1
+    for low, high in zip(np.concatenate([[0], breaks]).tolist(), np.concatenate([breaks, [length]]).tolist()):
+        value = int(cycle[low])
+        if state['open'] is None or state['open']['cycle'] != value:
+            _close(state, offset + low)
+            state['open'] = _open(value, offset + low, float(voltage[low]))
+        _scan(state, voltage, low, high, offset)
+
+    state['length'] = offset + length
+    return state
+
+
+def build(chunks, threshold=None):
+    """由按顺序产出列数组字典的分块（需包含 voltage 和 cycle 列）重新建立索引状态"""
+    state = empty_state(threshold)
+    for columns in chunks:
+        state = extend(state, columns['voltage'], columns['cycle'])
+    return state
+
+
+def segment_index(state):
+    """索引状态对应的分段列表，未结束的段截止到已索引数据的末尾"""
+    if not state:
+        return []
+    segments = list(state['segments'])
+    current = state['open']
+    if current is not None and state['length'] > current['start']:
+        segments.append([current['cycle'], current['direction'], current['start'], state['length']])
+    return [
+        {'cycle': cycle, 'sweep': SWEEPS[direction], 'start': start, 'stop': stop}
+        for cycle, direction, start, stop in segments
+    ]
+
+
+def report(state):
+    """可存入 ExperimentResult.segments 的索引"""
+    if not state:
+        return {}
+    return {'threshold': state['threshold'], 'length': state['length'], 'segments': segment_index(state)}
+
+
+def sweep_ranges(segments, sweep=None, cycle=None):
+    """满足扫描方向和循环条件的各段 [start, stop) 区间，相邻区间合并"""
+    ranges = []
+    for segment in segments:
+        if sweep is not None and segment['sweep'] != sweep:
+            continue
+        if cycle is not None and segment['cycle'] != cycle:
+            continue
+        if ranges and ranges[-1][1] == segment['start']:
+            ranges[-1] = (ranges[-1][0], segment['stop'])
+        else:
+            ranges.append((segment['start'], segment['stop']))
+    return ranges
+
+
+def directions(segments, start, stop):
+    """区间 [start, stop) 内各点的扫描方向（1 为正扫、-1 为反扫、0 为未判断或未索引）"""
+    result = np.zeros(stop - start, dtype=np.int8)
+    for segment in segments:
+        low, high = max(segment['start'], start), min(segment['stop'], stop)
+        if low < high:
+            result[low - start:high - start] = SWEEP_DIRECTIONS.get(segment['sweep'], 0)
+    return result
+
+
+def sweep_at(segments, index):
+    """数据点所在段的扫描方向，未索引时返回 None"""
+    starts = [segment['start'] for segment in segments]
+    position = int(np.searchsorted(starts, index, side='right')) - 1
+    if position >= 0 and index < segments[position]['stop']:
+        return segments[position]['sweep']
+    return None
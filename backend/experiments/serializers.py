@@ -1,17 +1,41 @@
-from rest_framework import serializers
-from .models import Experiment, ExperimentDataPoint, Device, ExperimentTemplate, ExperimentResult
+from rest_framework import permissions, serializers
+from .models import Experiment, Device, ExperimentTemplate, ExperimentResult
+from .storage import columns_from_points
 
 
-class ExperimentDataPointSerializer(serializers.ModelSerializer):
-    """实验数据点序列化器"""
-    class Meta:
-        model = ExperimentDataPoint
-        fields = ['id', 'timestamp', 'voltage', 'current', 'cycle', 'temperature', 'ph']
+def _split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    按查询参数选择输出字段
+
+    ?fields=id,name 只输出列出的字段；optional_fields 中的字段默认不输出，
+    需要时用 ?include=data_points 指定。只作用于读取请求的顶层序列化器。
+    """
+    optional_fields = ()
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        params = request.query_params if request is not None and request.method in permissions.SAFE_METHODS else {}
+        
+        include = _split_param(params.get('include'))
+        for name in self.optional_fields:
+            if name not in include:
+                fields.pop(name, None)
+        
+        requested = _split_param(params.get('fields'))
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested | include}
+        return fields
 
 
-class ExperimentSerializer(serializers.ModelSerializer):
-    """实验序列化器"""
-    data_points = ExperimentDataPointSerializer(many=True, read_only=True)
+class ExperimentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """实验序列化器，数据点需通过 ?include=data_points 请求"""
+    optional_fields = ('data_points',)
+    data_points = serializers.SerializerMethodField()
     duration = serializers.ReadOnlyField()
     data_points_count = serializers.ReadOnlyField()
     user_name = serializers.CharField(source='user.username', read_only=True)
@@ -27,12 +51,15 @@ class ExperimentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'started_at', 'completed_at']
     
+    def get_data_points(self, obj):
+        return obj.trace.points()
+    
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
 
-class ExperimentListSerializer(serializers.ModelSerializer):
+class ExperimentListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """实验列表序列化器（不包含数据点）"""
     duration = serializers.ReadOnlyField()
     data_points_count = serializers.ReadOnlyField()
@@ -81,6 +108,9 @@ class ExperimentTemplateSerializer(serializers.ModelSerializer):
 class ExperimentResultSerializer(serializers.ModelSerializer):
     """实验结果序列化器"""
     experiment_name = serializers.CharField(source='experiment.name', read_only=True)
+    # 压缩存储的字段（PackedJSONField）按 JSON 文档输出
+    analysis_data = serializers.JSONField(read_only=True)
+    chart_data = serializers.JSONField(read_only=True)
     
     class Meta:
         model = ExperimentResult
@@ -88,7 +118,7 @@ class ExperimentResultSerializer(serializers.ModelSerializer):
             'id', 'experiment', 'experiment_name',
             'peak_current', 'peak_voltage', 'onset_potential',
             'max_current', 'min_current', 'avg_current',
-            'analysis_data', 'chart_data',
+            'analysis_data', 'chart_data', 'segments',
             'created_at', 'updated_at'
         ]
 
@@ -115,46 +145,44 @@ class ExperimentUpdateSerializer(serializers.ModelSerializer):
         fields = [
             'name', 'description', 'tags', 'metadata', 'status'
         ]
+    
+    def update(self, instance, validated_data):
+        # 只保存修改的字段，避免覆盖采集过程中并发更新的统计摘要
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data) + ['updated_at'])
+        return instance
 
 
 class DataPointBatchSerializer(serializers.Serializer):
-    """批量数据点序列化器"""
-    experiment_id = serializers.IntegerField()
+    """
+    批量数据点序列化器
+    
+    batch_id 为批次键，可用每个实验递增的批次序号或随机的幂等键；客户端超时重试时
+    使用相同的 batch_id，已写入的批次不会重复写入。保存时需传入已解析的实验：
+    serializer.save(experiment=experiment)。
+    """
+    experiment_id = serializers.IntegerField(required=False)
+    batch_id = serializers.CharField(max_length=64, required=False, allow_blank=False)
     data_points = serializers.ListField(
         child=serializers.DictField(),
         allow_empty=False
     )
     
     def validate_data_points(self, value):
-        """验证数据点格式"""
-        required_fields = ['timestamp', 'voltage', 'current']
-        for point in value:
-            for field in required_fields:
-                if field not in point:
-                    raise serializers.ValidationError(f"Missing required field: {field}")
-        return value
+        """验证数据点格式并转换为列数组"""
+        try:
+            return columns_from_points(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
     
     def create(self, validated_data):
-        experiment_id = validated_data['experiment_id']
-        data_points = validated_data['data_points']
-        
-        try:
-            experiment = Experiment.objects.get(id=experiment_id)
-        except Experiment.DoesNotExist:
-            raise serializers.ValidationError("Experiment not found")
-        
-        # 批量创建数据点
-        data_point_objects = []
-        for point_data in data_points:
-            data_point_objects.append(ExperimentDataPoint(
-                experiment=experiment,
-                timestamp=point_data['timestamp'],
-                voltage=point_data['voltage'],
-                current=point_data['current'],
-                cycle=point_data.get('cycle', 1),
-                temperature=point_data.get('temperature'),
-                ph=point_data.get('ph')
-            ))
+        experiment = validated_data['experiment']
+        if validated_data.get('experiment_id', experiment.pk) != experiment.pk:
+            raise serializers.ValidationError({'experiment_id': ["Does not match the experiment in the URL"]})
         
-        ExperimentDataPoint.objects.bulk_create(data_point_objects)
-        return {'created_count': len(data_point_objects)}
+        # 按列追加到实验曲线，相同批次键的重试不重复写入
+        created_count, duplicate = experiment.trace.append_batch(
+            validated_data['data_points'], validated_data.get('batch_id')
+        )
+        return {'created_count': created_count, 'duplicate': duplicate}
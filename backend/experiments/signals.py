@@ -0,0 +1,50 @@
+"""
+缓存失效
+
+模型保存或删除时更新相关缓存命名空间的版本号（见 electrochemical.caching）：
+
+- 实验模板：templates，模板列表包含其他用户的公开模板，整体失效；
+- 实验：该实验的 experiment:<id>（已完成实验的统计摘要和分段索引）和所属用户的
+  results:<用户id>（实验结果中包含实验名称）；
+- 实验结果：所属用户的 results:<用户id>。
+
+写入和清空数据点不经过模型保存，由 TraceStore 调用 invalidate_experiment。
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from electrochemical.caching import invalidate
+
+from .models import Experiment, ExperimentResult, ExperimentTemplate
+
+TEMPLATES_NAMESPACE = 'templates'
+
+
+def experiment_namespace(pk):
+    return f'experiment:{pk}'
+
+
+def results_namespace(user_id):
+    return f'results:{user_id}'
+
+
+def invalidate_experiment(experiment):
+    invalidate(experiment_namespace(experiment.pk))
+
+
+@receiver([post_save, post_delete], sender=ExperimentTemplate)
+def invalidate_templates(sender, **kwargs):
+    invalidate(TEMPLATES_NAMESPACE)
+
+
+@receiver([post_save, post_delete], sender=Experiment)
+def invalidate_experiment_caches(sender, instance, **kwargs):
+    invalidate(experiment_namespace(instance.pk), results_namespace(instance.user_id))
+
+
+@receiver([post_save, post_delete], sender=ExperimentResult)
+def invalidate_results(sender, instance, **kwargs):
+    # 随实验级联删除时实验可能已不存在，此时由实验的删除信号处理
+    user_id = Experiment.objects.filter(pk=instance.experiment_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        invalidate(results_namespace(user_id))
@@ -0,0 +1,483 @@
+"""
+实验曲线的列式分块存储
+
+每个实验的数据点按到达顺序保存为若干 ExperimentTraceChunk 行，每行以小端序
+定长数组保存一段连续数据点的各列。写入时每批数据追加为新分块，实验结束后
+compact() 将小分块合并为定长分块；读取时只取所需的列。
+
+每个分块记录循环、时间和电压的范围。按范围查询时（TraceStore.where）先用分块范围
+跳过不相关的分块，再在分块内逐点筛选；分块始终按 (experiment, start_offset) 索引顺序读取，
+无需排序。
+
+写入时同时增量更新循环与扫描方向的分段索引（见 experiments.segments）；按扫描方向筛选
+（sweep）时只读取索引中对应各段所在的区间。
+
+写入和清空数据点时递增实验的 data_version 并更新 updated_at，用于分析结果缓存和条件请求，
+同时使该实验的接口缓存失效（见 experiments.signals）。
+
+带批次键写入（TraceStore.append_batch）时，同一实验中批次键相同的重复请求只写入一次，
+用于客户端超时重试；批次的检查和写入在锁定实验行的同一事务中完成。
+"""
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from electrochemical import metrics
+
+from . import segments
+from .models import Experiment, ExperimentDataBatch, ExperimentTraceChunk
+from .signals import invalidate_experiment
+from .summary import merge, summarize
+
+# 列名 -> (分块模型字段, 存储类型)
+TRACE_COLUMNS = OrderedDict([
+    ('timestamp', ('timestamps', '<i8')),
+    ('voltage', ('voltages', '<f8')),
+    ('current', ('currents', '<f8')),
+    ('cycle', ('cycles', '<i4')),
+    ('temperature', ('temperatures', '<f8')),
+    ('ph', ('phs', '<f8')),
+])
+REQUIRED_COLUMNS = ('timestamp', 'voltage', 'current')
+OPTIONAL_COLUMNS = ('temperature', 'ph')
+
+DEFAULT_CHUNK_SIZE = 4096
+# 单条 INSERT 语句中分块数据的字节数上限，低于 MySQL 5.7 默认的 max_allowed_packet (4MB)
+DEFAULT_INSERT_BYTES = 1024 * 1024
+
+# 范围筛选条件 -> 所需的列
+RANGE_FILTERS = {
+    'cycle': 'cycle',
+    'time_min': 'timestamp',
+    'time_max': 'timestamp',
+    'v_min': 'voltage',
+    'v_max': 'voltage',
+}
+# 由分段索引确定读取区间的筛选条件
+SEGMENT_FILTERS = ('sweep',)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def get_chunk_size():
+    return getattr(settings, 'EXPERIMENT_TRACE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def get_insert_batch_size(chunk_size):
+    """每条 INSERT 语句写入的分块数"""
+    point_bytes = sum(np.dtype(dtype).itemsize for field, dtype in TRACE_COLUMNS.values())
+    max_bytes = getattr(settings, 'EXPERIMENT_TRACE_INSERT_BYTES', DEFAULT_INSERT_BYTES)
+    return max(max_bytes // (chunk_size * point_bytes), 1)
+
+
+class BatchConflict(ValueError):
+    """批次键已用于内容不同的批次"""
+
+
+def to_epoch_us(value):
+    """将时间戳（ISO字符串、datetime或Unix秒）转换为Unix微秒"""
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid timestamp: {value}")
+        value = parsed
+    if isinstance(value, datetime):
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return (value - EPOCH) // timedelta(microseconds=1)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(round(value * 1e6))
+    raise ValueError(f"Invalid timestamp: {value}")
+
+
+def timestamps_to_iso(timestamps):
+    """将Unix微秒数组转换为ISO 8601字符串列表（UTC）"""
+    return np.datetime_as_string(
+        np.asarray(timestamps, dtype='<i8').astype('datetime64[us]'), timezone='UTC'
+    ).tolist()
+
+
+def empty_columns(columns=None):
+    return {name: np.empty(0, dtype=TRACE_COLUMNS[name][1]) for name in (columns or TRACE_COLUMNS)}
+
+
+def normalize_columns(columns):
+    """校验列数组并转换为存储类型，返回 (列字典, 点数)"""
+    for name in REQUIRED_COLUMNS:
+        if columns.get(name) is None:
+            raise ValueError(f"Missing required field: {name}")
+
+    length = len(columns['timestamp'])
+    normalized = {}
+    for name, (field, dtype) in TRACE_COLUMNS.items():
+        values = columns.get(name)
+        if values is None:
+            normalized[name] = np.full(length, 1 if name == 'cycle' else np.nan, dtype=dtype)
+            continue
+        try:
+            array = np.asarray(values, dtype=dtype)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid values in field: {name}")
+        if array.ndim != 1 or len(array) != length:
+            raise ValueError(f"Field {name} must have {length} values")
+        normalized[name] = array
+
+    for name in ('voltage', 'current'):
+        if not np.isfinite(normalized[name]).all():
+            raise ValueError(f"Field {name} must contain finite numbers")
+    return normalized, length
+
+
+def columns_from_points(points):
+    """将逐点字典列表转换为列数组"""
+    try:
+        columns = {
+            'timestamp': [to_epoch_us(point['timestamp']) for point in points],
+            'voltage': [point['voltage'] for point in points],
+            'current': [point['current'] for point in points],
+            'cycle': [point.get('cycle', 1) for point in points],
+        }
+        for name in OPTIONAL_COLUMNS:
+            columns[name] = [
+                np.nan if point.get(name) is None else point[name] for point in points
+            ]
+    except KeyError as e:
+        raise ValueError(f"Missing required field: {e.args[0]}")
+    return normalize_columns(columns)[0]
+
+
+def columns_digest(columns):
+    """规范化列数组的SHA-256摘要，用于判断重试的批次与已写入批次的内容是否一致"""
+    digest = hashlib.sha256()
+    for name in TRACE_COLUMNS:
+        digest.update(np.ascontiguousarray(columns[name]).tobytes())
+    return digest.hexdigest()
+
+
+def column_values(name, array):
+    """将列数组转换为可序列化的值列表：时间戳为ISO字符串，缺失值为None"""
+    if name == 'timestamp':
+        return timestamps_to_iso(array)
+    if name in OPTIONAL_COLUMNS:
+        return [None if value != value else value for value in array.tolist()]
+    return array.tolist()
+
+
+def columns_to_points(columns, offset=0, indexes=None):
+    """将列数组转换为逐点字典列表，用于JSON输出；indexes 为各点在曲线中的位置，缺省时从 offset 连续编号"""
+    names = list(columns)
+    values = [column_values(name, columns[name]) for name in names]
+
+    length = len(values[0]) if values else 0
+    indexes = range(offset, offset + length) if indexes is None else indexes.tolist()
+    names = ['index'] + names
+    return [dict(zip(names, row)) for row in zip(indexes, *values)]
+
+
+def overlapping_chunks(chunks, cycle=None, time_min=None, time_max=None, v_min=None, v_max=None):
+    """按分块范围筛选可能包含满足条件数据点的分块"""
+    if cycle is not None:
+        chunks = chunks.filter(cycle_min__lte=cycle, cycle_max__gte=cycle)
+    if time_min is not None:
+        chunks = chunks.filter(time_max__gte=time_min)
+    if time_max is not None:
+        chunks = chunks.filter(time_min__lte=time_max)
+    if v_min is not None:
+        chunks = chunks.filter(voltage_max__gte=v_min)
+    if v_max is not None:
+        chunks = chunks.filter(voltage_min__lte=v_max)
+    return chunks
+
+
+def range_mask(columns, cycle=None, time_min=None, time_max=None, v_min=None, v_max=None):
+    """返回满足范围条件的数据点掩码"""
+    mask = np.ones(len(next(iter(columns.values()))), dtype=bool)
+    if cycle is not None:
+        mask &= columns['cycle'] == cycle
+    if time_min is not None:
+        mask &= columns['timestamp'] >= time_min
+    if time_max is not None:
+        mask &= columns['timestamp'] <= time_max
+    if v_min is not None:
+        mask &= columns['voltage'] >= v_min
+    if v_max is not None:
+        mask &= columns['voltage'] <= v_max
+    return mask
+
+
+def _decode(blob, name):
+    return np.frombuffer(blob, dtype=TRACE_COLUMNS[name][1])
+
+
+def _build_chunk(experiment, start_offset, columns):
+    chunk = ExperimentTraceChunk(
+        experiment=experiment,
+        start_offset=start_offset,
+        point_count=len(columns['timestamp']),
+        cycle_min=int(columns['cycle'].min()),
+        cycle_max=int(columns['cycle'].max()),
+        time_min=int(columns['timestamp'].min()),
+        time_max=int(columns['timestamp'].max()),
+        voltage_min=float(columns['voltage'].min()),
+        voltage_max=float(columns['voltage'].max()),
+    )
+    for name, (field, dtype) in TRACE_COLUMNS.items():
+        setattr(chunk, field, np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+    return chunk
+
+
+class TraceStore:
+    """
+    单个实验的曲线存储
+
+    filters 为范围筛选条件（见 RANGE_FILTERS、SEGMENT_FILTERS），只作用于读取；写入始终针对完整曲线。
+    """
+
+    def __init__(self, experiment, chunk_size=None, filters=None):
+        self.experiment = experiment
+        self.chunk_size = chunk_size or get_chunk_size()
+        self.filters = {name: value for name, value in (filters or {}).items() if value is not None}
+
+    def where(self, **filters):
+        """返回附加范围筛选条件的存储视图"""
+        return TraceStore(self.experiment, self.chunk_size, {**self.filters, **filters})
+
+    @property
+    def chunks(self):
+        return ExperimentTraceChunk.objects.filter(experiment=self.experiment)
+
+    @property
+    def range_filters(self):
+        """逐点筛选的范围条件，不含分段索引的筛选条件"""
+        return {name: value for name, value in self.filters.items() if name not in SEGMENT_FILTERS}
+
+    def count(self):
+        """数据点总数，有筛选条件时为满足条件的点数"""
+        if self.filters:
+            return sum(len(indexes) for indexes, columns in self.select([]))
+        return self.chunks.aggregate(total=Sum('point_count'))['total'] or 0
+
+    def _lock(self):
+        """锁定实验行，串行化同一实验的并发写入，返回 (当前统计摘要, 数据版本, 分段索引状态)"""
+        return Experiment.objects.select_for_update().filter(
+            pk=self.experiment.pk
+        ).values_list('trace_summary', 'data_version', 'trace_segments').get()
+
+    def end_offset(self):
+        """曲线末尾位置，即不考虑筛选条件时的数据点总数"""
+        last = self.chunks.order_by('-start_offset').values_list('start_offset', 'point_count').first()
+        return sum(last) if last else 0
+
+    def append(self, columns):
+        """追加数据点并更新统计摘要，返回写入数量"""
+        return self.append_batch(columns)[0]
+
+    def append_batch(self, columns, key=None):
+        """
+        追加一批数据点，返回 (数据点数量, 是否为重复批次)
+
+        key 为批次键（客户端的批次序号或幂等键）。同一实验中已写入过相同批次键时不再写入，
+        直接返回该批次的数量；相同批次键对应的数据不同时抛出 BatchConflict。
+        """
+        columns, length = normalize_columns(columns)
+        if not length:
+            return 0, False
+
+        digest = columns_digest(columns) if key else None
+        batch_summary = summarize(columns)
+        with transaction.atomic():
+            summary, version, index = self._lock()
+            if key:
+                existing = ExperimentDataBatch.objects.filter(
+                    experiment=self.experiment, key=key
+                ).values_list('digest', 'point_count').first()
+                if existing is not None:
+                    if existing[0] != digest:
+                        raise BatchConflict(f"Batch {key} was already written with different data points")
+                    metrics.record_ingest(existing[1], duplicate=True)
+                    return existing[1], True
+
+            summary = merge(summary or {}, batch_summary)
+            offset = self.end_offset()
+            index = self._extend_segments(index, offset, columns)
+            new_chunks = [
+                _build_chunk(
+                    self.experiment, offset + start,
+                    {name: values[start:start + self.chunk_size] for name, values in columns.items()}
+                )
+                for start in range(0, length, self.chunk_size)
+            ]
+            ExperimentTraceChunk.objects.bulk_create(new_chunks, batch_size=get_insert_batch_size(self.chunk_size))
+            now = timezone.now()
+            if key:
+                ExperimentDataBatch.objects.create(
+                    experiment=self.experiment, key=key, digest=digest, start_offset=offset, point_count=length
+                )
+            Experiment.objects.filter(pk=self.experiment.pk).update(
+                trace_summary=summary, data_points_count=summary['count'], data_version=version + 1,
+                trace_segments=index, updated_at=now,
+            )
+        self.experiment.trace_summary = summary
+        self.experiment.data_points_count = summary['count']
+        self.experiment.data_version = version + 1
+        self.experiment.trace_segments = index
+        self.experiment.updated_at = now
+        invalidate_experiment(self.experiment)
+        metrics.record_ingest(length)
+        return length, False
+
+    def _extend_segments(self, index, offset, columns):
+        """将新写入的数据点加入分段索引；索引未覆盖已有数据时（如升级前写入的实验）先重建"""
+        if (index or {}).get('length', 0) != offset:
+            index = self.build_segments()
+        return segments.extend(index, columns['voltage'], columns['cycle'])
+
+    def build_segments(self):
+        """按分块读取电压和循环列，重新建立分段索引状态"""
+        return segments.build(arrays for offset, arrays in TraceStore(self.experiment, self.chunk_size).iter_chunks(
+            ['voltage', 'cycle']
+        ))
+
+    def segment_index(self):
+        """当前的分段列表（见 experiments.segments.segment_index）"""
+        return segments.segment_index(self.experiment.trace_segments)
+
+    def compact(self):
+        """将逐批写入的小分块合并为定长分块，内存占用不超过两个分块"""
+        with transaction.atomic():
+            self._lock()
+            first_partial = self.chunks.filter(
+                point_count__lt=self.chunk_size
+            ).order_by('start_offset').values_list('start_offset', flat=True).first()
+            last_start = self.chunks.order_by('-start_offset').values_list('start_offset', flat=True).first()
+            # 只有末尾分块未满时无需合并
+            if first_partial is None or first_partial == last_start:
+                return
+
+            position = first_partial
+            buffer_start = first_partial
+            buffer = empty_columns()
+            while True:
+                chunk = self.chunks.filter(start_offset=position).first()
+                if chunk is not None:
+                    for name, (field, dtype) in TRACE_COLUMNS.items():
+                        buffer[name] = np.concatenate([buffer[name], _decode(getattr(chunk, field), name)])
+                    position += chunk.point_count
+                    chunk.delete()
+
+                while len(buffer['timestamp']) >= self.chunk_size or (
+                    chunk is None and len(buffer['timestamp'])
+                ):
+                    head = {name: values[:self.chunk_size] for name, values in buffer.items()}
+                    _build_chunk(self.experiment, buffer_start, head).save()
+                    buffer_start += len(head['timestamp'])
+                    buffer = {name: values[self.chunk_size:] for name, values in buffer.items()}
+
+                if chunk is None:
+                    break
+
+    def chunk_query(self, columns=None, start=0, stop=None):
+        """按起始位置顺序读取区间 [start, stop) 所在分块的查询，行为 (起始位置, 点数, 各列数据)"""
+        names = list(TRACE_COLUMNS if columns is None else columns)
+        queryset = overlapping_chunks(self.chunks, **self.range_filters).order_by('start_offset')
+        if start:
+            first = self.chunks.filter(start_offset__lte=start).order_by(
+                '-start_offset'
+            ).values_list('start_offset', flat=True).first()
+            queryset = queryset.filter(start_offset__gte=first or 0)
+        if stop is not None:
+            queryset = queryset.filter(start_offset__lt=stop)
+        return queryset.values_list('start_offset', 'point_count', *(TRACE_COLUMNS[name][0] for name in names))
+
+    def iter_chunks(self, columns=None, start=0, stop=None):
+        """
+        按分块迭代数据点区间 [start, stop)，产出 (起始位置, 列数组字典)
+
+        筛选条件只用于跳过不相关的分块，分块内的数据点不做筛选（见 select）。
+        """
+        names = list(TRACE_COLUMNS if columns is None else columns)
+        rows = self.chunk_query(names, start, stop)
+        for chunk_start, count, *blobs in rows.iterator(chunk_size=16):
+            low = max(start - chunk_start, 0)
+            high = count if stop is None else min(stop - chunk_start, count)
+            if low >= high:
+                continue
+            yield chunk_start + low, {
+                name: _decode(blob, name)[low:high] for name, blob in zip(names, blobs)
+            }
+
+    def ranges(self, start=0, stop=None):
+        """需要读取的区间列表；按扫描方向筛选时为分段索引中满足条件的各段与 [start, stop) 的交集"""
+        if self.filters.get('sweep') is None:
+            return [(start, stop)]
+        ranges = []
+        for low, high in segments.sweep_ranges(self.segment_index(), self.filters['sweep'], self.filters.get('cycle')):
+            low, high = max(low, start), high if stop is None else min(high, stop)
+            if low < high:
+                ranges.append((low, high))
+        return ranges
+
+    def select(self, columns=None, start=0, stop=None):
+        """按分块迭代区间 [start, stop) 内满足筛选条件的数据点，产出 (位置数组, 列数组字典)"""
+        names = list(TRACE_COLUMNS if columns is None else columns)
+        filters = self.range_filters
+        # 筛选所需的列；不读取任何列时至少读取最小的 cycle 列以确定点数
+        needed = names + [
+            name for name in dict.fromkeys(RANGE_FILTERS[key] for key in filters) if name not in names
+        ] or ['cycle']
+
+        for low, high in self.ranges(start, stop):
+            for offset, arrays in self.iter_chunks(needed, low, high):
+                indexes = np.arange(offset, offset + len(arrays[needed[0]]))
+                if filters:
+                    mask = range_mask(arrays, **filters)
+                    if not mask.any():
+                        continue
+                    if not mask.all():
+                        indexes = indexes[mask]
+                        arrays = {name: values[mask] for name, values in arrays.items()}
+                yield indexes, {name: arrays[name] for name in names}
+
+    def read(self, columns=None, start=0, stop=None):
+        """读取数据点区间 [start, stop) 内满足筛选条件的列数组"""
+        parts = [arrays for indexes, arrays in self.select(columns, start, stop)]
+        if not parts:
+            return empty_columns(columns)
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    def points(self, start=0, stop=None, columns=None, limit=None):
+        """读取区间 [start, stop) 内满足筛选条件的逐点字典，最多 limit 个"""
+        points = []
+        for indexes, arrays in self.select(columns, start, stop):
+            if limit is not None:
+                remaining = limit - len(points)
+                indexes = indexes[:remaining]
+                arrays = {name: values[:remaining] for name, values in arrays.items()}
+            points.extend(columns_to_points(arrays, indexes=indexes))
+            if limit is not None and len(points) >= limit:
+                break
+        return points
+
+    def clear(self):
+        """删除全部数据点及已写入批次的记录"""
+        with transaction.atomic():
+            summary, version, index = self._lock()
+            self.chunks.delete()
+            ExperimentDataBatch.objects.filter(experiment=self.experiment).delete()
+            now = timezone.now()
+            Experiment.objects.filter(pk=self.experiment.pk).update(
+                trace_summary={}, data_points_count=0, data_version=version + 1, trace_segments={}, updated_at=now
+            )
+        self.experiment.updated_at = now
+        invalidate_experiment(self.experiment)
+        self.experiment.trace_summary = {}
+        self.experiment.data_points_count = 0
+        self.experiment.data_version = version + 1
+        self.experiment.trace_segments = {}
+
@@ -0,0 +1,128 @@
+"""
+实验数据的增量统计摘要
+
+每批写入的数据点先汇总为摘要，再与已有摘要合并（按Chan等人的并行方差公式合并均值和
+二阶矩），因此任意时刻都能以常数时间得到计数、极值、均值、方差、峰值电位及各循环的
+统计量，实验结束时无需重新读取数据点。摘要为可直接存入 JSONField 的字典。
+"""
+import math
+
+import numpy as np
+
+
+def _series(values):
+    mean = float(values.mean())
+    return {
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': mean,
+        'm2': float(((values - mean) ** 2).sum()),
+    }
+
+
+def _merge_series(a, b, count_a, count_b):
+    count = count_a + count_b
+    delta = b['mean'] - a['mean']
+    return {
+        'min': min(a['min'], b['min']),
+        'max': max(a['max'], b['max']),
+        'mean': a['mean'] + delta * count_b / count,
+        'm2': a['m2'] + b['m2'] + delta * delta * count_a * count_b / count,
+    }
+
+
+def _summarize(timestamps, voltages, currents):
+    peak = int(currents.argmax())
+    valley = int(currents.argmin())
+    return {
+        'count': len(currents),
+        'time_range': [int(timestamps.min()), int(timestamps.max())],
+        'voltage': _series(voltages),
+        'current': _series(currents),
+        'peak_voltage': float(voltages[peak]),
+        'valley_voltage': float(voltages[valley]),
+    }
+
+
+def _merge(a, b):
+    if not a.get('count'):
+        return b
+    if not b.get('count'):
+        return a
+    return {
+        'count': a['count'] + b['count'],
+        'time_range': [min(a['time_range'][0], b['time_range'][0]), max(a['time_range'][1], b['time_range'][1])],
+        'voltage': _merge_series(a['voltage'], b['voltage'], a['count'], b['count']),
+        'current': _merge_series(a['current'], b['current'], a['count'], b['count']),
+        'peak_voltage': b['peak_voltage'] if b['current']['max'] > a['current']['max'] else a['peak_voltage'],
+        'valley_voltage': b['valley_voltage'] if b['current']['min'] < a['current']['min'] else a['valley_voltage'],
+    }
+
+
+def summarize(columns):
+    """汇总一批数据点，包含各循环的摘要"""
+    if not len(columns['current']):
+        return {}
+
+    summary = _summarize(columns['timestamp'], columns['voltage'], columns['current'])
+    summary['cycles'] = {}
+    cycles = columns['cycle']
+    for cycle in np.unique(cycles).tolist():
+        mask = cycles == cycle
+        summary['cycles'][str(cycle)] = _summarize(
+            columns['timestamp'][mask], columns['voltage'][mask], columns['current'][mask]
+        )
+    return summary
+
+
+def merge(a, b):
+    """合并两个摘要"""
+    merged = _merge(a, b)
+    if a.get('count') and b.get('count'):
+        cycles = dict(a['cycles'])
+        for cycle, summary in b['cycles'].items():
+            cycles[cycle] = _merge(cycles.get(cycle, {}), summary)
+        merged['cycles'] = cycles
+    return merged
+
+
+def _series_report(series, count):
+    variance = series['m2'] / count
+    return {
+        'min': series['min'],
+        'max': series['max'],
+        'mean': series['mean'],
+        'variance': variance,
+        'std': math.sqrt(variance),
+    }
+
+
+def _report(summary):
+    start, end = np.datetime_as_string(
+        np.array(summary['time_range'], dtype='datetime64[us]'), timezone='UTC'
+    ).tolist()
+    return {
+        'count': summary['count'],
+        'start_time': start,
+        'end_time': end,
+        'voltage': _series_report(summary['voltage'], summary['count']),
+        'current': _series_report(summary['current'], summary['count']),
+        'voltage_range': [summary['voltage']['min'], summary['voltage']['max']],
+        'peak_current': summary['current']['max'],
+        'peak_voltage': summary['peak_voltage'],
+        'valley_current': summary['current']['min'],
+        'valley_voltage': summary['valley_voltage'],
+    }
+
+
+def report(summary):
+    """将摘要转换为对外输出的统计量"""
+    if not summary.get('count'):
+        return {'count': 0}
+
+    result = _report(summary)
+    result['cycles'] = {
+        cycle: _report(summary['cycles'][cycle])
+        for cycle in sorted(summary['cycles'], key=int)
+    }
+    return result
@@ -0,0 +1,110 @@
+"""
+合成伏安曲线
+
+按实验类型生成带噪声的模拟曲线，用于性能基准和演示数据。电流由电容电流和一对可逆
+氧化还原峰组成，峰形为近似形状（不求解扩散方程），但峰电位、峰宽随扫描方向和技术的变化
+与实际曲线一致：
+
+- CV：三角波扫描，正扫出现阳极峰、反扫出现阴极峰，可有多个循环；
+- LSV：单向线性扫描，峰后电流按扩散控制衰减；
+- SWV、DPV：阶梯电位，电流为差分电流，峰形为 sech²。
+
+返回的列数组可直接写入 TraceStore。
+"""
+import numpy as np
+
+# F/RT (1/V)，25 °C
+F_RT = 96485.332 / (8.314462 * 298.15)
+EPOCH_US = 1704067200_000000
+
+TECHNIQUES = ('CV', 'LSV', 'SWV', 'DPV')
+DEFAULTS = {
+    'start_voltage': -0.2,
+    'end_voltage': 0.6,
+    'scan_rate': 50.0,
+    'formal_potential': 0.2,
+    'peak_current': 1e-5,
+    'capacitance': 2e-5,
+    'noise': 2e-8,
+}
+# SWV/DPV 的阶梯高度和脉冲幅度 (V)
+STEP_HEIGHT = 0.004
+PULSE_AMPLITUDE = {'SWV': 0.025, 'DPV': 0.05}
+
+
+def _peak(voltage, potential, direction):
+    """
+    线性扫描中的法拉第电流形状，在峰电位 potential 处取最大值 1
+
+    峰前为 Nernst 方程给出的 S 形上升，峰后按 t^-1/2 衰减；direction 为 1 时随电位升高
+    出现峰，为 -1 时随电位降低出现峰。
+    """
+    xi = direction * F_RT * (voltage - potential) + 1.1
+    rise = 1.0 / (1.0 + np.exp(-np.clip(xi, -50, 50)))
+    decay = 1.0 / np.sqrt(1.0 + np.maximum(xi - 1.1, 0.0) / 1.1)
+    return rise * decay / 0.75
+
+
+def _triangle(points, start, end, cycles):
+    """CV 的三角波电位和循环号"""
+    per_cycle = -(-points // cycles)
+    phase = (np.arange(points) % per_cycle) / per_cycle
+    voltage = start + (end - start) * (1.0 - np.abs(2.0 * phase - 1.0))
+    cycle = (np.arange(points) // per_cycle + 1).astype('<i4')
+    return voltage, cycle, phase < 0.5
+
+
+def voltammogram(technique='CV', points=10000, cycles=None, seed=0, **options):
+    """
+    生成一条合成曲线，返回列数组字典（timestamp、voltage、current、cycle）
+
+    options 可覆盖 DEFAULTS 中的参数；scan_rate 单位为 mV/s，用于计算采样时间间隔。
+    """
+    if technique not in TECHNIQUES:
+        raise ValueError(f"Unknown technique: {technique}")
+    if points < 2:
+        raise ValueError("points must be at least 2")
+    params = dict(DEFAULTS, **options)
+    rng = np.random.default_rng(seed)
+    start, end = params['start_voltage'], params['end_voltage']
+    span = abs(end - start)
+    scan_rate = params['scan_rate'] / 1000
+    ip = params['peak_current']
+    e0 = params['formal_potential']
+
+    if technique == 'CV':
+        cycles = cycles or 3
+        voltage, cycle, forward = _triangle(points, start, end, cycles)
+        duration = cycles * 2 * span / scan_rate
+        # 氧化峰在 E0 + 28.5 mV、还原峰在 E0 - 28.5 mV（可逆单电子反应），反扫时电容电流反向
+        current = np.where(
+            forward,
+            ip * _peak(voltage, e0 + 0.0285, 1) + params['capacitance'] * scan_rate,
+            -0.8 * ip * _peak(voltage, e0 - 0.0285, -1) - params['capacitance'] * scan_rate,
+        )
+    elif technique == 'LSV':
+        cycle = np.ones(points, dtype='<i4')
+        voltage = np.linspace(start, end, points)
+        duration = span / scan_rate
+        current = ip * _peak(voltage, e0 + 0.0285, 1 if end >= start else -1)
+        current += params['capacitance'] * scan_rate
+    else:
+        cycle = np.ones(points, dtype='<i4')
+        steps = max(int(round(span / STEP_HEIGHT)), 1)
+        step = np.minimum(np.arange(points) * steps // points, steps - 1)
+        voltage = start + np.sign(end - start) * STEP_HEIGHT * step
+        duration = steps * STEP_HEIGHT / scan_rate
+        amplitude = PULSE_AMPLITUDE[technique]
+        # 差分电流峰在 E0 - ΔE/2（DPV）或 E0（SWV），峰宽随脉冲幅度增大
+        center = e0 - amplitude / 2 if technique == 'DPV' else e0
+        width = 2.0 / F_RT + amplitude / 2
+        current = ip * np.cosh((voltage - center) / width) ** -2
+
+    current = current + rng.normal(0.0, params['noise'], points)
+    timestamps = EPOCH_US + np.round(np.arange(points) * (duration * 1e6 / points)).astype('<i8')
+    return {
+        'timestamp': timestamps,
+        'voltage': np.asarray(voltage, dtype='<f8'),
+        'current': np.asarray(current, dtype='<f8'),
+        'cycle': np.asarray(cycle, dtype='<i4'),
+    }
@@ -0,0 +1,272 @@
+import io
+import json
+from unittest import mock
+
+import numpy as np
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import pyramid
+from .models import Experiment, ExperimentResult, ExperimentTraceChunk, ExperimentTraceLevel
+from .fields import MAGIC
+from .routing import websocket_urlpatterns
+from .storage import TRACE_COLUMNS, TraceStore
+
+
+def trace_columns(n, start=0):
+    """合成的曲线列数组，位置 start 起的 n 个点"""
+    index = np.arange(start, start + n)
+    return {
+        'timestamp': (1704067200_000000 + index * 1000).astype('<i8'),
+        'voltage': np.sin(index / 50.0),
+        'current': np.cos(index / 30.0) * 1e-6,
+        'cycle': (1 + index // 500).astype('<i4'),
+    }
+
+
+class ExperimentTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('experimenter', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_experiment(self, **fields):
+        fields = {'experiment_type': 'CV', 'start_voltage': -1, 'end_voltage': 1, 'scan_rate': 50,
+                  'status': 'running', **fields}
+        return Experiment.objects.create(user=self.user, **fields)
+
+
+@override_settings(ANALYSIS_JOB_BACKEND='sync', EXPERIMENT_TRACE_CHUNK_SIZE=1000)
+class StopExperimentTests(ExperimentTestCase):
+    """stop 只保存状态，分块合并、降采样层级和实验结果在提交后由任务执行后端完成"""
+
+    def test_stop_queues_finalization(self):
+        experiment = self.create_experiment()
+        for start in range(0, 1200, 300):
+            TraceStore(experiment).append(trace_columns(300, start))
+        url = f'/api/experiments/experiments/{experiment.pk}/stop/'
+
+        with self.captureOnCommitCallbacks() as callbacks, \
+                mock.patch('experiments.views.build_pyramid') as build_pyramid:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        build_pyramid.assert_not_called()
+        self.assertFalse(ExperimentResult.objects.filter(experiment=experiment).exists())
+
+        for callback in callbacks:
+            callback()
+        experiment.refresh_from_db()
+        self.assertEqual(experiment.status, 'completed')
+        chunks = ExperimentTraceChunk.objects.filter(experiment=experiment).order_by('start_offset')
+        self.assertEqual(list(chunks.values_list('point_count', flat=True)), [1000, 200])
+        self.assertTrue(ExperimentTraceLevel.objects.filter(experiment=experiment).exists())
+        self.assertEqual(experiment.result.analysis_data['total_points'], 1200)
+
+
+# 每个数据点在分块中占用的字节数
+POINT_BYTES = sum(np.dtype(dtype).itemsize for field, dtype in TRACE_COLUMNS.values())
+
+
+@override_settings(EXPERIMENT_TRACE_CHUNK_SIZE=100, EXPERIMENT_TRACE_INSERT_BYTES=2 * 100 * POINT_BYTES)
+class AppendBatchTests(ExperimentTestCase):
+    """按批次键幂等写入：重复批次不再写入，内容不同时返回 409；跨多条 INSERT 时分块边界正确"""
+
+    content_type = 'application/x-trace-columns; columns=timestamp,voltage,current,cycle'
+
+    def setUp(self):
+        super().setUp()
+        self.experiment = self.create_experiment()
+
+    def post_batch(self, columns, key):
+        body = b''.join(columns[name].tobytes() for name in ('timestamp', 'voltage', 'current', 'cycle'))
+        return self.client.post(
+            f'/api/experiments/experiments/{self.experiment.pk}/add_data_points/', body,
+            content_type=self.content_type, HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_duplicate_batch_is_not_written_again(self):
+        columns = trace_columns(150)
+        response = self.post_batch(columns, 'batch-1')
+        self.assertEqual(response.json(), {'message': 'Added 150 data points', 'created_count': 150, 'duplicate': False})
+        self.experiment.refresh_from_db()
+        version = self.experiment.data_version
+
+        response = self.post_batch(columns, 'batch-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created_count'], 150)
+        self.assertTrue(response.json()['duplicate'])
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.data_version, version)
+        self.assertEqual(self.experiment.trace.count(), 150)
+
+    def test_batch_key_with_different_data_conflicts(self):
+        self.post_batch(trace_columns(150), 'batch-1')
+        response = self.post_batch(trace_columns(150, start=150), 'batch-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('batch_id', response.json())
+        self.assertEqual(self.experiment.trace.count(), 150)
+
+    def test_chunk_boundaries_across_insert_statements(self):
+        # 每条 INSERT 最多写入两个分块
+        batches = [trace_columns(250), trace_columns(230, start=250)]
+        for number, columns in enumerate(batches):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_batch(columns, f'batch-{number}')
+            self.assertEqual(response.status_code, 200)
+            inserts = [
+                query for query in queries
+                if query['sql'].startswith('INSERT INTO "experiments_experimenttracechunk"')
+            ]
+            self.assertEqual(len(inserts), 2)
+
+        chunks = ExperimentTraceChunk.objects.filter(experiment=self.experiment).order_by('start_offset')
+        self.assertEqual(
+            list(chunks.values_list('start_offset', 'point_count')),
+            [(0, 100), (100, 100), (200, 50), (250, 100), (350, 100), (450, 30)],
+        )
+        stored = self.experiment.trace.read(['timestamp', 'voltage'])
+        for name in ('timestamp', 'voltage'):
+            np.testing.assert_array_equal(stored[name], np.concatenate([columns[name] for columns in batches]))
+
+
+@override_settings(EXPERIMENT_TRACE_CHUNK_SIZE=1000)
+class DownsampleTests(ExperimentTestCase):
+    """尚无降采样层级时逐块降采样原始曲线，不将整条曲线读入内存"""
+
+    def test_completed_experiment_without_levels(self):
+        experiment = self.create_experiment(status='completed')
+        columns = trace_columns(6000)
+        experiment.trace.append(columns)
+        self.assertFalse(ExperimentTraceLevel.objects.filter(experiment=experiment).exists())
+
+        with mock.patch.object(pyramid, 'downsample_columns', wraps=pyramid.downsample_columns) as reduce:
+            level, result = pyramid.downsample(experiment.trace, 100)
+        self.assertEqual(level, 0)
+        self.assertLessEqual(len(reduce.call_args.args[0]['index']), 200)
+        self.assertLessEqual(len(result['index']), 100)
+        # 保留峰形：全局最大、最小电流点都在结果中
+        for position in (columns['current'].argmax(), columns['current'].argmin()):
+            self.assertIn(position, result['index'])
+
+        level, result = pyramid.downsample(experiment.trace, 100, cycle=3)
+        self.assertTrue(np.all(result['cycle'] == 3))
+        self.assertLessEqual(len(result['index']), 100)
+
+
+class LegacyJSONFieldTests(ExperimentTestCase):
+    """由 JSONField 改为 PackedJSONField 后，未转换的 JSON 值照常读取，pack_json_fields 重新编码"""
+
+    def test_legacy_json_is_read_and_repacked(self):
+        data = {'curve': [index * 0.5 for index in range(100)], 'peaks': [{'voltage': 0.25}]}
+        result = ExperimentResult.objects.create(experiment=self.create_experiment(), chart_data={'x': 1})
+        table = connection.ops.quote_name(ExperimentResult._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {table} SET analysis_data = %s WHERE id = %s', [json.dumps(data), result.pk])
+
+        self.assertEqual(ExperimentResult.objects.get(pk=result.pk).analysis_data, data)
+
+        call_command('pack_json_fields', stdout=io.StringIO())
+        raw = ExperimentResult.objects.values_list('analysis_data', 'chart_data').get(pk=result.pk)
+        self.assertTrue(all(value.is_packed and value.data.startswith(MAGIC) for value in raw))
+        result = ExperimentResult.objects.get(pk=result.pk)
+        self.assertEqual(result.analysis_data, data)
+        self.assertEqual(result.chart_data, {'x': 1})
+
+
+class ExperimentListTests(ExperimentTestCase):
+    """实验列表的查询数与实验数无关，?include=data_points 不会为每个实验读取数据点"""
+
+    def test_list_query_count(self):
+        for number in range(5):
+            experiment = self.create_experiment(name=f'实验{number}')
+            TraceStore(experiment).append(trace_columns(100))
+
+        for params in ({}, {'include': 'data_points'}):
+            # 分页计数和当前页各一次
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/experiments/experiments/', params)
+            self.assertEqual(response.status_code, 200)
+            results = response.json()['results']
+            self.assertEqual(len(results), 5)
+            self.assertEqual({row['data_points_count'] for row in results}, {100})
+            self.assertEqual({row['user_name'] for row in results}, {'experimenter'})
+            self.assertTrue(all('data_points' not in row for row in results))
+
+
+STREAM_COLUMNS = ['timestamp', 'voltage', 'current', 'cycle']
+
+
+@override_settings(EXPERIMENT_STREAM_FLUSH_POINTS=100, EXPERIMENT_STREAM_FLUSH_INTERVAL=60)
+class ExperimentStreamTests(TransactionTestCase):
+    """实时通道：转发给其他连接、累积到 EXPERIMENT_STREAM_FLUSH_POINTS 个点后写入、实验停止后拒绝"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('experimenter', password='password')
+        self.experiment = Experiment.objects.create(
+            user=self.user, experiment_type='CV', start_voltage=-1, end_voltage=1, scan_rate=50, status='running',
+        )
+
+    async def connect(self):
+        path = f'/ws/experiments/{self.experiment.pk}/stream/?columns=' + ','.join(STREAM_COLUMNS)
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def send_points(self, communicator, n, start=0):
+        """以二进制帧发送，列顺序与连接参数 columns 一致"""
+        columns = trace_columns(n, start)
+        await communicator.send_to(bytes_data=b''.join(columns[name].tobytes() for name in STREAM_COLUMNS))
+
+    async def trace_count(self):
+        return await database_sync_to_async(lambda: Experiment.objects.get(pk=self.experiment.pk).trace.count())()
+
+    async def test_points_are_forwarded_to_other_connections(self):
+        source, viewers = await self.connect(), [await self.connect(), await self.connect()]
+        await self.send_points(source, 30)
+        for viewer in viewers:
+            message = await viewer.receive_json_from()
+            self.assertEqual(message['type'], 'data_points')
+            self.assertEqual(len(message['columns']['voltage']), 30)
+        self.assertTrue(await source.receive_nothing())
+        for communicator in [source, *viewers]:
+            await communicator.disconnect()
+
+    async def test_points_are_stored_at_flush_points(self):
+        source = await self.connect()
+        await self.send_points(source, 60)
+        self.assertTrue(await source.receive_nothing())
+        self.assertEqual(await self.trace_count(), 0)
+
+        await self.send_points(source, 60, start=60)
+        self.assertEqual(await source.receive_json_from(), {'type': 'stored', 'created_count': 120})
+        self.assertEqual(await self.trace_count(), 120)
+
+        # 断开连接时写入剩余的点，不再向已关闭的连接发送结果
+        await self.send_points(source, 10, start=120)
+        with mock.patch('experiments.consumers.ExperimentStreamConsumer.send') as send:
+            await source.disconnect()
+        send.assert_not_called()
+        self.assertEqual(await self.trace_count(), 130)
+
+    @override_settings(EXPERIMENT_STREAM_FLUSH_INTERVAL=0)
+    async def test_points_are_rejected_after_stop(self):
+        source, viewer = await self.connect(), await self.connect()
+        await database_sync_to_async(Experiment.objects.filter(pk=self.experiment.pk).update)(status='completed')
+
+        await self.send_points(source, 30)
+        message = await source.receive_json_from()
+        self.assertEqual(message['type'], 'error')
+        self.assertIn('30 data points discarded', message['error'])
+        self.assertTrue(await viewer.receive_nothing())
+        self.assertEqual(await self.trace_count(), 0)
+        for communicator in (source, viewer):
+            await communicator.disconnect()
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'experiments', views.ExperimentViewSet, basename='experiment')
@@ -9,5 +9,12 @@ router.register(r'templates', views.ExperimentTemplateViewSet, basename='templat
 router.register(r'results', views.ExperimentResultViewSet, basename='result')
 
 urlpatterns = [
+    # 读取密集接口的 GET 请求由异步视图处理，其他请求方法仍由视图集处理；
+    # URL 名称与视图集的路由相同，请求指标按同一路由统计
+    path('experiments/', async_views.experiment_list, name='experiment-list'),
+    path('experiments/<int:pk>/data_points/', async_views.experiment_data_points, name='experiment-data-points'),
+    path('experiments/<int:pk>/export/', async_views.experiment_export, name='experiment-export'),
+    path('results/', async_views.result_list, name='result-list'),
+    path('results/<int:pk>/', async_views.result_detail, name='result-detail'),
     path('', include(router.urls)),
 ]
@@ -1,26 +1,175 @@
+from celery import shared_task
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
-from .models import Experiment, ExperimentDataPoint, Device, ExperimentTemplate, ExperimentResult
+from django.http import Http404, StreamingHttpResponse
+from analysis.executors import get_executor
+from electrochemical.caching import CachedReadMixin, Entry
+from .models import Experiment, Device, ExperimentTemplate, ExperimentResult
 from .serializers import (
     ExperimentSerializer, ExperimentListSerializer, ExperimentCreateSerializer,
     ExperimentUpdateSerializer, DeviceSerializer, ExperimentTemplateSerializer,
-    ExperimentResultSerializer, DataPointBatchSerializer, ExperimentDataPointSerializer
+    ExperimentResultSerializer, DataPointBatchSerializer
 )
+from . import exporters
+from .conditional import experiment_validators, not_modified, result_validators, set_validators
+from .parsers import TraceColumnsParser
+from .pyramid import build_pyramid, downsample
+from .storage import BatchConflict, columns_to_points, to_epoch_us
+from .segments import SWEEP_DIRECTIONS, report as segments_report
+from .signals import TEMPLATES_NAMESPACE, experiment_namespace, invalidate_experiment
+from .summary import report
 import json
 from datetime import datetime
 
 
+def range_filters(params):
+    """解析数据点范围筛选参数：cycle、sweep（forward/reverse）、start_time/end_time（ISO 8601）、v_min/v_max"""
+    sweep = params.get('sweep') or None
+    if sweep is not None and sweep not in SWEEP_DIRECTIONS:
+        raise ValidationError({'error': 'sweep must be "forward" or "reverse"'})
+    try:
+        return {
+            'sweep': sweep,
+            'cycle': int(params['cycle']) if params.get('cycle') else None,
+            'time_min': to_epoch_us(params['start_time']) if params.get('start_time') else None,
+            'time_max': to_epoch_us(params['end_time']) if params.get('end_time') else None,
+            'v_min': float(params['v_min']) if params.get('v_min') else None,
+            'v_max': float(params['v_max']) if params.get('v_max') else None,
+        }
+    except ValueError:
+        raise ValidationError({
+            'error': 'cycle must be an integer, start_time and end_time must be ISO 8601 timestamps, '
+                     'v_min and v_max must be numbers'
+        })
+
+
+def downsampled_points(experiment, params, filters):
+    """按点数上限返回保形降采样的数据点，可按循环和电压范围筛选"""
+    try:
+        max_points = int(params['max_points'])
+    except ValueError:
+        raise ValidationError({'error': 'max_points must be an integer'})
+    
+    if max_points < 2:
+        raise ValidationError({'error': 'max_points must be at least 2'})
+    if filters['time_min'] is not None or filters['time_max'] is not None:
+        raise ValidationError({'error': 'start_time and end_time are not supported with max_points'})
+    if filters['sweep'] is not None:
+        raise ValidationError({'error': 'sweep is not supported with max_points'})
+    
+    level, columns = downsample(
+        experiment.trace, max_points, cycle=filters['cycle'], v_min=filters['v_min'], v_max=filters['v_max']
+    )
+    indexes = columns.pop('index')
+    return {
+        'count': len(indexes),
+        'level': level,
+        'results': columns_to_points(columns, indexes=indexes)
+    }
+
+
+def export_response(experiment, params, stream=None):
+    """
+    导出实验数据的流式响应，format 为 csv、json、npz 或 parquet
+    
+    stream 用于包装导出生成器，异步视图传入异步迭代器的包装函数。
+    """
+    format_type = params.get('format', 'json')
+    store = experiment.trace.where(**range_filters(params))
+    filename = f'experiment_{experiment.id}.{format_type}'
+    
+    if format_type == 'csv':
+        content, content_type = exporters.iter_csv(store), 'text/csv'
+    elif format_type == 'json':
+        content, content_type = exporters.iter_json(ExperimentSerializer(experiment).data, store), 'application/json'
+        filename = None
+    elif format_type == 'npz':
+        content, content_type = exporters.iter_npz(store), 'application/octet-stream'
+    elif format_type == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValidationError({'error': 'Parquet export requires pyarrow'})
+        content, content_type = exporters.iter_parquet(store), 'application/vnd.apache.parquet'
+    else:
+        raise ValidationError({'error': 'Unsupported format. Use "csv", "json", "npz" or "parquet"'})
+    
+    response = StreamingHttpResponse(stream(content) if stream else content, content_type=content_type)
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def generate_analysis_results(experiment):
+    """由增量统计摘要和分段索引生成分析结果"""
+    experiment.refresh_from_db(fields=['trace_summary', 'trace_segments', 'data_points_count'])
+    summary = report(experiment.trace_summary)
+    
+    if not summary['count']:
+        return
+    
+    # 升级前写入的实验没有完整的分段索引，此时重新建立
+    index = experiment.trace_segments
+    if index.get('length') != experiment.data_points_count:
+        index = experiment.trace.build_segments()
+        Experiment.objects.filter(pk=experiment.pk).update(trace_segments=index)
+        experiment.trace_segments = index
+    
+    ExperimentResult.objects.update_or_create(
+        experiment=experiment,
+        defaults={
+            'peak_current': summary['peak_current'],
+            'peak_voltage': summary['peak_voltage'],
+            'max_current': summary['current']['max'],
+            'min_current': summary['current']['min'],
+            'avg_current': summary['current']['mean'],
+            'analysis_data': {
+                'total_points': summary['count'],
+                'voltage_range': summary['voltage_range'],
+                'current_range': [summary['current']['min'], summary['current']['max']],
+                'current_std': summary['current']['std'],
+                'cycles': summary['cycles'],
+            },
+            'segments': segments_report(index),
+        }
+    )
+
+
+@shared_task
+def finalize_experiment_task(experiment_id):
+    """
+    Celery任务：停止实验后的收尾
+    
+    合并采集过程中逐批写入的小分块，构建图表用的降采样层级，并生成分析结果。
+    """
+    experiment = Experiment.objects.filter(pk=experiment_id, status='completed').first()
+    if experiment is None:
+        return
+    experiment.trace.compact()
+    build_pyramid(experiment.trace)
+    generate_analysis_results(experiment)
+    # 分段索引可能在上面重建（以 update 写入，不触发信号），已缓存的分段响应随之失效
+    invalidate_experiment(experiment)
+
+
 class ExperimentViewSet(viewsets.ModelViewSet):
     """实验管理视图集"""
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Experiment.objects.filter(user=self.request.user)
+        queryset = Experiment.objects.filter(user=self.request.user).select_related('user')
+        if self.action == 'list':
+            # 列表不包含统计摘要和元数据
+            queryset = queryset.defer('trace_summary', 'metadata', 'trace_segments')
+        return queryset
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -34,6 +183,14 @@ class ExperimentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
     
+    def retrieve(self, request, *args, **kwargs):
+        """实验详情，未变化时返回 304"""
+        experiment = self.get_object()
+        validators = experiment_validators(experiment)
+        return not_modified(request, validators) or set_validators(
+            Response(self.get_serializer(experiment).data), validators
+        )
+    
     @action(detail=True, methods=['post'])
     def start(self, request, pk=None):
         """开始实验"""
@@ -46,7 +203,7 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         
         experiment.status = 'running'
         experiment.started_at = timezone.now()
-        experiment.save()
+        experiment.save(update_fields=['status', 'started_at', 'updated_at'])
         
         return Response({
             'message': 'Experiment started successfully',
@@ -65,10 +222,10 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         
         experiment.status = 'completed'
         experiment.completed_at = timezone.now()
-        experiment.save()
+        experiment.save(update_fields=['status', 'completed_at', 'updated_at'])
         
-        # 生成分析结果
-        self._generate_analysis_results(experiment)
+        # 分块合并、降采样层级和分析结果与曲线长度成正比，提交后交给任务执行后端
+        transaction.on_commit(lambda: get_executor().call(finalize_experiment_task, experiment.pk))
         
         return Response({
             'message': 'Experiment stopped successfully',
@@ -86,128 +243,88 @@ class ExperimentViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         experiment.status = 'cancelled'
-        experiment.save()
+        experiment.save(update_fields=['status', 'updated_at'])
         
         return Response({
             'message': 'Experiment cancelled successfully',
             'experiment': ExperimentSerializer(experiment).data
         })
     
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'],
+            parser_classes=api_settings.DEFAULT_PARSER_CLASSES + [TraceColumnsParser])
     def add_data_points(self, request, pk=None):
-        """添加数据点"""
+        """
+        添加数据点
+        
+        批次键由请求体的 batch_id 或 Idempotency-Key 请求头给出，重试已写入的批次时
+        不重复写入，响应中 duplicate 为 true；同一批次键对应不同数据时返回 409。
+        """
         experiment = self.get_object()
+        batch_id = request.headers.get('Idempotency-Key') or None
+        
+        # 二进制列数据直接按列写入，不经过逐点校验
+        if request.content_type.split(';')[0].strip() == TraceColumnsParser.media_type:
+            if batch_id is not None and len(batch_id) > 64:
+                return Response({
+                    'batch_id': ['Ensure this field has no more than 64 characters.']
+                }, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                created_count, duplicate = experiment.trace.append_batch(request.data, batch_id)
+            except BatchConflict as e:
+                return Response({'batch_id': [str(e)]}, status=status.HTTP_409_CONFLICT)
+            except ValueError as e:
+                return Response({'data_points': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({
+                'message': f'Added {created_count} data points',
+                'created_count': created_count,
+                'duplicate': duplicate
+            })
         
-        serializer = DataPointBatchSerializer(data=request.data)
+        data = request.data
+        if batch_id is not None and 'batch_id' not in data:
+            data = data.copy()
+            data['batch_id'] = batch_id
+        serializer = DataPointBatchSerializer(data=data)
         if serializer.is_valid():
-            result = serializer.save()
+            try:
+                result = serializer.save(experiment=experiment)
+            except BatchConflict as e:
+                return Response({'batch_id': [str(e)]}, status=status.HTTP_409_CONFLICT)
             return Response({
                 'message': f'Added {result["created_count"]} data points',
-                'created_count': result['created_count']
+                'created_count': result['created_count'],
+                'duplicate': result['duplicate']
             })
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['get'])
-    def data_points(self, request, pk=None):
-        """获取实验数据点"""
-        experiment = self.get_object()
-        data_points = experiment.data_points.all()
-        
-        # 分页
-        page = self.paginate_queryset(data_points)
-        if page is not None:
-            serializer = ExperimentDataPointSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = ExperimentDataPointSerializer(data_points, many=True)
-        return Response(serializer.data)
+    def statistics(self, request, pk=None):
+        """获取实验数据统计，运行中的实验也会实时更新"""
+        return self._completed_cached('statistics', pk, lambda experiment: report(experiment.trace_summary))
     
     @action(detail=True, methods=['get'])
-    def export(self, request, pk=None):
-        """导出实验数据"""
-        experiment = self.get_object()
-        format_type = request.query_params.get('format', 'json')
-        
-        if format_type == 'csv':
-            return self._export_csv(experiment)
-        elif format_type == 'json':
-            return self._export_json(experiment)
-        else:
-            return Response({
-                'error': 'Unsupported format. Use "csv" or "json"'
-            }, status=status.HTTP_400_BAD_REQUEST)
-    
-    def _export_json(self, experiment):
-        """导出JSON格式数据"""
-        serializer = ExperimentSerializer(experiment)
-        return Response(serializer.data)
+    def segments(self, request, pk=None):
+        """获取循环与扫描方向的分段索引，运行中的实验也会实时更新"""
+        return self._completed_cached('segments', pk, lambda experiment: segments_report(experiment.trace_segments))
     
-    def _export_csv(self, experiment):
-        """导出CSV格式数据"""
-        import csv
-        from django.http import HttpResponse
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="experiment_{experiment.id}.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Timestamp', 'Voltage (V)', 'Current (A)', 'Cycle', 'Temperature (°C)', 'pH'])
-        
-        for point in experiment.data_points.all():
-            writer.writerow([
-                point.timestamp.isoformat(),
-                point.voltage,
-                point.current,
-                point.cycle,
-                point.temperature or '',
-                point.ph or ''
-            ])
-        
-        return response
+    def _completed_cached(self, name, pk, build):
+        """已完成实验的响应数据按实验缓存，命中时不查询数据库；其他状态的实验每次重新生成"""
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+        entry = Entry(name, [experiment_namespace(pk)], (self.request.user.pk, pk))
+        data = entry.get()
+        if data is None:
+            experiment = self.get_object()
+            data = build(experiment)
+            if experiment.status == 'completed':
+                entry.set(data)
+        return Response(data)
     
-    def _generate_analysis_results(self, experiment):
-        """生成分析结果"""
-        data_points = experiment.data_points.all()
-        
-        if not data_points.exists():
-            return
-        
-        # 计算基本统计
-        currents = [point.current for point in data_points]
-        voltages = [point.voltage for point in data_points]
-        
-        max_current = max(currents)
-        min_current = min(currents)
-        avg_current = sum(currents) / len(currents)
-        
-        # 找到峰值
-        peak_index = currents.index(max_current)
-        peak_voltage = voltages[peak_index]
-        
-        # 创建或更新结果
-        result, created = ExperimentResult.objects.get_or_create(
-            experiment=experiment,
-            defaults={
-                'peak_current': max_current,
-                'peak_voltage': peak_voltage,
-                'max_current': max_current,
-                'min_current': min_current,
-                'avg_current': avg_current,
-                'analysis_data': {
-                    'total_points': len(currents),
-                    'voltage_range': [min(voltages), max(voltages)],
-                    'current_range': [min_current, max_current],
-                }
-            }
-        )
-        
-        if not created:
-            result.peak_current = max_current
-            result.peak_voltage = peak_voltage
-            result.max_current = max_current
-            result.min_current = min_current
-            result.avg_current = avg_current
-            result.save()
+    def perform_content_negotiation(self, request, force=False):
+        # 导出（见 async_views.experiment_export）的 format 参数指导出文件格式，协商不到渲染器时使用默认渲染器
+        return super().perform_content_negotiation(request, force=force or self.action == 'export')
 
 
 class DeviceViewSet(viewsets.ModelViewSet):
@@ -230,16 +347,18 @@ class DeviceViewSet(viewsets.ModelViewSet):
         })
 
 
-class ExperimentTemplateViewSet(viewsets.ModelViewSet):
-    """实验模板管理视图集"""
+class ExperimentTemplateViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    """实验模板管理视图集，列表和详情按用户缓存"""
     serializer_class = ExperimentTemplateSerializer
     permission_classes = [IsAuthenticated]
+    cache_namespace = TEMPLATES_NAMESPACE
+    cache_per_user = True
     
     def get_queryset(self):
         # 返回用户自己的模板和公开的模板
         return ExperimentTemplate.objects.filter(
             Q(user=self.request.user) | Q(is_public=True)
-        )
+        ).select_related('user')
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -277,4 +396,12 @@ class ExperimentResultViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return ExperimentResult.objects.filter(experiment__user=self.request.user)
+        return ExperimentResult.objects.filter(experiment__user=self.request.user).select_related('experiment')
+    
+    def retrieve(self, request, *args, **kwargs):
+        """实验结果详情，未变化时返回 304"""
+        result = self.get_object()
+        validators = result_validators(result)
+        return not_modified(request, validators) or set_validators(
+            Response(self.get_serializer(result).data), validators
+        )
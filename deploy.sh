@@ -136,6 +136,10 @@ configure_webserver() {
     ProxyPass /api/ http://127.0.0.1:8000/api/
     ProxyPassReverse /api/ http://127.0.0.1:8000/api/
     
+    # 实验数据实时通道（需要 mod_proxy_wstunnel）
+    ProxyPass /ws/ ws://127.0.0.1:8000/ws/
+    ProxyPassReverse /ws/ ws://127.0.0.1:8000/ws/
+    
     # PWA文件
     <Files "sw.js">
         Header set Service-Worker-Allowed "/"
@@ -198,7 +202,7 @@ User=huang
 Group=huang
 WorkingDirectory=$BACKEND_DIR
 Environment=PATH=$BACKEND_DIR/venv/bin
-ExecStart=$BACKEND_DIR/venv/bin/gunicorn --bind 127.0.0.1:8000 electrochemical.wsgi:application
+ExecStart=$BACKEND_DIR/venv/bin/daphne --bind 127.0.0.1 --port 8000 electrochemical.asgi:application
 Restart=always
 RestartSec=10
 